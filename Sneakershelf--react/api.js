@@ -155,6 +155,17 @@ export const CartAPI = {
             method: 'POST'
         });
     },
+
+    // Apply several changes at once, e.g.
+    // [{op: 'add', product_id: 3, size_id: 7, quantity: 2}, {op: 'remove', item_id: 12}]
+    batch: async (operations) => {
+        return apiRequest('/cart/batch/', {
+            method: 'POST',
+            body: JSON.stringify({
+                operations: operations
+            })
+        });
+    },
 };
 
 // ==================== REVIEWS API ====================
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class CartConfig(AppConfig):
     name = 'cart'
+
+    def ready(self):
+        from .purge import start_scheduler
+        from .storage import start_flusher
+        start_scheduler()
+        start_flusher()
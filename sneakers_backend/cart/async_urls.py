@@ -0,0 +1,7 @@
+from django.urls import path
+
+from . import async_views
+
+urlpatterns = [
+    path('count/', async_views.cart_count, name='async-cart-count'),
+]
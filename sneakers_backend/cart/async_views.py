@@ -0,0 +1,19 @@
+"""
+Async variant of the cart badge count, served under ``/api/async/cart/``;
+see ``sneakers_backend.async_api``.
+"""
+
+from sneakers_backend.async_api import async_api_view, json_response
+from .identity import cart_key
+from .storage import cart_storage
+
+
+@async_api_view
+async def cart_count(request):
+    """
+    Item count of the visitor's cart. Like ``/api/cart/count/`` this never
+    creates a cart: no cart means a count of 0.
+    """
+    key = cart_key(request)
+    count = await cart_storage().acount(key) if key else 0
+    return json_response({'count': count})
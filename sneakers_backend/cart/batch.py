@@ -0,0 +1,171 @@
+"""
+Batched cart changes for ``POST /api/cart/batch/``.
+
+The body is ``{"operations": [...]}``, each operation one of::
+
+    {"op": "add", "product_id": 3, "size_id": 7, "quantity": 2}
+    {"op": "update", "item_id": 12, "quantity": 1}
+    {"op": "remove", "item_id": 12}
+    {"op": "clear"}
+
+with the same fields as the single-item endpoints.  ``plan_operations`` replays the
+operations against the cart's current lines and checks the resulting
+quantity of every line they touch against stock, reading all products and
+sizes involved in one query, so nothing is written unless the whole batch
+is valid.  The view then runs ``apply_operations`` inside one
+``cart_storage().open`` block: one transaction, or one cache write.
+"""
+
+from django.conf import settings
+
+from .storage import Unavailable, stock_levels
+
+
+OPERATIONS = ('add', 'update', 'remove', 'clear')
+
+
+class BatchError(Exception):
+    """An invalid operation; ``index`` is its position in the batch"""
+
+    def __init__(self, message, index=None):
+        super().__init__(message)
+        self.message = message
+        self.index = index
+
+    def as_data(self):
+        data = {'error': self.message}
+        if self.index is not None:
+            data['operation'] = self.index
+        return data
+
+
+def _positive_int(value, name, index, default=None):
+    if value is None and default is not None:
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise BatchError(f'Invalid {name}', index)
+    if value < 1:
+        raise BatchError(f'{name.capitalize()} must be at least 1', index)
+    return value
+
+
+def parse_operations(data):
+    """Validate the shape of the request body into a list of dicts"""
+    operations = data.get('operations') if hasattr(data, 'get') else None
+    if not isinstance(operations, list) or not operations:
+        raise BatchError('operations must be a non-empty list')
+    limit = getattr(settings, 'CART_BATCH_MAX_OPERATIONS', 50)
+    if len(operations) > limit:
+        raise BatchError(f'At most {limit} operations per request')
+
+    parsed = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in OPERATIONS:
+            raise BatchError(f'op must be one of {", ".join(OPERATIONS)}', index)
+        op = operation['op']
+        if op == 'add':
+            if not operation.get('product_id'):
+                raise BatchError('product_id is required', index)
+            size_id = operation.get('size_id')
+            parsed.append({
+                'op': op,
+                'product_id': _positive_int(operation['product_id'], 'product_id', index),
+                'size_id': _positive_int(size_id, 'size_id', index) if size_id else None,
+                'quantity': _positive_int(operation.get('quantity'), 'quantity', index, default=1),
+            })
+        elif op in ('update', 'remove'):
+            if not operation.get('item_id'):
+                raise BatchError('item_id is required', index)
+            entry = {'op': op, 'item_id': _positive_int(operation['item_id'], 'item_id', index)}
+            if op == 'update':
+                if operation.get('quantity') is None:
+                    raise BatchError('quantity is required', index)
+                entry['quantity'] = _positive_int(operation['quantity'], 'quantity', index)
+            parsed.append(entry)
+        else:
+            parsed.append({'op': op})
+    return parsed
+
+
+def plan_operations(items, operations):
+    """
+    Check ``operations`` against the cart's ``items`` (``CartItem``
+    instances) and stock, raising ``BatchError`` for the first problem.
+    Returns the operations with each ``update``/``remove`` bound to its
+    item as ``item``.
+    """
+    lines = {(item.product_id, item.size_id): item.quantity for item in items}
+    by_id = {item.id: item for item in items}
+    removed = set()
+    touched = {}  # (product_id, size_id) -> index of the last operation on it
+
+    product_ids = {item.product_id for item in items}
+    size_ids = {item.size_id for item in items if item.size_id}
+    for operation in operations:
+        if operation['op'] == 'add':
+            product_ids.add(operation['product_id'])
+            if operation['size_id']:
+                size_ids.add(operation['size_id'])
+    products, sizes = stock_levels(product_ids, size_ids)
+
+    for index, operation in enumerate(operations):
+        op = operation['op']
+        if op == 'add':
+            product = products.get(operation['product_id'])
+            if product is None or not product[0]:
+                raise BatchError('Product not found', index)
+            size_id = operation['size_id']
+            if size_id and sizes.get(size_id, (None,))[0] != operation['product_id']:
+                raise BatchError('Size not found', index)
+            line = (operation['product_id'], size_id)
+            lines[line] = lines.get(line, 0) + operation['quantity']
+            touched[line] = index
+        elif op == 'clear':
+            lines.clear()
+            removed.update(by_id)
+        else:
+            item = by_id.get(operation['item_id'])
+            if item is None or item.id in removed:
+                raise BatchError('Cart item not found', index)
+            operation['item'] = item
+            line = (item.product_id, item.size_id)
+            if op == 'remove':
+                lines.pop(line, None)
+                removed.add(item.id)
+            else:
+                lines[line] = operation['quantity']
+                touched[line] = index
+
+    # Every line left with a quantity the batch changed must be in stock
+    for line, index in touched.items():
+        if line not in lines:
+            continue
+        product_id, size_id = line
+        quantity = lines[line]
+        if size_id and sizes[size_id][1] < quantity:
+            raise BatchError('Insufficient stock for selected size', index)
+        if products[product_id][1] < quantity:
+            raise BatchError('Insufficient stock', index)
+    return operations
+
+
+def apply_operations(storage, cart, operations):
+    """Apply planned operations to a cart opened with ``storage.open``"""
+    for index, operation in enumerate(operations):
+        op = operation['op']
+        if op == 'add':
+            try:
+                # Stock was checked for the batch as a whole
+                storage.add_item(
+                    cart, operation['product_id'], operation['size_id'],
+                    operation['quantity'], check_stock=False)
+            except Unavailable as exc:
+                raise BatchError(exc.message, index)
+        elif op == 'update':
+            storage.set_quantity(cart, operation['item'], operation['quantity'])
+        elif op == 'remove':
+            storage.remove_item(cart, operation['item'])
+        else:
+            storage.clear(cart)
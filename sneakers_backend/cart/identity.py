@@ -0,0 +1,77 @@
+"""
+Which cart a request belongs to.
+
+With ``CART_IDENTITY = 'cookie'`` (the default) a guest's cart key is a
+random string kept in a signed cookie, ``CART_COOKIE_NAME``.  Nothing is
+stored server side for it beyond the cart itself, so browsing the catalog
+or reading the cart writes nothing, and the key is only minted when the
+visitor first changes their cart.  The cookie is re-issued on every cart
+change, so it expires ``CART_COOKIE_AGE`` seconds after the last one.
+
+``CART_IDENTITY = 'session'`` keys carts by the Django session instead, as
+before; every change then needs a session, and with
+``SESSION_SAVE_EVERY_REQUEST`` every request of that visitor rewrites its
+``django_session`` row.
+
+The key is also the ``session_key`` of the ``Cart`` row (see
+cart.storage); it never appears in responses.
+"""
+
+from django.conf import settings
+from django.utils.crypto import get_random_string
+
+
+SALT = 'cart.identity'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def uses_session():
+    return _setting('CART_IDENTITY', 'cookie') == 'session'
+
+
+def cookie_name():
+    return _setting('CART_COOKIE_NAME', 'cart')
+
+
+def cart_key(request, create=False):
+    """
+    The key of the request's cart, or None when it has none yet.  With
+    ``create`` a key is assigned instead; call ``remember`` on the
+    response to hand it to the client.
+    """
+    key = getattr(request, '_cart_key', None)
+    if key is not None:
+        return key
+
+    if uses_session():
+        key = request.session.session_key
+        if not key and create:
+            request.session.create()
+            key = request.session.session_key
+    else:
+        key = request.get_signed_cookie(
+            cookie_name(), default=None, salt=SALT,
+            max_age=_setting('CART_COOKIE_AGE', 14 * 86400))
+        if not key and create:
+            key = get_random_string(32)
+    if key and create:
+        request._cart_key = key
+    return key
+
+
+def remember(request, response):
+    """Set (or renew) the cart cookie for a key assigned by ``cart_key``"""
+    key = getattr(request, '_cart_key', None)
+    if key is None or uses_session() or response.status_code >= 400:
+        return response
+    response.set_signed_cookie(
+        cookie_name(), key, salt=SALT,
+        max_age=_setting('CART_COOKIE_AGE', 14 * 86400),
+        domain=settings.SESSION_COOKIE_DOMAIN,
+        secure=settings.SESSION_COOKIE_SECURE,
+        httponly=True,
+        samesite=settings.SESSION_COOKIE_SAMESITE)
+    return response
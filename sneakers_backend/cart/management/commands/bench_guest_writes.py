@@ -0,0 +1,103 @@
+import random
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+
+from products.models import Product
+
+
+WRITE = re.compile(r'^\s*(?:INSERT INTO|UPDATE|DELETE FROM)\s+"?(\w+)"?', re.I)
+
+# (label, CART_IDENTITY, SESSION_SAVE_EVERY_REQUEST)
+MODES = [
+    ('session cart, session saved every request', 'session', True),
+    ('signed cart cookie', 'cookie', False),
+]
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Count database writes per 1,000 anonymous page views with guest '
+        'carts keyed by the session (saved on every request, as before) and '
+        'by the signed cart cookie. A page view is a catalog request plus the '
+        "header's cart badge; some visitors add a product to their cart. "
+        'Everything runs in a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--views', type=int, default=1000, help='Page views per mode (default: 1000)')
+        parser.add_argument(
+            '--pages', type=int, default=10,
+            help='Page views per visitor (default: 10)')
+        parser.add_argument(
+            '--shoppers', type=float, default=0.3,
+            help='Share of visitors who add to their cart on their first page (default: 0.3)')
+
+    def handle(self, *args, **options):
+        if min(options['views'], options['pages']) < 1:
+            raise CommandError('--views and --pages must be positive')
+        if not 0 <= options['shoppers'] <= 1:
+            raise CommandError('--shoppers must be between 0 and 1')
+        slugs = list(
+            Product.objects.filter(is_available=True).order_by('-created_at')
+            .values_list('slug', flat=True)[:200])
+        ids = list(Product.objects.filter(slug__in=slugs).values_list('id', flat=True))
+        if not slugs:
+            raise CommandError('No products to browse; import a catalog first')
+
+        self.stdout.write(
+            f"{options['views']} page views, {options['pages']} per visitor, "
+            f"{options['shoppers']:.0%} of visitors add to their cart")
+        for label, identity, save_every_request in MODES:
+            with override_settings(
+                    CART_IDENTITY=identity, SESSION_SAVE_EVERY_REQUEST=save_every_request,
+                    DATABASE_REPLICAS=[],
+                    ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                tables = self.run(random.Random(0), slugs, ids, options)
+            per_thousand = sum(tables.values()) * 1000 / options['views']
+            self.stdout.write(f'  {label:<44} {per_thousand:8.1f} writes per 1,000 views')
+            for table, count in tables.most_common():
+                self.stdout.write(f'    {table:<42} {count:8}')
+
+    def run(self, rng, slugs, ids, options):
+        """Writes by table for ``views`` page views"""
+        tables = Counter()
+
+        def count_writes(execute, sql, params, many, context):
+            match = WRITE.match(sql)
+            if match:
+                tables[match.group(1)] += 1
+            return execute(sql, params, many, context)
+
+        try:
+            with transaction.atomic(), connection.execute_wrapper(count_writes):
+                self.browse(rng, slugs, ids, options)
+                raise _Rollback
+        except _Rollback:
+            pass
+        return tables
+
+    def browse(self, rng, slugs, ids, options):
+        client = None
+        for view in range(options['views']):
+            if view % options['pages'] == 0:
+                client = Client()
+                if rng.random() < options['shoppers']:
+                    client.post(
+                        '/api/cart/add/', {'product_id': rng.choice(ids)},
+                        content_type='application/json')
+            page = rng.choice([
+                '/api/products/', '/api/products/featured/',
+                f'/api/products/{rng.choice(slugs)}/', '/api/cart/',
+            ])
+            client.get(page)
+            client.get('/api/cart/count/')
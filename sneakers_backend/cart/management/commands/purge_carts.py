@@ -0,0 +1,48 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cart.purge import purge_carts
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete guest carts not changed for a while, with their items, and '
+        'expired sessions, in small keyset batches. Safe to run while the '
+        'site is serving; see cart.purge.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=float,
+            help='Delete carts idle for this many days '
+                 '(default: CART_PURGE_AFTER, else the cart cookie lifetime)')
+        parser.add_argument(
+            '--batch-size', type=int,
+            help='Rows deleted per transaction (default: CART_PURGE_BATCH_SIZE)')
+        parser.add_argument(
+            '--pause', type=float, default=0.0,
+            help='Milliseconds to sleep between batches (default: 0)')
+        parser.add_argument(
+            '--keep-sessions', action='store_true',
+            help='Leave expired sessions alone')
+
+    def handle(self, *args, **options):
+        if options['days'] is not None and options['days'] < 0:
+            raise CommandError('--days must not be negative')
+        if options['batch_size'] is not None and options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        older_than = (
+            datetime.timedelta(days=options['days']) if options['days'] is not None else None)
+
+        result = purge_carts(
+            older_than=older_than, batch_size=options['batch_size'],
+            sessions=not options['keep_sessions'], pause=options['pause'] / 1000)
+
+        self.stdout.write(f'  carts       {result.carts:10,}')
+        self.stdout.write(f'  cart items  {result.items:10,}')
+        if not options['keep_sessions']:
+            self.stdout.write(f'  sessions    {result.sessions:10,}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Removed {result.rows:,} rows in {result.batches} batches, '
+            f'{result.seconds:.2f}s ({result.rows_per_second:,.0f} rows/s)'))
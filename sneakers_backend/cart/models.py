@@ -5,17 +5,38 @@ class Cart(models.Model):
     session_key = models.CharField(max_length=40, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Sum of the items' quantities for the header badge, recounted by the
+    # cart storage whenever the items change
+    item_total = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Keyset order of cart purges (see cart.purge)
+            models.Index(fields=['updated_at', 'id'], name='cart_updated'),
+        ]
 
     def __str__(self):
         return f"Cart {self.session_key}"
 
+    @property
+    def item_list(self):
+        """Items as loaded by the cart storage (see cart.storage)"""
+        item_list = getattr(self, '_item_list', None)
+        if item_list is None:
+            return list(self.items.all())
+        return item_list
+
     @property
     def total_price(self):
-        return sum(item.subtotal for item in self.items.all())
+        return sum(item.subtotal for item in self.item_list)
 
     @property
     def total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return sum(item.quantity for item in self.item_list)
+
+    @property
+    def item_count(self):
+        return len(self.item_list)
 
 
 class CartItem(models.Model):
@@ -24,13 +45,25 @@ class CartItem(models.Model):
     size = models.ForeignKey(Size, on_delete=models.CASCADE, null=True, blank=True)
     quantity = models.IntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ['cart', 'product', 'size']
+        constraints = [
+            # NULLs never conflict, so lines without a size need their own
+            # unique index (the conflict target of the cart add upsert)
+            models.UniqueConstraint(
+                fields=['cart', 'product'], condition=models.Q(size__isnull=True),
+                name='cartitem_unique_without_size'),
+        ]
 
     def __str__(self):
         return f"{self.product.name} x {self.quantity}"
 
+    @property
+    def unit_price(self):
+        return self.product.final_price
+
     @property
     def subtotal(self):
-        return self.product.final_price * self.quantity
\ No newline at end of file
+        return self.unit_price * self.quantity
@@ -0,0 +1,153 @@
+"""
+Deleting abandoned guest carts and expired sessions.
+
+Every visitor who changes their cart leaves a ``Cart`` row and its
+``CartItem`` rows behind, and sessions outlive their expiry until someone
+removes them.  ``purge_carts`` deletes carts not changed for
+``CART_PURGE_AFTER`` seconds (by default the cart cookie's lifetime, after
+which no client can reach them) and sessions past their ``expire_date``.
+
+Both walk their table in ``updated_at`` / ``expire_date`` order by keyset,
+deleting at most ``CART_PURGE_BATCH_SIZE`` rows per transaction, so a purge
+of millions of rows never holds a write lock for long and never re-scans
+what it has already passed.
+
+``manage.py purge_carts`` runs a purge; with ``CART_PURGE_INTERVAL`` set,
+each process also runs one in a background thread every that many seconds
+(see ``start_scheduler``).
+"""
+
+import datetime
+import logging
+import threading
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Cart, CartItem
+
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+@dataclass
+class PurgeResult:
+    carts: int = 0
+    items: int = 0
+    sessions: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows(self):
+        return self.carts + self.items + self.sessions
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def _keyset(queryset, field, batch_size):
+    """
+    Yield lists of at most ``batch_size`` primary keys from ``queryset`` in
+    ``(field, pk)`` order, each page starting after the last one
+    """
+    pk = queryset.model._meta.pk.name
+    last = None
+    while True:
+        page = queryset
+        if last is not None:
+            page = page.filter(
+                Q(**{f'{field}__gt': last[0]}) | Q(**{field: last[0], f'{pk}__gt': last[1]}))
+        rows = list(page.order_by(field, pk).values_list(field, pk)[:batch_size])
+        if not rows:
+            return
+        yield [row[1] for row in rows]
+        if len(rows) < batch_size:
+            return
+        last = rows[-1]
+
+
+def purge_carts(older_than=None, batch_size=None, sessions=True, pause=0.0):
+    """
+    Delete carts idle for ``older_than`` (a timedelta) and, with
+    ``sessions``, expired sessions; ``pause`` seconds between batches give
+    other writers a turn.  Returns a ``PurgeResult``.
+    """
+    if older_than is None:
+        older_than = datetime.timedelta(seconds=_setting(
+            'CART_PURGE_AFTER', _setting('CART_COOKIE_AGE', 14 * 86400)))
+    batch_size = batch_size or _setting('CART_PURGE_BATCH_SIZE', 500)
+    now = timezone.now()
+    result = PurgeResult()
+    started = time.perf_counter()
+
+    cutoff = now - older_than
+    for ids in _keyset(Cart.objects.filter(updated_at__lt=cutoff), 'updated_at', batch_size):
+        with transaction.atomic():
+            # A cart changed since it was listed is kept
+            _, deleted = Cart.objects.filter(id__in=ids, updated_at__lt=cutoff).delete()
+        result.carts += deleted.get(Cart._meta.label, 0)
+        result.items += deleted.get(CartItem._meta.label, 0)
+        result.batches += 1
+        if pause:
+            time.sleep(pause)
+
+    if sessions:
+        expired = Session.objects.filter(expire_date__lt=now)
+        for keys in _keyset(expired, 'expire_date', batch_size):
+            deleted, _ = Session.objects.filter(
+                session_key__in=keys, expire_date__lt=now).delete()
+            result.sessions += deleted
+            result.batches += 1
+            if pause:
+                time.sleep(pause)
+
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def _run_scheduler(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            result = purge_carts()
+        except Exception:
+            logger.exception('Scheduled cart purge failed')
+            continue
+        finally:
+            close_old_connections()
+        if result.rows:
+            logger.info(
+                'Purged %d carts, %d items and %d sessions in %.1fs',
+                result.carts, result.items, result.sessions, result.seconds)
+
+
+def start_scheduler():
+    """
+    Purge every ``CART_PURGE_INTERVAL`` seconds in a daemon thread, once per
+    process; does nothing when the interval is None
+    """
+    global _scheduler
+    interval = _setting('CART_PURGE_INTERVAL', None)
+    if interval is None:
+        return None
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = threading.Thread(
+                target=_run_scheduler, args=(interval,), name='cart-purge', daemon=True)
+            _scheduler.start()
+    return _scheduler
@@ -1,10 +1,40 @@
 from rest_framework import serializers
 from .models import Cart, CartItem
-from products.serializers import ProductListSerializer, SizeSerializer
+from products.images import variant_urls
+from products.models import Product
+from products.serializers import SizeSerializer, media_url_builder
+
+
+class CartProductSerializer(serializers.ModelSerializer):
+    """
+    What the cart shows of a product. Reads only the product row, its
+    brand and the ``primary_image_*`` columns added by the cart storage,
+    so rendering costs no queries.
+    """
+    brand_name = serializers.CharField(source='brand.name', read_only=True)
+    primary_image = serializers.SerializerMethodField()
+    primary_image_variants = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = [
+            'id', 'name', 'slug', 'price', 'discount_price', 'final_price',
+            'discount_percentage', 'brand_name', 'stock', 'is_available',
+            'primary_image', 'primary_image_variants',
+        ]
+
+    def get_primary_image(self, obj):
+        if obj.primary_image_name:
+            return media_url_builder(self.context)(obj.primary_image_name)
+        return None
+
+    def get_primary_image_variants(self, obj):
+        return variant_urls(
+            obj.primary_image_variants or {}, media_url_builder(self.context))
 
 
 class CartItemSerializer(serializers.ModelSerializer):
-    product = ProductListSerializer(read_only=True)
+    product = CartProductSerializer(read_only=True)
     size = SizeSerializer(read_only=True)
     subtotal = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     unit_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
@@ -18,7 +48,7 @@ class CartItemSerializer(serializers.ModelSerializer):
 
 
 class CartSerializer(serializers.ModelSerializer):
-    items = CartItemSerializer(many=True, read_only=True)
+    items = CartItemSerializer(many=True, read_only=True, source='item_list')
     total_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     total_items = serializers.IntegerField(read_only=True)
     item_count = serializers.IntegerField(read_only=True)
@@ -0,0 +1,692 @@
+"""
+Pluggable storage for shopping carts.
+
+``CART_STORAGE`` names the backend:
+
+* ``cart.storage.DatabaseCartStorage`` (the default) keeps carts as
+  ``Cart``/``CartItem`` rows, as before;
+* ``cart.storage.CacheCartStorage`` keeps each cart as one entry in the
+  ``CART_CACHE_ALIAS`` cache, so adding to or reading a guest cart writes
+  no rows.  Carts changed in this process are written behind to the
+  database every ``CART_PERSIST_INTERVAL`` seconds by a background thread
+  (see ``start_flusher``) and at exit, and a cart is always written before
+  checkout by ``materialize``; with the interval set to None rows are only
+  created at checkout.  An entry missing from the cache is reloaded from
+  the last persisted rows.  The cache must be shared by every process that
+  serves the shop (Redis, Memcached, the database cache): with a
+  local-memory cache each worker process would see its own copy of a cart.
+
+Carts are identified by a key (see cart.identity).  Both backends hand out
+``Cart`` instances whose ``item_list`` holds ``CartItem`` instances, which
+is what the cart serializer renders; call ``load_items`` first so their
+products and sizes are fetched in bulk.  Cache carts are unsaved
+instances: ``Cart.id`` is the id of the persisted row, or None until the
+first write, and item ids are numbered within the cart.
+
+Changes go through ``open``, which holds the cart for the duration of the
+block and saves it at the end, unless the block raises::
+
+    with cart_storage().open(key) as cart:
+        cart_storage().add_item(cart, product.id, size.id, 2)
+"""
+
+import atexit
+import contextlib
+import hashlib
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections, connection, transaction
+from django.db.models import (
+    F, FilteredRelation, JSONField, OuterRef, Prefetch, Q, Subquery, Sum,
+    prefetch_related_objects,
+)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from products.models import Product, ProductImage, Size
+from .models import Cart, CartItem
+
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _item_id(item_id):
+    try:
+        return int(item_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def _primary_image(product_ref):
+    """Subqueries for the name and variants of a product's primary image"""
+    # Same choice as ProductListSerializer: the primary image, else the first
+    images = ProductImage.objects.filter(
+        product=product_ref).order_by('-is_primary', 'created_at')
+    return {
+        'primary_image_name': Subquery(images.values('image')[:1]),
+        'primary_image_variants': Subquery(
+            images.values('variants')[:1], output_field=JSONField()),
+    }
+
+
+def cart_products():
+    """Products with everything the cart product summary renders"""
+    return Product.objects.select_related('brand').annotate(
+        **_primary_image(OuterRef('pk')))
+
+
+def cart_items_prefetch():
+    """
+    Cart items with everything the cart serializer renders, in one query:
+    products, brands and sizes are joined and the primary image is a
+    subquery
+    """
+    return Prefetch(
+        'items',
+        queryset=CartItem.objects.select_related(
+            'product__brand', 'size'
+        ).annotate(**_primary_image(OuterRef('product_id'))),
+    )
+
+
+def _item_total(cart_ref):
+    """Sum of the quantities of the cart ``cart_ref``'s items, as an expression"""
+    return Coalesce(Subquery(
+        CartItem.objects.filter(cart=cart_ref).order_by().values('cart')
+        .annotate(total=Sum('quantity')).values('total')
+    ), 0)
+
+
+class Unavailable(Exception):
+    """
+    An add the catalog cannot satisfy: ``missing`` for an unknown product
+    or size, else not enough stock
+    """
+
+    def __init__(self, message, missing=False):
+        super().__init__(message)
+        self.message = message
+        self.missing = missing
+
+
+def stock_levels(product_ids, size_ids):
+    """
+    ``(products, sizes)`` for the given ids in one query:
+    ``{product_id: (is_available, stock)}`` and
+    ``{size_id: (product_id, stock)}``
+    """
+    queryset = Product.objects.filter(id__in=product_ids).order_by()
+    if size_ids:
+        rows = queryset.annotate(wanted_size=FilteredRelation(
+            'sizes', condition=Q(sizes__id__in=size_ids),
+        )).values_list('id', 'is_available', 'stock', 'wanted_size__id', 'wanted_size__stock')
+    else:
+        # An empty IN in the join condition would empty the whole result
+        rows = ((*row, None, None) for row in queryset.values_list('id', 'is_available', 'stock'))
+    products, sizes = {}, {}
+    for product_id, is_available, stock, size_id, size_stock in rows:
+        products[product_id] = (is_available, stock)
+        if size_id is not None:
+            sizes[size_id] = (product_id, size_stock)
+    return products, sizes
+
+
+def check_add(product_id, size_id, quantity):
+    """Raise ``Unavailable`` unless a cart line may hold ``quantity``"""
+    products, sizes = stock_levels([product_id], [size_id] if size_id else [])
+    product = products.get(product_id)
+    if product is None or not product[0]:
+        raise Unavailable('Product not found', missing=True)
+    if size_id:
+        size = sizes.get(size_id)
+        if size is None:
+            raise Unavailable('Size not found', missing=True)
+        if size[1] < quantity:
+            raise Unavailable('Insufficient stock for selected size')
+    if product[1] < quantity:
+        raise Unavailable('Insufficient stock')
+
+
+# Backends with INSERT ... ON CONFLICT DO UPDATE ... RETURNING
+UPSERT_VENDORS = ('sqlite', 'postgresql')
+
+
+def _upsert_sql(with_size, check_stock):
+    """
+    Insert a cart line, or add to its quantity, in one statement.  Nothing
+    is written (and no row returned) when the product is unavailable, the
+    size is not the product's or, with ``check_stock``, the line would hold
+    more than either's stock.  Parameters: cart id, quantity, created_at,
+    updated_at, product id[, size id], then the quantity once per stock
+    checked on insert.
+    """
+    qn = connection.ops.quote_name
+    item, product, size = (
+        qn(CartItem._meta.db_table), qn(Product._meta.db_table), qn(Size._meta.db_table))
+    total = f'{item}.quantity + excluded.quantity'
+    if with_size:
+        sql = f"""
+            INSERT INTO {item} (cart_id, quantity, created_at, updated_at, product_id, size_id)
+            SELECT %s, %s, %s, %s, p.id, s.id
+            FROM {product} p JOIN {size} s ON s.product_id = p.id
+            WHERE p.id = %s AND s.id = %s AND p.is_available
+            {'AND p.stock >= %s AND s.stock >= %s' if check_stock else ''}
+            ON CONFLICT (cart_id, product_id, size_id) DO UPDATE
+            SET quantity = {total}, updated_at = excluded.updated_at
+        """
+        checks = [(product, 'product_id'), (size, 'size_id')]
+    else:
+        # Lines without a size are unique by their partial index
+        sql = f"""
+            INSERT INTO {item} (cart_id, quantity, created_at, updated_at, product_id)
+            SELECT %s, %s, %s, %s, p.id
+            FROM {product} p
+            WHERE p.id = %s AND p.is_available
+            {'AND p.stock >= %s' if check_stock else ''}
+            ON CONFLICT (cart_id, product_id) WHERE size_id IS NULL DO UPDATE
+            SET quantity = {total}, updated_at = excluded.updated_at
+        """
+        checks = [(product, 'product_id')]
+    if check_stock:
+        sql += 'WHERE ' + ' AND '.join(
+            f'{total} <= (SELECT stock FROM {table} WHERE id = excluded.{column})'
+            for table, column in checks)
+    return sql + ' RETURNING id, quantity'
+
+
+class DatabaseCartStorage:
+    """Carts as ``Cart``/``CartItem`` rows"""
+
+    def get(self, key):
+        return Cart.objects.filter(session_key=key).first()
+
+    def get_or_create(self, key):
+        cart, created = Cart.objects.get_or_create(session_key=key)
+        return cart
+
+    @contextlib.contextmanager
+    def open(self, key):
+        with transaction.atomic():
+            # Hold the row, so concurrent changes to the cart take turns
+            cart, created = Cart.objects.select_for_update().get_or_create(session_key=key)
+            cart.changed = False
+            yield cart
+            if cart.changed:
+                # Bump updated_at so the cart validators change, and recount
+                # the badge total in the same statement
+                cart.updated_at = timezone.now()
+                Cart.objects.filter(pk=cart.pk).update(
+                    updated_at=cart.updated_at, item_total=_item_total(OuterRef('pk')))
+
+    def load_items(self, cart):
+        """Fetch the cart's items with their products and sizes"""
+        if hasattr(cart, '_prefetched_objects_cache'):
+            cart._prefetched_objects_cache.pop('items', None)
+        prefetch_related_objects([cart], cart_items_prefetch())
+        for item in cart.items.all():
+            item.product.primary_image_name = item.primary_image_name
+            item.product.primary_image_variants = item.primary_image_variants
+        return cart
+
+    def get_item(self, cart, item_id):
+        """The cart's item ``item_id`` with its product and size, or None"""
+        item_id = _item_id(item_id)
+        if item_id is None:
+            return None
+        return CartItem.objects.select_related('product', 'size').filter(
+            id=item_id, cart=cart).first()
+
+    def add_item(self, cart, product_id, size_id, quantity, check_stock=True):
+        """
+        Add ``quantity`` to the cart's line for a product (and size) with a
+        single upsert, raising ``Unavailable`` when the product or size is
+        gone or, with ``check_stock``, the line would exceed their stock
+        """
+        if connection.vendor not in UPSERT_VENDORS:
+            return self._add_item_locked(cart, product_id, size_id, quantity, check_stock)
+        now = CartItem._meta.get_field('updated_at').get_db_prep_value(
+            timezone.now(), connection)
+        params = [cart.pk, quantity, now, now, product_id]
+        if size_id:
+            params.append(size_id)
+        if check_stock:
+            params += [quantity, quantity] if size_id else [quantity]
+        with connection.cursor() as cursor:
+            cursor.execute(_upsert_sql(bool(size_id), check_stock), params)
+            row = cursor.fetchone()
+        if row is None:
+            line = CartItem.objects.filter(
+                cart=cart, product_id=product_id, size_id=size_id).first()
+            check_add(product_id, size_id, quantity + (line.quantity if line else 0))
+            # Stock moved between the upsert and the check
+            raise Unavailable('Insufficient stock')
+        cart.changed = True
+        return CartItem(
+            id=row[0], cart=cart, product_id=product_id, size_id=size_id, quantity=row[1])
+
+    def _add_item_locked(self, cart, product_id, size_id, quantity, check_stock):
+        """``add_item`` for backends without upserts; ``open`` holds the cart row"""
+        line = CartItem.objects.filter(
+            cart=cart, product_id=product_id, size_id=size_id).first()
+        total = quantity + (line.quantity if line else 0)
+        check_add(product_id, size_id, total if check_stock else 0)
+        if line is None:
+            line = CartItem.objects.create(
+                cart=cart, product_id=product_id, size_id=size_id, quantity=quantity)
+        else:
+            CartItem.objects.filter(pk=line.pk).update(
+                quantity=F('quantity') + quantity, updated_at=timezone.now())
+            line.quantity = total
+        cart.changed = True
+        return line
+
+    def set_quantity(self, cart, item, quantity):
+        item.quantity = quantity
+        item.save()
+        cart.changed = True
+
+    def remove_item(self, cart, item):
+        item.delete()
+        cart.changed = True
+
+    def clear(self, cart):
+        cart.items.all().delete()
+        cart.changed = True
+
+    def validators(self, key):
+        """``(tag, updated_at)`` identifying the cart's state, or None"""
+        row = Cart.objects.filter(session_key=key).values_list('id', 'updated_at').first()
+        if row is None:
+            return None
+        return str(row[0]), row[1]
+
+    def count(self, key):
+        """Total quantity in the cart, without creating it"""
+        return Cart.objects.filter(
+            session_key=key).values_list('item_total', flat=True).first() or 0
+
+    async def acount(self, key):
+        return await Cart.objects.filter(
+            session_key=key).values_list('item_total', flat=True).afirst() or 0
+
+    def materialize(self, cart):
+        """The database row of a cart held by ``open``, for checkout"""
+        return cart
+
+    def flush(self):
+        return 0
+
+
+# Cached value for a key known to have no cart, so a visitor without one
+# does not cost a database lookup per request
+_NO_CART = 'none'
+
+
+class CacheCartStorage:
+    """
+    Carts as single cache entries, written behind to the database.
+
+    The entry is a dict with the persisted ``id`` (or None), ``created_at``,
+    ``updated_at``, ``next_item_id`` and ``items``, each item a dict of
+    ``id``, ``product_id``, ``size_id``, ``quantity``, ``created_at`` and
+    ``updated_at``.  Changes to one cart are serialized with a ``cache.add``
+    lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirty = set()
+        _cache_storages.append(self)
+
+    def cache(self):
+        return caches[_setting('CART_CACHE_ALIAS', 'default')]
+
+    def cache_key(self, key):
+        return f'cart:{key}'
+
+    def timeout(self):
+        return _setting('CART_CACHE_TIMEOUT', _setting('SESSION_COOKIE_AGE', 86400))
+
+    @contextlib.contextmanager
+    def _locked(self, key):
+        cache = self.cache()
+        lock_key = self.cache_key(key) + ':lock'
+        lock_timeout = _setting('CART_LOCK_TIMEOUT', 5)
+        # The lock expires on its own, so a crashed holder cannot wedge the cart
+        while not cache.add(lock_key, 1, lock_timeout):
+            time.sleep(0.005)
+        try:
+            yield
+        finally:
+            cache.delete(lock_key)
+
+    def _store(self, key, state):
+        self.cache().set(self.cache_key(key), state, self.timeout())
+
+    def _read(self, key):
+        """The cart's state, from the cache or else the persisted rows"""
+        state = self.cache().get(self.cache_key(key))
+        if state is None:
+            cart = Cart.objects.filter(
+                session_key=key).prefetch_related('items').first()
+            state = self._state_from_row(cart) if cart is not None else _NO_CART
+            self._store(key, state)
+        return state if state != _NO_CART else None
+
+    def _state_from_row(self, cart):
+        items = [
+            {
+                'id': item.id, 'product_id': item.product_id, 'size_id': item.size_id,
+                'quantity': item.quantity, 'created_at': item.created_at,
+                'updated_at': item.updated_at,
+            }
+            for item in sorted(cart.items.all(), key=lambda item: item.id)
+        ]
+        return {
+            'id': cart.id, 'created_at': cart.created_at, 'updated_at': cart.updated_at,
+            'next_item_id': max((item['id'] for item in items), default=0) + 1,
+            'items': items,
+        }
+
+    def _new_state(self):
+        now = timezone.now()
+        return {'id': None, 'created_at': now, 'updated_at': now,
+                'next_item_id': 1, 'items': []}
+
+    def _build(self, key, state):
+        cart = Cart(
+            id=state['id'], session_key=key,
+            created_at=state['created_at'], updated_at=state['updated_at'])
+        cart.state = state
+        cart._item_list = [
+            CartItem(
+                id=item['id'], cart_id=state['id'], product_id=item['product_id'],
+                size_id=item['size_id'], quantity=item['quantity'],
+                created_at=item['created_at'], updated_at=item['updated_at'])
+            for item in state['items']
+        ]
+        return cart
+
+    def get(self, key):
+        state = self._read(key)
+        return self._build(key, state) if state is not None else None
+
+    def get_or_create(self, key):
+        state = self._read(key)
+        if state is None:
+            with self._locked(key):
+                state = self._read(key)
+                if state is None:
+                    state = self._new_state()
+                    self._store(key, state)
+        return self._build(key, state)
+
+    @contextlib.contextmanager
+    def open(self, key):
+        with self._locked(key):
+            state = self._read(key) or self._new_state()
+            cart = self._build(key, state)
+            cart.changed = False
+            yield cart
+            # Reads, failed changes and 404s leave the entry alone
+            if cart.changed:
+                state['updated_at'] = cart.updated_at = timezone.now()
+                self._store(key, state)
+                self._mark_dirty(key)
+
+    def load_items(self, cart):
+        """Attach products and sizes to the items, two queries in all"""
+        items = cart._item_list
+        products = cart_products().in_bulk({item.product_id for item in items})
+        sizes = Size.objects.in_bulk(
+            {item.size_id for item in items if item.size_id is not None})
+        loaded = []
+        for item in items:
+            product = products.get(item.product_id)
+            if product is None or (item.size_id is not None and item.size_id not in sizes):
+                continue  # deleted from the catalog since it was added
+            item.product = product
+            item.size = sizes.get(item.size_id)
+            loaded.append(item)
+        cart._item_list = loaded
+        return cart
+
+    def get_item(self, cart, item_id):
+        item_id = _item_id(item_id)
+        item = next((item for item in cart._item_list if item.id == item_id), None)
+        if item is None:
+            return None
+        item.product = Product.objects.filter(id=item.product_id).first()
+        if item.size_id is not None:
+            item.size = Size.objects.filter(id=item.size_id).first()
+        if item.product is None or (item.size_id is not None and item.size is None):
+            return None
+        return item
+
+    def _item_state(self, cart, item_id):
+        return next(item for item in cart.state['items'] if item['id'] == item_id)
+
+    def _refresh(self, cart):
+        cart._item_list = self._build(cart.session_key, cart.state)._item_list
+        cart.changed = True
+
+    def add_item(self, cart, product_id, size_id, quantity, check_stock=True):
+        line = next((
+            item for item in cart.state['items']
+            if item['product_id'] == product_id and item['size_id'] == size_id), None)
+        check_add(
+            product_id, size_id,
+            quantity + (line['quantity'] if line else 0) if check_stock else 0)
+        now = timezone.now()
+        if line is not None:
+            line['quantity'] += quantity
+            line['updated_at'] = now
+        else:
+            line = {
+                'id': cart.state['next_item_id'], 'product_id': product_id,
+                'size_id': size_id, 'quantity': quantity,
+                'created_at': now, 'updated_at': now,
+            }
+            cart.state['next_item_id'] += 1
+            cart.state['items'].append(line)
+        self._refresh(cart)
+        return next(cart_item for cart_item in cart._item_list if cart_item.id == line['id'])
+
+    def set_quantity(self, cart, item, quantity):
+        entry = self._item_state(cart, item.id)
+        entry['quantity'] = item.quantity = quantity
+        entry['updated_at'] = timezone.now()
+        self._refresh(cart)
+
+    def remove_item(self, cart, item):
+        cart.state['items'] = [
+            entry for entry in cart.state['items'] if entry['id'] != item.id]
+        self._refresh(cart)
+
+    def clear(self, cart):
+        cart.state['items'] = []
+        self._refresh(cart)
+
+    def validators(self, key):
+        state = self._read(key)
+        if state is None:
+            return None
+        # The cart key must not leak into ETags
+        tag = hashlib.md5(key.encode()).hexdigest()[:12]
+        return tag, state['updated_at']
+
+    def count(self, key):
+        state = self._read(key)
+        return sum(item['quantity'] for item in state['items']) if state else 0
+
+    async def acount(self, key):
+        state = await self.cache().aget(self.cache_key(key))
+        if state is None:
+            return await sync_to_async(self.count)(key)
+        return sum(item['quantity'] for item in state['items']) if state != _NO_CART else 0
+
+    def _mark_dirty(self, key):
+        """Queue the cart for the next write-behind flush"""
+        with self._lock:
+            self._dirty.add(key)
+
+    def persist(self, key):
+        """Write the cart's current state to the database; the row or None"""
+        with self._locked(key):
+            state = self._read(key)
+            if state is None:
+                return None
+            cart = self._write(key, state)
+            if state['id'] != cart.id:
+                state['id'] = cart.id
+                self._store(key, state)
+        with self._lock:
+            self._dirty.discard(key)
+        return cart
+
+    def _write(self, key, state):
+        items = state['items']
+        # Skip items whose product or size was deleted from the catalog
+        products = set(Product.objects.filter(
+            id__in={item['product_id'] for item in items}).values_list('id', flat=True))
+        sizes = set(Size.objects.filter(
+            id__in={item['size_id'] for item in items}).values_list('id', flat=True))
+        wanted = {
+            (item['product_id'], item['size_id']): item for item in items
+            if item['product_id'] in products
+            and (item['size_id'] is None or item['size_id'] in sizes)
+        }
+
+        with transaction.atomic():
+            cart, created = Cart.objects.get_or_create(session_key=key)
+            rows = {(row.product_id, row.size_id): row for row in cart.items.all()}
+            stale = [row.id for lookup, row in rows.items() if lookup not in wanted]
+            if stale:
+                CartItem.objects.filter(id__in=stale).delete()
+            changed = []
+            for lookup, item in wanted.items():
+                row = rows.get(lookup)
+                if row is not None and row.quantity != item['quantity']:
+                    row.quantity = item['quantity']
+                    row.updated_at = item['updated_at']
+                    changed.append(row)
+            if changed:
+                CartItem.objects.bulk_update(changed, ['quantity', 'updated_at'])
+            CartItem.objects.bulk_create([
+                CartItem(
+                    cart=cart, product_id=item['product_id'], size_id=item['size_id'],
+                    quantity=item['quantity'])
+                for lookup, item in wanted.items() if lookup not in rows
+            ])
+            Cart.objects.filter(id=cart.id).update(
+                updated_at=state['updated_at'],
+                item_total=sum(item['quantity'] for item in wanted.values()))
+        return cart
+
+    def materialize(self, cart):
+        """
+        Write a cart held by ``open`` to the database for checkout, under
+        the same lock; its row, or None when the cart is empty
+        """
+        if not cart.state['items']:
+            return None
+        # Still queued: the checkout's transaction may roll these rows back
+        row = self._write(cart.session_key, cart.state)
+        cart.state['id'] = cart.id = row.id
+        return row
+
+    def flush(self):
+        """Persist every cart changed in this process; the number written"""
+        with self._lock:
+            dirty = self._dirty
+            self._dirty = set()
+
+        written = 0
+        failed = set()
+        for key in dirty:
+            try:
+                self.persist(key)
+                written += 1
+            except Exception:
+                logger.exception('Writing a cached cart to the database failed')
+                failed.add(key)
+        if failed:
+            # Keep them queued so a transient database error loses nothing
+            with self._lock:
+                self._dirty |= failed
+        return written
+
+
+_cache_storages = []
+_storages = {}
+
+
+def cart_storage():
+    """The ``CART_STORAGE`` backend instance"""
+    path = _setting('CART_STORAGE', 'cart.storage.DatabaseCartStorage')
+    storage = _storages.get(path)
+    if storage is None:
+        storage = _storages.setdefault(path, import_string(path)())
+    return storage
+
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def _run_flusher(interval):
+    while True:
+        time.sleep(interval)
+        for storage in list(_cache_storages):
+            try:
+                storage.flush()
+            except Exception:
+                logger.exception('Scheduled cart flush failed')
+            finally:
+                close_old_connections()
+
+
+def start_flusher():
+    """
+    Write cached carts behind every ``CART_PERSIST_INTERVAL`` seconds in a
+    daemon thread, once per process; does nothing unless ``CART_STORAGE``
+    is a ``CacheCartStorage`` and the interval is set
+    """
+    global _flusher
+    if not issubclass(
+            import_string(_setting('CART_STORAGE', 'cart.storage.DatabaseCartStorage')),
+            CacheCartStorage):
+        return None
+    backend = settings.CACHES[_setting('CART_CACHE_ALIAS', 'default')]['BACKEND']
+    if backend == 'django.core.cache.backends.locmem.LocMemCache':
+        logger.warning(
+            'Cache carts are kept in a local-memory cache; with more than one '
+            'worker process each one sees its own copy of a cart')
+    interval = _setting('CART_PERSIST_INTERVAL', 300)
+    if interval is None:
+        return None
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(
+                target=_run_flusher, args=(interval,), name='cart-flush', daemon=True)
+            _flusher.start()
+    return _flusher
+
+
+@atexit.register
+def _flush_on_exit():
+    for storage in _cache_storages:
+        try:
+            storage.flush()
+        except Exception:
+            logger.exception('Writing cached carts to the database at exit failed')
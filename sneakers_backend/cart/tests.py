@@ -1,3 +1,545 @@
-from django.test import TestCase
+import datetime
+import io
+from decimal import Decimal
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .batch import parse_operations, plan_operations
+from .models import Cart, CartItem
+from .purge import purge_carts
+from .storage import CacheCartStorage, _run_flusher, cart_storage
+from orders.models import Order
+from products.models import Brand, Category, Product, Size
+from products.tests import seed_catalog
+
+
+class CartQueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(products=8)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.post('/api/cart/add/', {'product_id': self.catalog[0].id}, format='json')
+        cart = Cart.objects.get()
+        cart.items.all().delete()
+        for product in self.catalog:
+            CartItem.objects.create(
+                cart=cart, product=product, size=product.sizes.first(), quantity=2)
+
+    def test_cart_detail(self):
+        # validators, cart, items with products, brands, sizes and primary
+        # images; the cart cookie needs no session lookup or save
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/cart/')
+        data = response.json()
+        self.assertEqual(len(data['items']), 8)
+        self.assertEqual(data['total_items'], 16)
+        product = data['items'][0]['product']
+        self.assertEqual(product['brand_name'], self.catalog[0].brand.name)
+        self.assertTrue(product['primary_image'].endswith('/media/products/0.png'))
+
+
+class CartConditionalGetTests(TestCase):
+    def test_not_modified_until_cart_changes(self):
+        product = seed_catalog(products=1)[0]
+        client = APIClient()
+        client.post('/api/cart/add/', {'product_id': product.id}, format='json')
+        etag = client.get('/api/cart/')['ETag']
+
+        # validators only
+        with self.assertNumQueries(1):
+            response = client.get('/api/cart/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        client.post('/api/cart/clear/')
+        response = client.get('/api/cart/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class CartCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(products=2)
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(lambda: cart_storage().flush())
+        self.client = APIClient()
+
+    def count(self, queries):
+        with self.assertNumQueries(queries):
+            count = self.client.get('/api/cart/count/').json()['count']
+        self.assertEqual(self.client.get('/api/async/cart/count/').json()['count'], count)
+        return count
+
+    def test_no_cart_no_queries(self):
+        self.assertEqual(self.count(0), 0)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_total_follows_changes(self):
+        a, b = self.catalog
+        items = self.client.post('/api/cart/batch/', {'operations': [
+            {'op': 'add', 'product_id': a.id, 'quantity': 2},
+            {'op': 'add', 'product_id': b.id, 'size_id': b.sizes.first().id},
+        ]}, format='json').json()['items']
+        self.assertEqual(self.count(1), 3)
+
+        self.client.post('/api/cart/add/', {'product_id': a.id, 'quantity': 3}, format='json')
+        self.assertEqual(self.count(1), 6)
+        self.client.post('/api/cart/update_item/',
+                         {'item_id': items[1]['id'], 'quantity': 4}, format='json')
+        self.assertEqual(self.count(1), 9)
+        self.client.post('/api/cart/remove/', {'item_id': items[0]['id']}, format='json')
+        self.assertEqual(self.count(1), 4)
+        self.assertEqual(Cart.objects.get().item_total, 4)
+        self.client.post('/api/cart/clear/')
+        self.assertEqual(self.count(1), 0)
+
+    @override_settings(CART_STORAGE='cart.storage.CacheCartStorage', CART_PERSIST_INTERVAL=None)
+    def test_cache_storage(self):
+        a, _ = self.catalog
+        self.client.post('/api/cart/add/', {'product_id': a.id, 'quantity': 2}, format='json')
+        self.assertEqual(self.count(0), 2)
+        cart_storage().flush()
+        self.assertEqual(Cart.objects.get().item_total, 2)
+
+
+class CartIdentityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = seed_catalog(products=1)[0]
+
+    def writes(self, *paths, client):
+        with CaptureQueriesContext(connection) as captured:
+            for path in paths:
+                self.assertEqual(client.get(path).status_code, 200)
+        return [
+            query['sql'] for query in captured.captured_queries
+            if query['sql'].split(None, 1)[0].upper() in ('INSERT', 'UPDATE', 'DELETE')]
+
+    def checkout(self, client):
+        return client.post('/api/orders/create_order/', {
+            'full_name': 'Test Buyer', 'email': 'buyer@example.com', 'phone': '555',
+            'address': '1 Main St', 'city': 'Town', 'postal_code': '00000', 'country': 'US',
+        }, format='json')
+
+    def test_reads_write_nothing(self):
+        client = APIClient()
+        paths = ['/api/products/', f'/api/products/{self.product.slug}/',
+                 '/api/cart/', '/api/cart/count/']
+        self.assertEqual(self.writes(*paths, client=client), [])
+        self.assertNotIn('cart', client.cookies)
+        self.assertEqual(client.get('/api/cart/').json()['items'], [])
+        self.assertFalse(Cart.objects.exists())
+
+        client.post('/api/cart/add/', {'product_id': self.product.id}, format='json')
+        self.assertIn('cart', client.cookies)
+        self.assertEqual(self.writes(*paths, client=client), [])
+        self.assertFalse(Session.objects.exists())
+
+    def test_changes_without_a_cart_create_none(self):
+        client = APIClient()
+        for path, data, status in [
+            ('/api/cart/update_item/', {'item_id': 1, 'quantity': 2}, 404),
+            ('/api/cart/remove/', {'item_id': 1}, 404),
+            ('/api/cart/clear/', {}, 200),
+        ]:
+            with self.subTest(path=path):
+                response = client.post(path, data, format='json')
+                self.assertEqual(response.status_code, status)
+                self.assertNotIn('cart', response.cookies)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_checkout_uses_the_cart_cookie(self):
+        client = APIClient()
+        client.post('/api/cart/add/', {'product_id': self.product.id, 'quantity': 2},
+                    format='json')
+        response = self.checkout(client)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['items'][0]['quantity'], 2)
+        self.assertEqual(client.get('/api/cart/count/').json(), {'count': 0})
+
+    def test_tampered_cookie_is_no_cart(self):
+        client = APIClient()
+        client.post('/api/cart/add/', {'product_id': self.product.id}, format='json')
+        client.cookies['cart'] = Cart.objects.get().session_key
+        self.assertEqual(client.get('/api/cart/count/').json(), {'count': 0})
+        self.assertEqual(self.checkout(client).status_code, 400)
+
+    @override_settings(CART_IDENTITY='session')
+    def test_session_identity(self):
+        client = APIClient()
+        client.post('/api/cart/add/', {'product_id': self.product.id}, format='json')
+        self.assertNotIn('cart', client.cookies)
+        self.assertEqual(Cart.objects.get().session_key, Session.objects.get().session_key)
+        self.assertEqual(client.get('/api/cart/count/').json(), {'count': 1})
+        self.assertEqual(self.checkout(client).status_code, 201)
+
+
+@override_settings(CART_STORAGE='cart.storage.CacheCartStorage', CART_PERSIST_INTERVAL=None)
+class CacheCartStorageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(products=3)
+
+    def setUp(self):
+        cache.clear()
+        # Write out anything still queued while the test database is in use
+        self.addCleanup(lambda: cart_storage().flush())
+
+    def shop(self, client):
+        """Add, update and remove items, returning every cart snapshot"""
+        a, b, c = self.catalog
+        snapshots = [
+            client.post('/api/cart/add/', {'product_id': a.id, 'quantity': 2}, format='json'),
+            client.post('/api/cart/add/', {'product_id': b.id, 'size_id': b.sizes.first().id},
+                        format='json'),
+            client.post('/api/cart/add/', {'product_id': a.id}, format='json'),
+            client.post('/api/cart/add/', {'product_id': c.id}, format='json'),
+        ]
+        items = snapshots[-1].json()['items']
+        snapshots += [
+            client.post('/api/cart/update_item/',
+                        {'item_id': items[1]['id'], 'quantity': 4}, format='json'),
+            client.post('/api/cart/remove/', {'item_id': items[2]['id']}, format='json'),
+            client.get('/api/cart/'),
+        ]
+        return [self.comparable(response) for response in snapshots]
+
+    def comparable(self, response):
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        for key in ('id', 'created_at', 'updated_at'):
+            data.pop(key)
+        for item in data['items']:
+            for key in ('id', 'created_at', 'updated_at'):
+                item.pop(key)
+        return data
+
+    def test_same_responses_as_database_storage_without_rows(self):
+        snapshots = self.shop(APIClient())
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(snapshots[-1]['total_items'], 7)
+
+        with override_settings(CART_STORAGE='cart.storage.DatabaseCartStorage'):
+            self.assertEqual(self.shop(APIClient()), snapshots)
+
+    def test_cart_detail_queries(self):
+        client = APIClient()
+        self.shop(client)
+        # products with brands and primary images, sizes; the cart itself
+        # comes from the cache
+        with self.assertNumQueries(2):
+            client.get('/api/cart/')
+
+    def test_write_behind_and_reload(self):
+        client = APIClient()
+        product = self.catalog[0]
+        client.post('/api/cart/add/', {'product_id': product.id, 'quantity': 3}, format='json')
+        self.assertEqual(cart_storage().flush(), 1)
+        self.assertEqual(
+            list(CartItem.objects.values_list('product_id', 'quantity')), [(product.id, 3)])
+
+        # With the cache entry gone the cart comes back from its rows
+        cache.clear()
+        data = client.get('/api/cart/').json()
+        self.assertEqual(data['id'], Cart.objects.get().id)
+        self.assertEqual(data['total_items'], 3)
+        self.assertEqual(client.get('/api/async/cart/count/').json(), {'count': 3})
+
+        client.post('/api/cart/update_item/',
+                    {'item_id': data['items'][0]['id'], 'quantity': 1}, format='json')
+        cart_storage().flush()
+        self.assertEqual(CartItem.objects.get().quantity, 1)
+
+    def test_requests_that_change_nothing_write_nothing(self):
+        client = APIClient()
+        product = self.catalog[0]
+        client.post('/api/cart/add/', {'product_id': product.id}, format='json')
+        self.assertEqual(cart_storage().flush(), 1)
+        with mock.patch.object(CacheCartStorage, '_store') as store:
+            response = client.post(
+                '/api/cart/update_item/', {'item_id': 999, 'quantity': 2}, format='json')
+            self.assertEqual(response.status_code, 404)
+            client.post('/api/cart/remove/', {'item_id': 999}, format='json')
+        store.assert_not_called()
+        self.assertEqual(cart_storage().flush(), 0)
+
+    @override_settings(CART_PERSIST_INTERVAL=0)
+    def test_write_behind_runs_outside_requests(self):
+        client = APIClient()
+        for product in self.catalog:
+            client.post('/api/cart/add/', {'product_id': product.id}, format='json')
+        self.assertFalse(Cart.objects.exists())
+
+        # One round of the background flusher
+        with mock.patch('cart.storage.time.sleep', side_effect=[None, SystemExit]), \
+                mock.patch('cart.storage.close_old_connections'), \
+                self.assertRaises(SystemExit):
+            _run_flusher(0)
+        self.assertEqual(Cart.objects.get().item_total, 3)
+
+    def test_checkout_materializes_the_cart(self):
+        client = APIClient()
+        product = self.catalog[1]
+        client.post('/api/cart/add/', {'product_id': product.id, 'quantity': 2}, format='json')
+        response = client.post('/api/orders/create_order/', {
+            'full_name': 'Test Buyer', 'email': 'buyer@example.com', 'phone': '555',
+            'address': '1 Main St', 'city': 'Town', 'postal_code': '00000', 'country': 'US',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [(item['product']['id'], item['quantity']) for item in response.json()['items']],
+            [(product.id, 2)])
+        self.assertEqual(client.get('/api/cart/').json()['items'], [])
+
+        # The ordered lines are gone from the rows too, not only the cache
+        cache.clear()
+        self.assertEqual(client.get('/api/cart/').json()['items'], [])
+        self.assertEqual(client.get('/api/cart/count/').json(), {'count': 0})
+        self.assertEqual(Cart.objects.get().item_total, 0)
+
+    def test_failed_checkout_keeps_the_cached_cart(self):
+        client = APIClient()
+        product = self.catalog[1]
+        client.post('/api/cart/add/', {'product_id': product.id, 'quantity': 2}, format='json')
+        with mock.patch('orders.checkout.OrderItem.objects.bulk_create',
+                        side_effect=DatabaseError), self.assertRaises(DatabaseError):
+            client.post('/api/orders/create_order/', {
+                'full_name': 'Test Buyer', 'email': 'buyer@example.com', 'phone': '555',
+                'address': '1 Main St', 'city': 'Town', 'postal_code': '00000',
+                'country': 'US',
+            }, format='json')
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(client.get('/api/cart/count/').json(), {'count': 2})
+
+
+class CartBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(products=4)
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(lambda: cart_storage().flush())
+        self.client = APIClient()
+
+    def batch(self, *operations):
+        return self.client.post(
+            '/api/cart/batch/', {'operations': list(operations)}, format='json')
+
+    def lines(self, data):
+        return [
+            (item['product']['id'], item['size'] and item['size']['id'], item['quantity'])
+            for item in data['items']]
+
+    def test_operations_apply_in_one_request(self):
+        a, b, c, _ = self.catalog
+        size = b.sizes.first()
+        response = self.batch(
+            {'op': 'add', 'product_id': a.id, 'quantity': 2},
+            {'op': 'add', 'product_id': b.id, 'size_id': size.id},
+            {'op': 'add', 'product_id': a.id},
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(self.lines(data), [(a.id, None, 3), (b.id, size.id, 1)])
+
+        first, second = data['items']
+        response = self.batch(
+            {'op': 'update', 'item_id': first['id'], 'quantity': 1},
+            {'op': 'remove', 'item_id': second['id']},
+            {'op': 'add', 'product_id': c.id, 'quantity': 2},
+        )
+        self.assertEqual(self.lines(response.json()), [(a.id, None, 1), (c.id, None, 2)])
+        self.assertEqual(response.json()['total_items'], 3)
+
+        response = self.batch({'op': 'clear'}, {'op': 'add', 'product_id': b.id})
+        self.assertEqual(self.lines(response.json()), [(b.id, None, 1)])
+
+    def test_invalid_batch_changes_nothing(self):
+        a, b, _, _ = self.catalog
+        self.batch({'op': 'add', 'product_id': a.id})
+        before = self.client.get('/api/cart/').json()
+
+        response = self.batch(
+            {'op': 'add', 'product_id': b.id},
+            {'op': 'add', 'product_id': a.id, 'quantity': a.stock},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Insufficient stock', 'operation': 1})
+
+        response = self.batch(
+            {'op': 'clear'},
+            {'op': 'remove', 'item_id': before['items'][0]['id']},
+        )
+        self.assertEqual(response.json(), {'error': 'Cart item not found', 'operation': 1})
+
+        response = self.batch({'op': 'add', 'product_id': b.id}, {'op': 'explode'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['operation'], 1)
+        self.assertEqual(self.client.get('/api/cart/').json(), before)
+
+    def test_stock_read_in_one_query(self):
+        operations = parse_operations({'operations': [
+            {'op': 'add', 'product_id': product.id, 'size_id': product.sizes.first().id}
+            for product in self.catalog]})
+        with self.assertNumQueries(1):
+            plan_operations([], operations)
+
+    @override_settings(CART_STORAGE='cart.storage.CacheCartStorage', CART_PERSIST_INTERVAL=None)
+    def test_cache_storage(self):
+        a, b, _, _ = self.catalog
+        response = self.batch(
+            {'op': 'add', 'product_id': a.id, 'quantity': 2},
+            {'op': 'add', 'product_id': b.id},
+        )
+        self.assertEqual(self.lines(response.json()), [(a.id, None, 2), (b.id, None, 1)])
+        self.assertFalse(CartItem.objects.exists())
+
+        item = response.json()['items'][0]
+        response = self.batch(
+            {'op': 'update', 'item_id': item['id'], 'quantity': 5},
+            {'op': 'add', 'product_id': b.id, 'quantity': b.stock},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/api/cart/').json()['total_items'], 3)
+
+
+class CartPurgeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        product = seed_catalog(products=1)[0]
+        now = timezone.now()
+        for n in range(7):
+            cart = Cart.objects.create(session_key=f'old-{n}')
+            CartItem.objects.create(cart=cart, product=product, quantity=1)
+            CartItem.objects.create(cart=cart, product=product, size=product.sizes.first())
+        # Several carts share a timestamp, so batches must break ties by id
+        Cart.objects.update(updated_at=now - datetime.timedelta(days=30))
+        Cart.objects.filter(session_key__in=['old-0', 'old-1']).update(
+            updated_at=now - datetime.timedelta(days=40))
+        cls.recent = Cart.objects.create(session_key='recent')
+        CartItem.objects.create(cart=cls.recent, product=product)
+
+        for n in range(3):
+            Session.objects.create(
+                session_key=f'expired-{n}', session_data='',
+                expire_date=now - datetime.timedelta(hours=n + 1))
+        Session.objects.create(
+            session_key='live', session_data='', expire_date=now + datetime.timedelta(days=1))
+
+    def test_purge_in_batches(self):
+        result = purge_carts(older_than=datetime.timedelta(days=14), batch_size=2)
+        self.assertEqual((result.carts, result.items, result.sessions), (7, 14, 3))
+        # 4 batches of carts, 2 of sessions
+        self.assertEqual(result.batches, 6)
+        self.assertEqual(list(Cart.objects.all()), [self.recent])
+        self.assertEqual(CartItem.objects.get().cart, self.recent)
+        self.assertEqual(Session.objects.get().session_key, 'live')
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('purge_carts', '--days', '35', '--keep-sessions', stdout=out)
+        self.assertIn('Removed 6 rows', out.getvalue())
+        self.assertEqual(Cart.objects.count(), 6)
+        self.assertEqual(Session.objects.count(), 4)
+
+
+class CartAddTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.a, cls.b = seed_catalog(products=2)
+
+    def add(self, client, **data):
+        return client.post('/api/cart/add/', data, format='json')
+
+    def test_errors_write_nothing(self):
+        client = APIClient()
+        size = self.a.sizes.first()
+        cases = [
+            ({'product_id': 999999}, 404, 'Product not found'),
+            ({'product_id': self.a.id, 'size_id': self.b.sizes.first().id}, 404, 'Size not found'),
+            ({'product_id': self.a.id, 'quantity': 0}, 400, 'Quantity must be at least 1'),
+            ({'product_id': self.a.id, 'quantity': 11}, 400, 'Insufficient stock'),
+            ({'product_id': self.a.id, 'size_id': size.id, 'quantity': 6}, 400,
+             'Insufficient stock for selected size'),
+        ]
+        for data, status_code, error in cases:
+            response = self.add(client, **data)
+            self.assertEqual(response.status_code, status_code, data)
+            self.assertEqual(response.json(), {'error': error})
+        self.assertFalse(Cart.objects.exists())
+        self.assertNotIn('cart', client.cookies)
+
+    def test_stock_counts_what_is_already_in_the_cart(self):
+        client = APIClient()
+        size = self.a.sizes.first()
+        self.assertEqual(self.add(client, product_id=self.a.id, size_id=size.id,
+                                  quantity=3).status_code, 200)
+        response = self.add(client, product_id=self.a.id, size_id=size.id, quantity=3)
+        self.assertEqual(response.json(), {'error': 'Insufficient stock for selected size'})
+        response = self.add(client, product_id=str(self.a.id), size_id=str(size.id), quantity=2)
+        self.assertEqual(response.json()['items'][0]['quantity'], 5)
+        self.assertEqual(CartItem.objects.get().quantity, 5)
+
+
+class ConcurrentAddTests(TransactionTestCase):
+    """Many clients adding to one cart at once, each thread its own connection"""
+
+    def setUp(self):
+        # No images: their derivatives would be generated on commit
+        self.product = Product.objects.create(
+            name='Sneaker', description='Seeded', price=Decimal('100.00'), stock=1000,
+            category=Category.objects.create(name='Category'),
+            brand=Brand.objects.create(name='Brand'))
+        self.size = Size.objects.create(
+            product=self.product, size='M', us_size=Decimal('9.0'), stock=1000)
+        self.client = APIClient()
+        self.client.post('/api/cart/add/', {'product_id': self.product.id}, format='json')
+
+    def hammer(self, payload, threads=8, requests=10):
+        """POST ``payload`` to /api/cart/add/ from many threads; the statuses"""
+        cookies = self.client.cookies
+
+        def add(_):
+            client = APIClient()
+            client.cookies = cookies
+            try:
+                return [
+                    client.post('/api/cart/add/', payload, format='json').status_code
+                    for _ in range(requests)]
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            return Counter(code for codes in pool.map(add, range(threads)) for code in codes)
+
+    def quantities(self):
+        return dict(CartItem.objects.values_list('size_id', 'quantity'))
+
+    def test_no_lost_updates(self):
+        statuses = self.hammer({'product_id': self.product.id, 'quantity': 2})
+        self.assertEqual(statuses, {200: 80})
+        statuses = self.hammer({'product_id': self.product.id, 'size_id': self.size.id})
+        self.assertEqual(statuses, {200: 80})
+        self.assertEqual(self.quantities(), {None: 161, self.size.id: 80})
+        self.assertEqual(Cart.objects.get().item_total, 241)
+
+    def test_stock_is_never_exceeded(self):
+        Size.objects.filter(pk=self.size.pk).update(stock=25)
+        statuses = self.hammer({'product_id': self.product.id, 'size_id': self.size.id})
+        self.assertEqual(statuses, {200: 25, 400: 55})
+        self.assertEqual(self.quantities(), {None: 1, self.size.id: 25})
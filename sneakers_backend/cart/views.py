@@ -2,58 +2,83 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
-from django.shortcuts import get_object_or_404
-from .models import Cart, CartItem
+from .models import Cart
 from .serializers import CartSerializer, CartItemSerializer
-from products.models import Product, Size
+from .batch import BatchError, apply_operations, parse_operations, plan_operations
+from .identity import cart_key, remember
+from .storage import Unavailable, cart_storage
+from products.cache import get_catalog_modified, get_catalog_version
+from sneakers_backend.conditional import conditional_get, to_timestamp
 
 
 class CartViewSet(viewsets.ModelViewSet):
     """
     API endpoint for shopping cart
-    
-    Supports both authenticated users and guest sessions
+
+    Carts live in the ``CART_STORAGE`` backend, keyed by the visitor's cart
+    identity (see cart.identity and cart.storage).  Only adding creates a
+    cart: a visitor without one gets an empty cart back from reads and
+    ``clear``, and 404 from changes to items.
     """
     serializer_class = CartSerializer
     permission_classes = [AllowAny]
 
+    def cart_key(self, request):
+        """The key identifying the visitor's cart, assigning one if needed"""
+        return cart_key(request, create=True)
+
     def get_cart(self, request):
-        """Get or create cart for current user/session"""
-        if request.user.is_authenticated:
-            cart, created = Cart.objects.get_or_create(user=request.user)
-        else:
-            session_key = request.session.session_key
-            if not session_key:
-                request.session.create()
-                session_key = request.session.session_key
-            
-            cart, created = Cart.objects.get_or_create(session_key=session_key)
-        
-        return cart
+        """The visitor's cart, or None if they have none yet"""
+        key = cart_key(request)
+        return cart_storage().get(key) if key else None
 
     def get_queryset(self):
-        if self.request.user.is_authenticated:
-            return Cart.objects.filter(user=self.request.user)
-        else:
-            session_key = self.request.session.session_key
-            if session_key:
-                return Cart.objects.filter(session_key=session_key)
+        key = cart_key(self.request)
+        if key:
+            return Cart.objects.filter(session_key=key)
         return Cart.objects.none()
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        return remember(request, response)
+
+    def cart_response(self, cart, **kwargs):
+        """Serialize the cart after loading its items in a fixed number of queries"""
+        if cart is None:
+            cart = Cart()
+            cart._item_list = []
+        else:
+            cart_storage().load_items(cart)
+        serializer = CartSerializer(cart, context={'request': self.request})
+        return Response(serializer.data, **kwargs)
+
+    def item_not_found(self):
+        return Response(
+            {'error': 'Cart item not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+    def cart_validators(self, request, *args, **kwargs):
+        """Validators from the cart's updated_at and the catalog version"""
+        key = cart_key(request)
+        state = cart_storage().validators(key) if key else None
+        if state is None:
+            return None, None
+        tag, updated_at = state
+        etag = f'cart-{tag}-{to_timestamp(updated_at)}-{get_catalog_version()}'
+        return etag, max(to_timestamp(updated_at), get_catalog_modified())
+
+    @conditional_get('cart_validators')
     def list(self, request):
         """Get current cart"""
         cart = self.get_cart(request)
-        serializer = self.get_serializer(cart)
-        return Response(serializer.data)
+        return self.cart_response(cart)
 
     @action(detail=False, methods=['post'])
     def add(self, request):
         """Add item to cart"""
-        cart = self.get_cart(request)
-        
         product_id = request.data.get('product_id')
         size_id = request.data.get('size_id')
-        quantity = int(request.data.get('quantity', 1))
 
         if not product_id:
             return Response(
@@ -62,56 +87,35 @@ class CartViewSet(viewsets.ModelViewSet):
             )
 
         try:
-            product = Product.objects.get(id=product_id, is_available=True)
-        except Product.DoesNotExist:
+            quantity = int(request.data.get('quantity', 1))
+            product_id = int(product_id)
+            size_id = int(size_id) if size_id else None
+        except (TypeError, ValueError):
             return Response(
-                {'error': 'Product not found'},
-                status=status.HTTP_404_NOT_FOUND
+                {'error': 'Invalid product_id, size_id or quantity'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-
-        # Get size if provided
-        size = None
-        if size_id:
-            try:
-                size = Size.objects.get(id=size_id, product=product)
-                if size.stock < quantity:
-                    return Response(
-                        {'error': 'Insufficient stock for selected size'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-            except Size.DoesNotExist:
-                return Response(
-                    {'error': 'Size not found'},
-                    status=status.HTTP_404_NOT_FOUND
-                )
-
-        # Check stock
-        if product.stock < quantity:
+        if quantity < 1:
             return Response(
-                {'error': 'Insufficient stock'},
+                {'error': 'Quantity must be at least 1'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Add or update cart item
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            size=size,
-            defaults={'quantity': quantity}
-        )
-
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
-
-        serializer = CartSerializer(cart, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # One upsert adds to the line, checking availability and stock
+        storage = cart_storage()
+        try:
+            with storage.open(self.cart_key(request)) as cart:
+                storage.add_item(cart, product_id, size_id, quantity)
+        except Unavailable as exc:
+            return Response(
+                {'error': exc.message},
+                status=status.HTTP_404_NOT_FOUND if exc.missing else status.HTTP_400_BAD_REQUEST
+            )
+        return self.cart_response(cart, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['post'])
     def update_item(self, request):
         """Update cart item quantity"""
-        cart = self.get_cart(request)
-        
         item_id = request.data.get('item_id')
         quantity = request.data.get('quantity')
 
@@ -134,9 +138,15 @@ class CartViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        try:
-            cart_item = CartItem.objects.get(id=item_id, cart=cart)
-            
+        key = cart_key(request)
+        if key is None:
+            return self.item_not_found()
+        storage = cart_storage()
+        with storage.open(key) as cart:
+            cart_item = storage.get_item(cart, item_id)
+            if cart_item is None:
+                return self.item_not_found()
+
             # Check stock
             if cart_item.size:
                 if cart_item.size.stock < quantity:
@@ -149,23 +159,13 @@ class CartViewSet(viewsets.ModelViewSet):
                     {'error': 'Insufficient stock'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            
-            cart_item.quantity = quantity
-            cart_item.save()
 
-            serializer = CartSerializer(cart, context={'request': request})
-            return Response(serializer.data)
-
-        except CartItem.DoesNotExist:
-            return Response(
-                {'error': 'Cart item not found'},
-                status=status.HTTP_404_NOT_FOUND
-            )
+            storage.set_quantity(cart, cart_item, quantity)
+        return self.cart_response(cart)
 
     @action(detail=False, methods=['post'])
     def remove(self, request):
         """Remove item from cart"""
-        cart = self.get_cart(request)
         item_id = request.data.get('item_id')
 
         if not item_id:
@@ -174,30 +174,51 @@ class CartViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        try:
-            cart_item = CartItem.objects.get(id=item_id, cart=cart)
-            cart_item.delete()
-
-            serializer = CartSerializer(cart, context={'request': request})
-            return Response(serializer.data)
-
-        except CartItem.DoesNotExist:
-            return Response(
-                {'error': 'Cart item not found'},
-                status=status.HTTP_404_NOT_FOUND
-            )
+        key = cart_key(request)
+        if key is None:
+            return self.item_not_found()
+        storage = cart_storage()
+        with storage.open(key) as cart:
+            cart_item = storage.get_item(cart, item_id)
+            if cart_item is None:
+                return self.item_not_found()
+            storage.remove_item(cart, cart_item)
+        return self.cart_response(cart)
 
     @action(detail=False, methods=['post'])
     def clear(self, request):
         """Clear all items from cart"""
-        cart = self.get_cart(request)
-        cart.items.all().delete()
-        
-        serializer = CartSerializer(cart, context={'request': request})
-        return Response(serializer.data)
+        key = cart_key(request)
+        if key is None:
+            return self.cart_response(None)
+        storage = cart_storage()
+        with storage.open(key) as cart:
+            storage.clear(cart)
+        return self.cart_response(cart)
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Apply a list of add/update/remove/clear operations atomically and
+        return the cart once; see cart.batch for the format
+        """
+        try:
+            operations = parse_operations(request.data)
+        except BatchError as exc:
+            return Response(exc.as_data(), status=status.HTTP_400_BAD_REQUEST)
+
+        storage = cart_storage()
+        try:
+            with storage.open(self.cart_key(request)) as cart:
+                storage.load_items(cart)
+                operations = plan_operations(cart.item_list, operations)
+                apply_operations(storage, cart, operations)
+        except BatchError as exc:
+            return Response(exc.as_data(), status=status.HTTP_400_BAD_REQUEST)
+        return self.cart_response(cart)
 
     @action(detail=False, methods=['get'])
     def count(self, request):
-        """Get cart item count"""
-        cart = self.get_cart(request)
-        return Response({'count': cart.total_items})
\ No newline at end of file
+        """Cart item count for the header badge; never creates a cart"""
+        key = cart_key(request)
+        return Response({'count': cart_storage().count(key) if key else 0})
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""
+Turning a cart into an order.
+
+``place_order`` holds the cart (see ``cart_storage().open``) from before
+its lines are read until it is emptied.  In one transaction it loads the
+lines with their products and sizes in one query, takes the stock with one
+conditional ``UPDATE`` per table, writes the order and all of its items and
+deletes the cart's rows; the cart itself is emptied only once that has
+committed.
+
+Stock is taken as ``UPDATE ... SET stock = stock - n WHERE id = ... AND
+stock >= n`` for every product and size at once; if fewer rows match than
+were asked for, some line is short and the whole order rolls back, so
+concurrent checkouts can never sell more than there is.  Products sold
+get a new ``updated_at`` in the same statement and the catalog version is
+bumped once the order commits, so cached pages and ETags show the new stock.
+"""
+
+from collections import Counter
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from cart.models import Cart, CartItem
+from cart.storage import cart_storage
+from products.cache import bump_catalog_version
+from products.models import Product, Size
+from .models import Order, OrderItem
+
+
+class CheckoutError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+def _take_stock(queryset, wanted, **changes):
+    """
+    Subtract ``wanted`` (``{pk: quantity}``) from the rows' stock in one
+    statement, only where there is enough, also setting ``changes``;
+    whether every row had enough
+    """
+    amount = Case(
+        *[When(pk=pk, then=Value(quantity)) for pk, quantity in wanted.items()],
+        output_field=IntegerField(),
+    )
+    updated = queryset.filter(pk__in=wanted, stock__gte=amount).update(
+        stock=F('stock') - amount, **changes)
+    return updated == len(wanted)
+
+
+def _take_all(products, sizes):
+    """Take the stock of every product and size, or of none"""
+    with transaction.atomic():
+        if _take_stock(
+                Product.objects.filter(is_available=True), products,
+                updated_at=timezone.now()) and (
+                not sizes or _take_stock(Size.objects.all(), sizes)):
+            return True
+        # Undo the rows that did have enough
+        transaction.set_rollback(True)
+    return False
+
+
+def _short_of(lines, products, sizes):
+    """The name of the first line whose product or size lacks its quantity"""
+    stock = dict(Product.objects.filter(
+        pk__in=products, is_available=True).values_list('pk', 'stock'))
+    size_stock = dict(Size.objects.filter(pk__in=sizes).values_list('pk', 'stock'))
+    for line in lines:
+        if stock.get(line.product_id, 0) < products[line.product_id]:
+            return line.product.name
+        if line.size_id and size_stock.get(line.size_id, 0) < sizes[line.size_id]:
+            return f'{line.product.name} (size {line.size.size})'
+    return None
+
+
+def place_order(key, details, shipping_cost):
+    """
+    Order the contents of the cart ``key`` and empty it; ``details`` are
+    the customer fields of ``Order``.  Raises ``CheckoutError`` with nothing
+    written when the cart is empty or out of stock.
+    """
+    if key is None:
+        raise CheckoutError('Cart is empty')
+    storage = cart_storage()
+
+    with storage.open(key) as cart, transaction.atomic():
+        # Write a cache-backed cart to the database before ordering from it
+        if storage.materialize(cart) is None:
+            raise CheckoutError('Cart is empty')
+        lines = list(
+            CartItem.objects.filter(cart_id=cart.id)
+            .select_related('product', 'size').order_by('id'))
+        if not lines:
+            raise CheckoutError('Cart is empty')
+
+        products, sizes = Counter(), Counter()
+        for line in lines:
+            products[line.product_id] += line.quantity
+            if line.size_id:
+                sizes[line.size_id] += line.quantity
+        if not _take_all(products, sizes):
+            name = _short_of(lines, products, sizes)
+            raise CheckoutError(f'Insufficient stock for {name}' if name else 'Insufficient stock')
+        # The update skipped the save signals that invalidate the catalog
+        transaction.on_commit(bump_catalog_version)
+
+        subtotal = sum((line.product.final_price * line.quantity for line in lines), Decimal(0))
+        order = Order.objects.create(
+            **details, subtotal=subtotal, shipping_cost=shipping_cost,
+            total=subtotal + shipping_cost)
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order, product=line.product, size=line.size,
+                quantity=line.quantity, price=line.product.final_price)
+            for line in lines
+        ])
+        # Delete the ordered rows here: a cache-backed cart would reload
+        # them once its cache entry is gone
+        CartItem.objects.filter(cart_id=cart.id).delete()
+        Cart.objects.filter(id=cart.id).update(item_total=0)
+        storage.clear(cart)
+    return order
@@ -0,0 +1,130 @@
+import logging
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, RequestFactory, override_settings
+
+from cart.identity import cart_key, uses_session
+from cart.models import Cart
+from cart.storage import cart_storage
+from orders.models import Order
+from products.models import Brand, Category, Product
+
+
+BENCH_EMAIL = 'bench-checkout@example.invalid'
+
+
+def client_cart_key(client):
+    """The cart key a test client's cookies carry, or None"""
+    if uses_session():
+        cookie = client.cookies.get(settings.SESSION_COOKIE_NAME)
+        return cookie.value if cookie else None
+    request = RequestFactory().get('/')
+    request.COOKIES = {name: morsel.value for name, morsel in client.cookies.items()}
+    return cart_key(request)
+
+
+class Command(BaseCommand):
+    help = (
+        'Concurrent checkout benchmark: many guests with the same scarce '
+        'product in their carts check out at once from a thread pool. '
+        'Reports orders per second and how many units were sold beyond the '
+        'stock. Creates a scratch category, brand and product and deletes '
+        'them, the guests\' carts and their orders afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--buyers', type=int, default=200, help='Guests checking out (default: 200)')
+        parser.add_argument(
+            '--stock', type=int, default=100,
+            help='Units of the product in stock (default: 100)')
+        parser.add_argument(
+            '--threads', type=int, default=8,
+            help='Checkouts in flight at once (default: 8)')
+
+    def handle(self, *args, **options):
+        if min(options['buyers'], options['stock'], options['threads']) < 1:
+            raise CommandError('--buyers, --stock and --threads must be positive')
+
+        with override_settings(
+                DATABASE_REPLICAS=[],
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            # A unique name, so nothing of the shop's is touched on cleanup
+            name = f'Checkout benchmark {uuid.uuid4().hex[:8]}'
+            category = Category.objects.create(name=name)
+            brand = Brand.objects.create(name=name)
+            product = Product.objects.create(
+                name=name, description='Scratch product',
+                price=Decimal('100.00'), stock=options['stock'],
+                category=category, brand=brand)
+            clients = []
+            try:
+                self.run(product, clients, options)
+            finally:
+                # Nothing of the guests' carts may be written behind later
+                cart_storage().flush()
+                keys = [key for key in map(client_cart_key, clients) if key]
+                Cart.objects.filter(session_key__in=keys).delete()
+                Order.objects.filter(email=BENCH_EMAIL).delete()
+                product.delete()
+                category.delete()
+                brand.delete()
+
+    def run(self, product, clients, options):
+        for _ in range(options['buyers']):
+            client = Client()
+            client.post(
+                '/api/cart/add/', {'product_id': product.id}, content_type='application/json')
+            clients.append(client)
+
+        def buy(client):
+            try:
+                return client.post('/api/orders/create_order/', {
+                    'full_name': 'Bench Buyer', 'email': BENCH_EMAIL, 'phone': '555',
+                    'address': '1 Main St', 'city': 'Town', 'postal_code': '00000',
+                    'country': 'US',
+                }, content_type='application/json').status_code
+            except Exception:
+                return 'error'
+            finally:
+                connection.close()
+
+        # Rejected checkouts are expected; keep their warnings out of the report
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+                statuses = Counter(pool.map(buy, clients))
+            elapsed = time.perf_counter() - started
+        finally:
+            request_logger.setLevel(level)
+
+        placed = statuses.pop(201, 0)
+        sold = sum(
+            item.quantity for order in Order.objects.filter(email=BENCH_EMAIL)
+            for item in order.items.all())
+        product.refresh_from_db()
+        oversold = max(0, sold - options['stock'])
+
+        self.stdout.write(
+            f"{options['buyers']} checkouts of 1 unit, {options['stock']} in stock, "
+            f"{options['threads']} threads")
+        self.stdout.write(
+            f'  {placed} orders in {elapsed:.2f}s: {placed / elapsed:.1f} orders/s, '
+            f'{len(clients) / elapsed:.1f} checkouts/s')
+        self.stdout.write(
+            '  rejected: ' + (', '.join(
+                f'{count} x {status}' for status, count in sorted(
+                    statuses.items(), key=lambda entry: str(entry[0]))) or 'none'))
+        self.stdout.write(f'  units sold {sold}, stock left {product.stock}')
+        style = self.style.ERROR if oversold or product.stock < 0 else self.style.SUCCESS
+        self.stdout.write(style(f'  oversold: {oversold}'))
@@ -31,6 +31,9 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['email', '-created_at'], name='order_email_recent'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.order_number:
@@ -1,6 +1,20 @@
+from decimal import Decimal
+
 from rest_framework import serializers
 from .models import Order, OrderItem
-from products.serializers import ProductListSerializer, SizeSerializer
+from products.serializers import (
+    ProductListSerializer, SizeSerializer, ProductCountListSerializer
+)
+
+
+class OrderItemListSerializer(ProductCountListSerializer):
+    def get_products(self, items):
+        return [item.product for item in items]
+
+
+class OrderListSerializer(ProductCountListSerializer):
+    def get_products(self, orders):
+        return [item.product for order in orders for item in order.items.all()]
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
@@ -14,6 +28,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = ['id', 'product', 'size', 'quantity', 'price', 'subtotal']
         read_only_fields = ['subtotal']
+        list_serializer_class = OrderItemListSerializer
 
 
 class OrderSerializer(serializers.ModelSerializer):
@@ -32,16 +47,21 @@ class OrderSerializer(serializers.ModelSerializer):
             'items', 'created_at', 'updated_at'
         ]
         read_only_fields = ['order_number', 'created_at', 'updated_at']
+        list_serializer_class = OrderListSerializer
 
 
 class CreateOrderSerializer(serializers.ModelSerializer):
     """Serializer for creating new orders"""
+    # Rejects NaN and infinity as well as negative costs
+    shipping_cost = serializers.DecimalField(
+        max_digits=10, decimal_places=2, min_value=Decimal('0'),
+        default=Decimal('10.00'))
 
     class Meta:
         model = Order
         fields = [
             'full_name', 'email', 'phone', 'address',
-            'city', 'postal_code', 'country', 'notes'
+            'city', 'postal_code', 'country', 'notes', 'shipping_cost'
         ]
 
     def validate_email(self, value):
@@ -74,6 +94,8 @@ class OrderTrackingSerializer(serializers.ModelSerializer):
         ]
 
     def get_items_count(self, obj):
+        if hasattr(obj, 'items_count'):
+            return obj.items_count
         return obj.items.count()
 
 
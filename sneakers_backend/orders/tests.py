@@ -1,3 +1,199 @@
-from django.test import TestCase
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from .models import Order, OrderItem
+from products.cache import get_catalog_version
+from products.models import Brand, Category, Product, Size
+from products.tests import seed_catalog
+
+
+class OrderQueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        catalog = seed_catalog(products=6)
+        for n in range(5):
+            order = Order.objects.create(
+                full_name='Test Buyer', email='buyer@example.com', phone='555',
+                address='1 Main St', city='Town', postal_code='00000',
+                country='US', subtotal=Decimal('300.00'), total=Decimal('310.00'))
+            for product in catalog[n:n + 3]:
+                OrderItem.objects.create(
+                    order=order, product=product, quantity=1, price=product.price)
+        cls.order = order
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_order_list(self):
+        self.assertEqual(self.client.get('/api/orders/').status_code, 403)
+        self.client.force_authenticate(User.objects.create_user('clerk', is_staff=True))
+        # count, orders, items with products, product images,
+        # category counts, brand counts
+        with self.assertNumQueries(6):
+            response = self.client.get('/api/orders/')
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_orders_are_staff_only_except_tracking(self):
+        url = f'/api/orders/{self.order.pk}/'
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.delete(url).status_code, 403)
+        self.client.force_authenticate(User.objects.create_user('shopper'))
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_authenticate(None)
+        response = self.client.get(f'/api/orders/{self.order.order_number}/track/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_order_track(self):
+        # validators, then the same without the count
+        with self.assertNumQueries(6):
+            self.client.get(f'/api/orders/{self.order.order_number}/track/')
+
+    def test_order_track_not_modified(self):
+        url = f'/api/orders/{self.order.order_number}/track/'
+        last_modified = self.client.get(url)['Last-Modified']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_order_list_by_email(self):
+        response = self.client.get('/api/orders/', {'email': 'buyer@example.com'})
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_authenticate(User.objects.create_user('shopper'))
+        response = self.client.get('/api/orders/', {'email': 'buyer@example.com'})
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_authenticate(
+            User.objects.create_user('clerk', is_staff=True))
+        response = self.client.get('/api/orders/', {'email': 'buyer@example.com'})
+        self.assertEqual(response.json()['count'], 5)
+        response = self.client.get('/api/orders/', {'email': 'nobody@example.com'})
+        self.assertEqual(response.json()['count'], 0)
+
+
+def checkout(client):
+    return client.post('/api/orders/create_order/', {
+        'full_name': 'Test Buyer', 'email': 'buyer@example.com', 'phone': '555',
+        'address': '1 Main St', 'city': 'Town', 'postal_code': '00000', 'country': 'US',
+    }, format='json')
+
+
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(products=6)
+
+    def fill(self, products, quantity=2):
+        client = APIClient()
+        client.post('/api/cart/batch/', {'operations': [
+            {'op': 'add', 'product_id': product.id, 'size_id': product.sizes.first().id,
+             'quantity': quantity}
+            for product in products
+        ]}, format='json')
+        return client
+
+    def test_stock_taken_and_cart_emptied(self):
+        a, b = self.catalog[:2]
+        client = self.fill([a, b])
+        response = checkout(client)
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get()
+        self.assertEqual(order.subtotal, (a.final_price + b.final_price) * 2)
+        self.assertEqual(order.total, order.subtotal + Decimal('10.00'))
+        self.assertEqual(
+            sorted(order.items.values_list('product_id', 'quantity', 'price')),
+            [(a.id, 2, a.final_price), (b.id, 2, b.final_price)])
+        for product in (a, b):
+            product.refresh_from_db()
+            self.assertEqual(product.stock, 8)
+            self.assertEqual(product.sizes.first().stock, 3)
+        self.assertEqual(client.get('/api/cart/count/').json(), {'count': 0})
+
+    def test_sale_invalidates_cached_stock(self):
+        product = self.catalog[0]
+        client = self.fill([product])
+        url = f'/api/products/{product.slug}/'
+        etag = client.get(url)['ETag']
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(checkout(client).status_code, 201)
+        self.assertGreater(get_catalog_version(), version)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['stock'], 8)
+
+    def test_queries_do_not_grow_with_the_cart(self):
+        def checkout_queries(products):
+            client = self.fill(products, quantity=1)
+            with CaptureQueriesContext(connection) as captured:
+                self.assertEqual(checkout(client).status_code, 201)
+            return len(captured)
+
+        self.assertEqual(checkout_queries(self.catalog[:1]), checkout_queries(self.catalog[1:]))
+
+    def test_short_stock_fails_the_whole_order(self):
+        a, b = self.catalog[:2]
+        client = self.fill([a, b], quantity=3)
+        Size.objects.filter(pk=b.sizes.first().pk).update(stock=2)
+        response = checkout(client)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': f'Insufficient stock for {b.name} (size M)'})
+        self.assertFalse(Order.objects.exists())
+        a.refresh_from_db()
+        self.assertEqual((a.stock, a.sizes.first().stock), (10, 5))
+        self.assertEqual(client.get('/api/cart/count/').json(), {'count': 6})
+
+    def test_empty_cart(self):
+        self.assertEqual(checkout(APIClient()).json(), {'error': 'Cart is empty'})
+
+    def test_invalid_details_are_rejected_before_the_cart(self):
+        client = self.fill(self.catalog[:1])
+        response = client.post('/api/orders/create_order/', {'phone': '555'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            set(response.json()),
+            {'full_name', 'email', 'address', 'city', 'postal_code', 'country'})
+        for cost in ['NaN', 'Infinity', '-5', 'free']:
+            with self.subTest(cost=cost):
+                response = client.post('/api/orders/create_order/', {
+                    'full_name': 'Test Buyer', 'email': 'buyer@example.com',
+                    'phone': '555', 'address': '1 Main St', 'city': 'Town',
+                    'postal_code': '00000', 'country': 'US', 'shipping_cost': cost,
+                }, format='json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('shipping_cost', response.json())
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(client.get('/api/cart/count/').json(), {'count': 2})
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    def test_no_oversell(self):
+        product = Product.objects.create(
+            name='Sneaker', description='Seeded', price=Decimal('100.00'), stock=5,
+            category=Category.objects.create(name='Category'),
+            brand=Brand.objects.create(name='Brand'))
+        clients = []
+        for _ in range(12):
+            client = APIClient()
+            client.post('/api/cart/add/', {'product_id': product.id}, format='json')
+            clients.append(client)
+
+        def buy(client):
+            try:
+                return checkout(client).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            statuses = Counter(pool.map(buy, clients))
+        self.assertEqual(statuses, {201: 5, 400: 7})
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(OrderItem.objects.count(), 5)
@@ -1,72 +1,86 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
+from django.db.models import Prefetch
+from .checkout import CheckoutError, place_order
 from .models import Order, OrderItem
-from .serializers import OrderSerializer
-from cart.models import Cart
+from .serializers import CreateOrderSerializer, OrderSerializer
+from cart.identity import cart_key
+from products.cache import get_catalog_modified, get_catalog_version
+from sneakers_backend.conditional import conditional_get, to_timestamp
+from sneakers_backend.pagination import CatalogPagination
+
+
+def order_items_prefetch():
+    """Order items with everything the order serializer renders"""
+    return Prefetch(
+        'items',
+        queryset=OrderItem.objects.select_related(
+            'product__category', 'product__brand', 'size'
+        ).prefetch_related('product__images'),
+    )
 
 
 class OrderViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.all()
+    """
+    Orders hold customers' personal data: only placing an order and
+    tracking one by its order number are open to everyone, listing and
+    editing orders are staff only
+    """
+    queryset = Order.objects.prefetch_related(order_items_prefetch())
     serializer_class = OrderSerializer
+    pagination_class = CatalogPagination
+
+    def get_permissions(self):
+        if self.action in ('create_order', 'track'):
+            return [AllowAny()]
+        return [IsAdminUser()]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        # Filter by customer email
+        email = self.request.query_params.get('email')
+        if email:
+            queryset = queryset.filter(email=email)
+
+        return queryset
 
     @action(detail=False, methods=['post'])
     def create_order(self, request):
-        session_key = request.session.session_key
+        serializer = CreateOrderSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        details = dict(serializer.validated_data)
+        shipping_cost = details.pop('shipping_cost')
 
         try:
-            cart = Cart.objects.get(session_key=session_key)
-        except Cart.DoesNotExist:
+            order = place_order(cart_key(request), details, shipping_cost)
+        except CheckoutError as exc:
             return Response(
-                {'error': 'Cart is empty'},
+                {'error': exc.message},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        if not cart.items.exists():
-            return Response(
-                {'error': 'Cart is empty'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        # Create order
-        order_data = {
-            'full_name': request.data.get('full_name'),
-            'email': request.data.get('email'),
-            'phone': request.data.get('phone'),
-            'address': request.data.get('address'),
-            'city': request.data.get('city'),
-            'postal_code': request.data.get('postal_code'),
-            'country': request.data.get('country'),
-            'subtotal': cart.total_price,
-            'shipping_cost': request.data.get('shipping_cost', 10.00),
-            'notes': request.data.get('notes', ''),
-        }
-
-        order_data['total'] = float(
-            order_data['subtotal']) + float(order_data['shipping_cost'])
-
-        order = Order.objects.create(**order_data)
-
-        # Create order items from cart items
-        for cart_item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                size=cart_item.size,
-                quantity=cart_item.quantity,
-                price=cart_item.product.final_price
-            )
-
-        # Clear cart
-        cart.items.all().delete()
-
+        order = self.queryset.get(pk=order.pk)
         serializer = self.get_serializer(order)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    def track_validators(self, request, pk=None):
+        """Validators from the order's updated_at and the catalog version"""
+        updated_at = Order.objects.filter(
+            order_number=pk).values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            return None, None
+        etag = f'order-{pk}-{to_timestamp(updated_at)}-{get_catalog_version()}'
+        return etag, max(to_timestamp(updated_at), get_catalog_modified())
+
     @action(detail=True, methods=['get'])
+    @conditional_get('track_validators')
     def track(self, request, pk=None):
         try:
-            order = Order.objects.get(order_number=pk)
+            order = self.get_queryset().get(order_number=pk)
             serializer = self.get_serializer(order)
             return Response(serializer.data)
         except Order.DoesNotExist:
@@ -0,0 +1,11 @@
+from django.urls import path
+
+from . import async_views
+
+urlpatterns = [
+    path('products/', async_views.product_list, name='async-product-list'),
+    path('products/<slug:slug>/', async_views.product_detail, name='async-product-detail'),
+    path('categories/', async_views.category_list, name='async-category-list'),
+    path('brands/', async_views.brand_list, name='async-brand-list'),
+    path('reviews/', async_views.review_list, name='async-review-list'),
+]
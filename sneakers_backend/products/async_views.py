@@ -0,0 +1,90 @@
+"""
+Async variants of the hot catalog read endpoints, served under
+``/api/async/``; see ``sneakers_backend.async_api``.
+
+Responses match the corresponding DRF endpoints.  The product list always
+uses the ``values()`` row serializer, and the category and brand lists
+share the catalog response cache (under their own keys).
+"""
+
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import NotFound
+
+from sneakers_backend.async_api import async_api_view, json_response, viewset_for
+from .cache import async_cached_catalog_response
+from .listing import ProductRowSerializer, row_queryset
+from .models import Product
+from .popularity import arecord_view
+from .search import product_index
+from .serializers import (
+    CategorySerializer, BrandSerializer, ProductDetailSerializer,
+    ReviewSerializer, aprime_product_counts, sparse_fieldset,
+)
+from .views import CategoryViewSet, BrandViewSet, ProductViewSet, ReviewViewSet
+
+
+async def _paginated(view, queryset, request, serialize):
+    paginator = view.paginator
+    page = await paginator.apaginate_queryset(queryset, request, view=view)
+    data = await serialize(page)
+    return json_response(paginator.get_paginated_response(data).data)
+
+
+async def _serialized_list(viewset_class, serializer_class, request):
+    view = viewset_for(viewset_class, request, 'list')
+    context = view.get_serializer_context()
+
+    async def serialize(items):
+        return serializer_class(items, many=True, context=context).data
+
+    return await _paginated(view, view.get_queryset(), request, serialize)
+
+
+@async_api_view
+async def product_list(request):
+    view = viewset_for(ProductViewSet, request, 'list')
+    if request.query_params.get('search', '').strip():
+        # Building the index reads every product; do it off the event loop
+        await sync_to_async(product_index.ensure_built)()
+
+    queryset = row_queryset(
+        view.filter_queryset(view.get_queryset()),
+        *sparse_fieldset(request.query_params))
+    context = view.get_serializer_context()
+
+    async def serialize(rows):
+        return await ProductRowSerializer(rows, context).adata()
+
+    return await _paginated(view, queryset, request, serialize)
+
+
+@async_api_view
+async def product_detail(request, slug):
+    view = viewset_for(ProductViewSet, request, 'retrieve', slug=slug)
+    try:
+        product = await view.get_queryset().aget(slug=slug)
+    except Product.DoesNotExist:
+        raise NotFound()
+
+    context = view.get_serializer_context()
+    await aprime_product_counts(context, [product])
+    data = ProductDetailSerializer(product, context=context).data
+    await arecord_view(product.pk)
+    return json_response(data)
+
+
+@async_api_view
+@async_cached_catalog_response
+async def category_list(request):
+    return await _serialized_list(CategoryViewSet, CategorySerializer, request)
+
+
+@async_api_view
+@async_cached_catalog_response
+async def brand_list(request):
+    return await _serialized_list(BrandViewSet, BrandSerializer, request)
+
+
+@async_api_view
+async def review_list(request):
+    return await _serialized_list(ReviewViewSet, ReviewSerializer, request)
@@ -0,0 +1,261 @@
+"""
+Versioned response cache for anonymous catalog endpoints.
+
+Every cache key embeds a catalog version number that is bumped by the
+save/delete signals of the catalog models, so a change anywhere in the
+catalog invalidates all cached responses at once without enumerating keys.
+
+The version is kept in the database (``CatalogState``), so a bump in one
+process (another worker, ``manage.py import_catalog``) reaches all of
+them, and each process caches it for ``CATALOG_STATE_TTL`` seconds: a
+change made elsewhere shows in cached responses and ETags within that
+time, and reading the version costs one query per interval.  The same row
+carries the search index generation (see products.search).
+
+Stampede protection works on two levels:
+
+* an entry past its soft expiry keeps being served while the single worker
+  that wins a ``cache.add`` lock rebuilds it (stale-while-revalidate);
+* on a cold key (first hit, or right after a version bump) the lock winner
+  rebuilds while other workers poll briefly for its result.
+
+Only ``add``, ``get``, ``set`` and ``delete`` are used, so this works with
+the local-memory backend as well as a shared cache.
+
+JSON responses are cached rendered and precompressed, so a hit is served
+without rendering or compressing anything; other renderers (the browsable
+API) render the cached data as usual.
+"""
+
+import functools
+import time
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from sneakers_backend.compression import compress_variants, precompressed_response
+
+
+STATE_KEY = 'catalog:state'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def get_cache():
+    return caches[_setting('CATALOG_CACHE_ALIAS', 'default')]
+
+
+def _fresh_version():
+    # Millisecond clock, so a sequence restarted after the key is evicted
+    # cannot reuse a version handed out by the previous one
+    return int(time.time() * 1000)
+
+
+def _load_state():
+    """
+    ``(version, modified, search generation)`` from the database, cached
+    for a while
+    """
+    from .models import CatalogState
+
+    row = CatalogState.objects.filter(pk=1).values_list(
+        'version', 'modified', 'search_generation').first()
+    # No change recorded yet: version 0, modified now
+    state = row or (0, time.time(), 0)
+    get_cache().set(STATE_KEY, state, timeout=_setting('CATALOG_STATE_TTL', 5))
+    return state
+
+
+def _catalog_state():
+    return get_cache().get(STATE_KEY) or _load_state()
+
+
+def get_catalog_version():
+    return _catalog_state()[0]
+
+
+async def aget_catalog_version():
+    """``get_catalog_version`` without blocking the event loop"""
+    state = await get_cache().aget(STATE_KEY)
+    if state is None:
+        state = await sync_to_async(_load_state)()
+    return state[0]
+
+
+def get_catalog_modified():
+    """Unix time of the last catalog change (now, if unknown)"""
+    return _catalog_state()[1]
+
+
+def get_search_generation():
+    return _catalog_state()[2]
+
+
+def bump_catalog_version(reindex=False):
+    """
+    Invalidate cached catalog responses in every process; with ``reindex``
+    also have every process rebuild its search index
+    """
+    from .models import CatalogState
+
+    now = time.time()
+    # At least the millisecond clock, so a version handed out by a bump
+    # that was rolled back is never reused for a different catalog
+    changes = {
+        'version': Greatest(F('version') + 1, Value(_fresh_version())),
+        'modified': now,
+    }
+    if reindex:
+        changes['search_generation'] = F('search_generation') + 1
+    if not CatalogState.objects.filter(pk=1).update(**changes):
+        CatalogState.objects.get_or_create(pk=1, defaults={
+            'version': _fresh_version(), 'modified': now,
+            'search_generation': int(reindex)})
+    return _load_state()[0]
+
+
+def response_cache_key(request, version):
+    params = sorted(request.query_params.lists())
+    query = urlencode([(k, v) for k, values in params for v in values])
+    return f'catalog:{version}:response:{request.path}?{query}'
+
+
+def _encoded(request):
+    return isinstance(getattr(request, 'accepted_renderer', None), JSONRenderer)
+
+
+def _cached(request, entry, cache_status, encoded=None):
+    """Response for a cached ``{'data', 'bodies', 'content_type'}`` payload"""
+    payload = entry[0]
+    if encoded is None:
+        encoded = _encoded(request)
+    if payload.get('bodies') is not None and encoded:
+        response = precompressed_response(
+            request, payload['bodies'], payload['content_type'])
+    else:
+        response = Response(payload['data'])
+    response['X-Cache'] = cache_status
+    return response
+
+
+def _rebuild(view, request, cache, key, build, timeout, grace):
+    response = build()
+    if response.status_code != 200:
+        return response
+
+    payload = {'data': response.data, 'bodies': None, 'content_type': None}
+    if _encoded(request):
+        renderer = request.accepted_renderer
+        body = renderer.render(
+            response.data, request.accepted_media_type, view.get_renderer_context())
+        payload['bodies'] = compress_variants(body)
+        payload['content_type'] = renderer.media_type
+    entry = (payload, time.time() + timeout)
+    cache.set(key, entry, timeout=timeout + grace)
+    return _cached(request, entry, 'MISS')
+
+
+def cached_catalog_response(view_method):
+    """
+    Cache the data of a GET viewset method for anonymous users.
+
+    Responses are cached for ``CATALOG_CACHE_TIMEOUT`` seconds and served
+    stale for up to ``CATALOG_CACHE_GRACE`` more while one worker rebuilds.
+    """
+
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.method != 'GET' or request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+
+        cache = get_cache()
+        timeout = _setting('CATALOG_CACHE_TIMEOUT', 300)
+        grace = _setting('CATALOG_CACHE_GRACE', 30)
+        lock_timeout = _setting('CATALOG_CACHE_LOCK_TIMEOUT', 10)
+
+        key = response_cache_key(request, get_catalog_version())
+        lock_key = f'{key}:lock'
+
+        def build():
+            return view_method(self, request, *args, **kwargs)
+
+        entry = cache.get(key)
+        if entry is not None:
+            soft_expiry = entry[1]
+            if time.time() >= soft_expiry and cache.add(lock_key, 1, lock_timeout):
+                try:
+                    return _rebuild(self, request, cache, key, build, timeout, grace)
+                finally:
+                    cache.delete(lock_key)
+            return _cached(request, entry, 'HIT')
+
+        if cache.add(lock_key, 1, lock_timeout):
+            try:
+                return _rebuild(self, request, cache, key, build, timeout, grace)
+            finally:
+                cache.delete(lock_key)
+
+        # Another worker is rebuilding this key; wait briefly for it
+        deadline = time.monotonic() + _setting('CATALOG_CACHE_WAIT', 2.0)
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None:
+                return _cached(request, entry, 'HIT')
+        return build()
+
+    return wrapper
+
+
+def async_cached_catalog_response(view):
+    """
+    ``cached_catalog_response`` for the async views in ``/api/async/``,
+    which are anonymous and return rendered JSON.
+
+    A stale entry is rebuilt by the request that wins the lock while others
+    keep serving it; a cold key is built by every request that misses it.
+    The cache is used through its async methods, so a database or network
+    cache neither fails nor blocks the event loop.
+    """
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        cache = get_cache()
+        timeout = _setting('CATALOG_CACHE_TIMEOUT', 300)
+        grace = _setting('CATALOG_CACHE_GRACE', 30)
+        lock_timeout = _setting('CATALOG_CACHE_LOCK_TIMEOUT', 10)
+
+        key = response_cache_key(request, await aget_catalog_version())
+        lock_key = f'{key}:lock'
+
+        entry = await cache.aget(key)
+        if entry is not None and (
+                time.time() < entry[1] or not await cache.aadd(lock_key, 1, lock_timeout)):
+            return _cached(request, entry, 'HIT', encoded=True)
+
+        try:
+            response = await view(request, *args, **kwargs)
+        finally:
+            if entry is not None:
+                await cache.adelete(lock_key)
+        if response.status_code != 200:
+            return response
+
+        payload = {
+            'data': None,
+            'bodies': compress_variants(response.content),
+            'content_type': response['Content-Type'],
+        }
+        entry = (payload, time.time() + timeout)
+        await cache.aset(key, entry, timeout=timeout + grace)
+        return _cached(request, entry, 'MISS', encoded=True)
+
+    return wrapper
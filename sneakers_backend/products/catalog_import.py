@@ -0,0 +1,419 @@
+"""
+Streaming bulk import of catalog feeds.
+
+Feeds are CSV or JSON Lines files, one per entity, read row by row and
+written in fixed-size batches so memory stays constant regardless of the
+feed size:
+
+* categories / brands: ``name``, optional ``slug``, ``description``,
+  ``is_active`` (and ``logo`` for brands); upserted by slug.  Optional
+  columns missing from a batch leave the existing values alone.
+* products: ``name``, ``description``, ``price``, ``category`` and ``brand``
+  (slug or name), plus any of ``slug``, ``discount_price``, ``gender``,
+  ``color``, ``stock``, ``is_available``, ``is_featured``,
+  ``is_new_arrival``, ``is_best_seller``.  Rows with a ``slug`` are upserted
+  by it; rows without one are known by brand and name, so they update the
+  existing product of that brand and name (the oldest, if several) or are
+  inserted under a generated unique slug, and a re-run updates in place.
+* sizes: ``product`` (slug), ``size``, ``us_size``, ``stock``; upserted by
+  product and size.
+* images: ``product`` (slug), ``image`` (storage path), ``is_primary``;
+  upserted by product and path.
+
+Foreign keys are resolved through in-memory slug maps (categories, brands)
+or one ``slug__in`` query per batch (products).  Each batch is written with
+``bulk_create``/``bulk_update`` inside its own transaction.
+"""
+
+import csv
+import json
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+from .models import Category, Brand, Product, ProductImage, Size
+
+
+TRUE_VALUES = {'true', '1', 'yes', 'y', 't'}
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_rows(path, file_format=None):
+    """Yield dict rows from a CSV or JSON Lines file, one at a time"""
+    path = Path(path)
+    file_format = file_format or (
+        'jsonl' if path.suffix.lower() in ('.jsonl', '.ndjson', '.json') else 'csv')
+    with path.open(newline='', encoding='utf-8') as handle:
+        if file_format == 'csv':
+            yield from csv.DictReader(handle)
+        else:
+            for line in handle:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _text(row, key, default=''):
+    value = row.get(key)
+    if value is None:
+        return default
+    return str(value).strip()
+
+
+def _required(row, key):
+    value = _text(row, key)
+    if not value:
+        raise RowError(f'missing {key}')
+    return value
+
+
+def _bool(row, key, default):
+    value = row.get(key)
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in TRUE_VALUES
+
+
+def _int(row, key, default=0):
+    value = row.get(key)
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise RowError(f'invalid {key}: {value!r}')
+
+
+def _decimal(row, key, required=True):
+    value = row.get(key)
+    if value is None or value == '':
+        if required:
+            raise RowError(f'missing {key}')
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise RowError(f'invalid {key}: {value!r}')
+
+
+@dataclass
+class ImportStats:
+    entity: str
+    rows: int = 0
+    written: int = 0
+    skipped: int = 0
+    batches: int = 0
+    started: float = field(default_factory=time.monotonic)
+    finished: float = None
+    errors: list = field(default_factory=list)
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rate(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def skip(self, line, error, keep=20):
+        self.skipped += 1
+        if len(self.errors) < keep:
+            self.errors.append(f'{self.entity} row {line}: {error}')
+
+
+class CatalogImporter:
+    """
+    Upsert catalog feeds in batches.
+
+    ``progress`` is called with the running ``ImportStats`` after every
+    batch.
+    """
+
+    def __init__(self, batch_size=1000, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress or (lambda stats: None)
+        self.category_ids = {}
+        self.brand_ids = {}
+
+    # Lookup maps
+
+    def load_lookups(self):
+        self.category_ids = self._lookup_map(Category)
+        self.brand_ids = self._lookup_map(Brand)
+
+    @staticmethod
+    def _lookup_map(model):
+        """slug and lowercased name -> id; these tables are small"""
+        lookup = {}
+        for pk, slug, name in model.objects.values_list('id', 'slug', 'name'):
+            lookup.setdefault(name.lower(), pk)
+            lookup[slug] = pk
+        return lookup
+
+    def _resolve(self, lookup, row, key):
+        value = _required(row, key)
+        pk = lookup.get(value) or lookup.get(value.lower()) or lookup.get(slugify(value))
+        if pk is None:
+            raise RowError(f'unknown {key} {value!r}')
+        return pk
+
+    @staticmethod
+    def _slugs_by_name(keys):
+        """``{(brand_id, name): slug}`` of the oldest existing product of each"""
+        slugs = {}
+        rows = Product.objects.filter(
+            brand_id__in={brand_id for brand_id, _ in keys},
+            name__in={name for _, name in keys},
+        ).order_by('id').values_list('brand_id', 'name', 'slug')
+        for brand_id, name, slug in rows:
+            if (brand_id, name) in keys:
+                slugs.setdefault((brand_id, name), slug)
+        return slugs
+
+    @staticmethod
+    def _product_ids(slugs):
+        return dict(
+            Product.objects.filter(slug__in=set(slugs)).values_list('slug', 'id'))
+
+    # Driver
+
+    def run(self, entity, rows):
+        handler = getattr(self, f'_import_{entity}_batch')
+        stats = ImportStats(entity)
+        line = 0
+        for batch in batched(rows, self.batch_size):
+            numbered = []
+            for row in batch:
+                line += 1
+                numbered.append((line, row))
+            with transaction.atomic():
+                stats.written += handler(numbered, stats)
+            stats.rows += len(batch)
+            stats.batches += 1
+            self.progress(stats)
+        stats.finished = time.monotonic()
+        if entity in ('categories', 'brands'):
+            self.load_lookups()
+        return stats
+
+    # Categories and brands
+
+    def _import_named_batch(self, model, numbered, stats, extra_fields):
+        # Only columns the feed has are written over existing rows
+        optional = ['description', 'is_active', *extra_fields]
+        present = [
+            column for column in optional
+            if any(column in row for _, row in numbered)]
+        objs = {}
+        for line, row in numbered:
+            try:
+                name = _required(row, 'name')
+                slug = _text(row, 'slug') or slugify(name)
+                values = {
+                    'name': name,
+                    'slug': slug,
+                    'description': _text(row, 'description'),
+                    'is_active': _bool(row, 'is_active', True),
+                }
+                for extra in extra_fields:
+                    values[extra] = _text(row, extra) or None
+            except RowError as error:
+                stats.skip(line, error)
+                continue
+            objs[slug] = model(**values)
+
+        model.objects.bulk_create(
+            list(objs.values()),
+            update_conflicts=True,
+            unique_fields=['slug'],
+            update_fields=['name', *present],
+        )
+        return len(objs)
+
+    def _import_categories_batch(self, numbered, stats):
+        return self._import_named_batch(Category, numbered, stats, [])
+
+    def _import_brands_batch(self, numbered, stats):
+        return self._import_named_batch(Brand, numbered, stats, ['logo'])
+
+    # Products
+
+    def _import_products_batch(self, numbered, stats):
+        keyed = {}
+        unslugged = {}
+        for line, row in numbered:
+            try:
+                product = Product(
+                    name=_required(row, 'name'),
+                    slug=_text(row, 'slug'),
+                    description=_text(row, 'description'),
+                    price=_decimal(row, 'price'),
+                    discount_price=_decimal(row, 'discount_price', required=False),
+                    category_id=self._resolve(self.category_ids, row, 'category'),
+                    brand_id=self._resolve(self.brand_ids, row, 'brand'),
+                    gender=_text(row, 'gender') or 'unisex',
+                    color=_text(row, 'color'),
+                    stock=_int(row, 'stock'),
+                    is_available=_bool(row, 'is_available', True),
+                    is_featured=_bool(row, 'is_featured', False),
+                    is_new_arrival=_bool(row, 'is_new_arrival', False),
+                    is_best_seller=_bool(row, 'is_best_seller', False),
+                )
+            except RowError as error:
+                stats.skip(line, error)
+                continue
+            if product.slug:
+                keyed[product.slug] = product
+            else:
+                unslugged[(product.brand_id, product.name)] = product
+
+        # Rows without a slug update the product of the same brand and name
+        existing = self._slugs_by_name(unslugged) if unslugged else {}
+        new = []
+        for key, product in unslugged.items():
+            if key in existing:
+                product.slug = existing[key]
+                # A row naming the slug itself wins
+                keyed.setdefault(product.slug, product)
+            else:
+                new.append(product)
+        self.assign_unique_slugs(new, reserved=set(keyed))
+
+        update_fields = [
+            'name', 'description', 'price', 'discount_price', 'category',
+            'brand', 'gender', 'color', 'stock', 'is_available',
+            'is_featured', 'is_new_arrival', 'is_best_seller', 'updated_at',
+        ]
+        Product.objects.bulk_create(
+            list(keyed.values()) + new,
+            update_conflicts=True,
+            unique_fields=['slug'],
+            update_fields=update_fields,
+        )
+        return len(keyed) + len(new)
+
+    @staticmethod
+    def assign_unique_slugs(products, reserved=()):
+        """
+        Give each product a slug derived from its name that is unique in the
+        database and within the batch: ``name``, ``name-2``, ``name-3``...
+
+        One query checks all base slugs; prefix range queries run only for
+        the bases that are already taken.
+        """
+        if not products:
+            return
+        bases = [slugify(p.name)[:45] or 'product' for p in products]
+        counts = Counter(bases)
+        taken = set(
+            Product.objects.filter(slug__in=counts).order_by()
+            .values_list('slug', flat=True))
+        taken.update(reserved)
+
+        clashing = sorted(
+            base for base, count in counts.items()
+            if base in taken or count > 1
+        )
+        # 'base-' <= slug < 'base.' is the 'base-' prefix as an index range
+        # ('.' sorts right after '-'); chunked to stay under SQLite's
+        # expression depth limit
+        for start in range(0, len(clashing), 200):
+            condition = Q()
+            for base in clashing[start:start + 200]:
+                condition |= Q(slug__gte=f'{base}-', slug__lt=f'{base}.')
+            taken.update(
+                Product.objects.filter(condition).order_by()
+                .values_list('slug', flat=True))
+
+        for product, base in zip(products, bases):
+            slug, n = base, 1
+            while slug in taken:
+                n += 1
+                slug = f'{base}-{n}'
+            taken.add(slug)
+            product.slug = slug
+
+    # Sizes and images
+
+    def _import_sizes_batch(self, numbered, stats):
+        product_ids = self._product_ids(_text(row, 'product') for _, row in numbered)
+        objs = {}
+        for line, row in numbered:
+            try:
+                slug = _required(row, 'product')
+                if slug not in product_ids:
+                    raise RowError(f'unknown product {slug!r}')
+                size = Size(
+                    product_id=product_ids[slug],
+                    size=_required(row, 'size'),
+                    us_size=_decimal(row, 'us_size'),
+                    stock=_int(row, 'stock'),
+                )
+            except RowError as error:
+                stats.skip(line, error)
+                continue
+            objs[(size.product_id, size.size)] = size
+
+        Size.objects.bulk_create(
+            list(objs.values()),
+            update_conflicts=True,
+            unique_fields=['product', 'size'],
+            update_fields=['us_size', 'stock'],
+        )
+        return len(objs)
+
+    def _import_images_batch(self, numbered, stats):
+        product_ids = self._product_ids(_text(row, 'product') for _, row in numbered)
+        rows = {}
+        for line, row in numbered:
+            try:
+                slug = _required(row, 'product')
+                if slug not in product_ids:
+                    raise RowError(f'unknown product {slug!r}')
+                key = (product_ids[slug], _required(row, 'image'))
+            except RowError as error:
+                stats.skip(line, error)
+                continue
+            rows[key] = _bool(row, 'is_primary', False)
+
+        existing = {
+            (product_id, image): pk
+            for pk, product_id, image in ProductImage.objects.filter(
+                product_id__in={product_id for product_id, _ in rows}
+            ).values_list('id', 'product_id', 'image')
+        }
+        to_create, to_update = [], []
+        for (product_id, image), is_primary in rows.items():
+            obj = ProductImage(
+                pk=existing.get((product_id, image)), product_id=product_id,
+                image=image, is_primary=is_primary)
+            (to_update if obj.pk else to_create).append(obj)
+
+        ProductImage.objects.bulk_create(to_create)
+        ProductImage.objects.bulk_update(to_update, ['is_primary'])
+        return len(rows)
+
+
+ENTITIES = ['categories', 'brands', 'products', 'sizes', 'images']
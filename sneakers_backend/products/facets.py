@@ -0,0 +1,143 @@
+"""
+Single-pass facet counts for the product ``filters`` action.
+
+All facet counts and the price range are derived from one grouped query
+over the product queryset *without* the facet filters applied.  Each row of
+that query is a distinct (category, brand, gender, color) combination with
+its product count and price bounds, so the number of rows is bounded by the
+attribute combinations that exist rather than by the catalog size.
+
+Counts are disjunctive: the count shown next to a facet value reflects
+every other active filter but not the facet's own selection, so choosing
+a brand does not collapse the rest of the brand list to zero.
+"""
+
+from django.db.models import Count, Max, Min
+
+
+# query param -> queryset lookup
+FACET_FILTERS = {
+    'category': 'category__slug',
+    'brand': 'brand__slug',
+    'gender': 'gender',
+    'color': 'color__icontains',
+}
+
+GROUP_FIELDS = [
+    'category_id', 'category__name', 'category__slug', 'category__is_active',
+    'brand_id', 'brand__name', 'brand__slug', 'brand__is_active',
+    'gender', 'color',
+]
+
+
+def selected_facets(query_params):
+    """Extract the active facet selections from request query params"""
+    return {
+        name: query_params.get(name)
+        for name in FACET_FILTERS
+        if query_params.get(name)
+    }
+
+
+def apply_facet_filters(queryset, selected):
+    lookups = {FACET_FILTERS[name]: value for name, value in selected.items()}
+    return queryset.filter(**lookups) if lookups else queryset
+
+
+def _row_matches(row, name, value):
+    if name == 'category':
+        return row['category__slug'] == value
+    if name == 'brand':
+        return row['brand__slug'] == value
+    if name == 'gender':
+        return row['gender'] == value
+    if name == 'color':
+        return value.lower() in (row['color'] or '').lower()
+    return True
+
+
+class ProductFacets:
+    """
+    Compute facet counts and the price range for a product queryset.
+
+    ``queryset`` must carry every non-facet filter (availability, flags,
+    price range, search) but none of the facet filters in ``selected``.
+    """
+
+    def __init__(self, queryset, selected):
+        self.queryset = queryset
+        self.selected = selected
+
+    def rows(self):
+        return list(
+            self.queryset.order_by().prefetch_related(None)
+            .values(*GROUP_FIELDS)
+            .annotate(count=Count('id'), min_price=Min('effective_price'),
+                      max_price=Max('effective_price'))
+        )
+
+    def _matches(self, row, skip=None):
+        return all(
+            _row_matches(row, name, value)
+            for name, value in self.selected.items()
+            if name != skip
+        )
+
+    def compute(self):
+        rows = self.rows()
+
+        categories = {}
+        brands = {}
+        genders = {}
+        colors = {}
+        price_min = price_max = None
+
+        for row in rows:
+            count = row['count']
+
+            if row['category__is_active'] and self._matches(row, skip='category'):
+                entry = categories.setdefault(row['category_id'], {
+                    'id': row['category_id'],
+                    'name': row['category__name'],
+                    'slug': row['category__slug'],
+                    'product_count': 0,
+                })
+                entry['product_count'] += count
+
+            if row['brand__is_active'] and self._matches(row, skip='brand'):
+                entry = brands.setdefault(row['brand_id'], {
+                    'id': row['brand_id'],
+                    'name': row['brand__name'],
+                    'slug': row['brand__slug'],
+                    'product_count': 0,
+                })
+                entry['product_count'] += count
+
+            if self._matches(row, skip='gender'):
+                genders[row['gender']] = genders.get(row['gender'], 0) + count
+
+            if row['color'] and self._matches(row, skip='color'):
+                colors[row['color']] = colors.get(row['color'], 0) + count
+
+            if self._matches(row):
+                if price_min is None or row['min_price'] < price_min:
+                    price_min = row['min_price']
+                if price_max is None or row['max_price'] > price_max:
+                    price_max = row['max_price']
+
+        return {
+            'categories': sorted(categories.values(), key=lambda c: c['name']),
+            'brands': sorted(brands.values(), key=lambda b: b['name']),
+            'genders': [
+                {'value': value, 'count': count}
+                for value, count in sorted(genders.items())
+            ],
+            'colors': [
+                {'value': value, 'count': count}
+                for value, count in sorted(colors.items())
+            ],
+            'price_range': {
+                'min': price_min if price_min is not None else 0,
+                'max': price_max if price_max is not None else 0,
+            },
+        }
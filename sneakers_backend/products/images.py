@@ -0,0 +1,266 @@
+"""
+Resized derivatives of product images and brand logos.
+
+Every uploaded image gets ``thumbnail``, ``card`` and ``zoom`` variants in
+WebP and JPEG.  Resizing runs in a process pool so it neither blocks the
+request that saved the image nor contends for the GIL with request threads;
+a small dispatcher thread reads the original, waits for the pool and
+stores the result.
+
+The generated paths are recorded on the model (``ProductImage.variants``,
+``Brand.logo_variants``) so serializers can build URLs without touching
+storage::
+
+    {
+        "source": "products/shoe.png",
+        "thumbnail": {"width": 160, "height": 120,
+                      "webp": "derivatives/products/shoe/thumbnail.webp",
+                      "jpeg": "derivatives/products/shoe/thumbnail.jpg"},
+        ...
+    }
+
+Missing or stale variants (after a bulk import, say) are filled in by the
+``generate_image_variants`` management command.
+"""
+
+import io
+import logging
+import posixpath
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+
+
+logger = logging.getLogger(__name__)
+
+# name -> bounding box; images are scaled down to fit, never up
+VARIANTS = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'zoom': (1600, 1600),
+}
+
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def render_variants(source, variants=VARIANTS, formats=tuple(FORMATS)):
+    """
+    Resize image bytes into every variant and format.
+
+    Runs in worker processes, so it only uses Pillow and plain data:
+    returns ``{variant: {'width', 'height', fmt: bytes}}``.
+    """
+    from PIL import Image, ImageOps, features
+
+    with Image.open(io.BytesIO(source)) as original:
+        original = ImageOps.exif_transpose(original)
+        original.load()
+
+    results = {}
+    for name, box in variants.items():
+        image = original.copy()
+        image.thumbnail(box, Image.LANCZOS)
+        entry = {'width': image.width, 'height': image.height}
+        for fmt in formats:
+            pil_format, _, options = FORMATS[fmt]
+            if fmt == 'webp' and not features.check('webp'):
+                continue
+            converted = image
+            if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                converted = Image.new('RGB', image.size, (255, 255, 255))
+                rgba = image.convert('RGBA')
+                converted.paste(rgba, mask=rgba.getchannel('A'))
+            buffer = io.BytesIO()
+            converted.save(buffer, pil_format, **options)
+            entry[fmt] = buffer.getvalue()
+        results[name] = entry
+    return results
+
+
+def derivative_path(source_name, variant, fmt):
+    stem = posixpath.splitext(source_name)[0]
+    return f'derivatives/{stem}/{variant}.{FORMATS[fmt][1]}'
+
+
+def store_variants(source_name, rendered, storage=default_storage):
+    """Save rendered bytes next to each other and return the variants map"""
+    variants = {'source': source_name}
+    for name, entry in rendered.items():
+        stored = {'width': entry['width'], 'height': entry['height']}
+        for fmt in FORMATS:
+            if fmt not in entry:
+                continue
+            path = derivative_path(source_name, name, fmt)
+            if storage.exists(path):
+                storage.delete(path)
+            stored[fmt] = storage.save(path, ContentFile(entry[fmt]))
+        variants[name] = stored
+    return variants
+
+
+# Pools are created lazily so that importing this module (and forking
+# worker processes) only happens in processes that actually save images
+_pools_lock = threading.Lock()
+_process_pool = None
+_dispatcher = None
+
+
+def _pools():
+    global _process_pool, _dispatcher
+    with _pools_lock:
+        if _process_pool is None:
+            workers = _setting('IMAGE_DERIVATIVE_WORKERS', 2)
+            _process_pool = ProcessPoolExecutor(max_workers=workers)
+            _dispatcher = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix='image-derivatives')
+    return _process_pool, _dispatcher
+
+
+def _record(model, pk, field_name, variants_field, source_name, variants):
+    # Only record if the image was not replaced in the meantime
+    return model.objects.filter(
+        pk=pk, **{field_name: source_name}).update(**{variants_field: variants})
+
+
+def generate(model, pk, field_name, variants_field, pool=None):
+    """
+    Render and store derivatives for one image field and record them.
+
+    Returns the variants map, or None when the field is empty or the
+    image changed while the variants were being rendered.
+    """
+    from .cache import bump_catalog_version
+
+    instance = model.objects.filter(pk=pk).only(field_name).first()
+    if instance is None:
+        return None
+    field_file = getattr(instance, field_name)
+    if not field_file:
+        return None
+
+    source_name = field_file.name
+    with field_file.open('rb') as handle:
+        source = handle.read()
+
+    if pool is None:
+        rendered = render_variants(source)
+    else:
+        rendered = pool.submit(render_variants, source).result()
+    variants = store_variants(source_name, rendered, field_file.storage)
+
+    if _record(model, pk, field_name, variants_field, source_name, variants):
+        bump_catalog_version()
+        return variants
+    return None
+
+
+def backfill(model, field_name, variants_field, force=False, workers=None,
+             chunk_size=32, progress=None):
+    """
+    Generate missing or outdated derivatives for every row of ``model``.
+
+    Originals are read and results stored from this thread while a process
+    pool renders up to ``chunk_size`` images at a time.  ``progress`` is
+    called with ``(done, total)`` after each chunk.  Returns
+    ``(generated, failed)``.
+    """
+    from .cache import bump_catalog_version
+
+    rows = (
+        model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+        .order_by('pk').values_list('pk', field_name, variants_field)
+    )
+    pending = [
+        (pk, name) for pk, name, variants in rows.iterator()
+        if force or (variants or {}).get('source') != name
+    ]
+    storage = model._meta.get_field(field_name).storage
+    workers = workers or _setting('IMAGE_DERIVATIVE_WORKERS', 2)
+
+    generated = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(pending), chunk_size):
+            jobs = []
+            for pk, name in pending[start:start + chunk_size]:
+                try:
+                    with storage.open(name, 'rb') as handle:
+                        source = handle.read()
+                except OSError:
+                    logger.warning('Missing image %s for %s %s', name, model.__name__, pk)
+                    failed += 1
+                    continue
+                jobs.append((pk, name, pool.submit(render_variants, source)))
+            for pk, name, future in jobs:
+                try:
+                    variants = store_variants(name, future.result(), storage)
+                except Exception:
+                    logger.exception(
+                        'Image derivatives failed for %s %s', model.__name__, pk)
+                    failed += 1
+                    continue
+                if _record(model, pk, field_name, variants_field, name, variants):
+                    generated += 1
+            if progress is not None:
+                progress(min(start + chunk_size, len(pending)), len(pending))
+
+    if generated:
+        bump_catalog_version()
+    return generated, failed
+
+
+def _generate_in_background(model, pk, field_name, variants_field):
+    try:
+        process_pool, _ = _pools()
+        generate(model, pk, field_name, variants_field, pool=process_pool)
+    except Exception:
+        logger.exception(
+            'Image derivatives failed for %s %s', model.__name__, pk)
+    finally:
+        close_old_connections()
+
+
+def schedule(instance, field_name, variants_field):
+    """
+    Queue derivative generation for an instance whose image changed, once
+    the surrounding transaction commits.  With ``IMAGE_DERIVATIVES_SYNC``
+    the work happens inline instead.
+    """
+    field_file = getattr(instance, field_name)
+    current = getattr(instance, variants_field) or {}
+    if not field_file or current.get('source') == field_file.name:
+        return
+
+    model, pk = type(instance), instance.pk
+
+    def run():
+        if _setting('IMAGE_DERIVATIVES_SYNC', False):
+            generate(model, pk, field_name, variants_field)
+        else:
+            _, dispatcher = _pools()
+            dispatcher.submit(
+                _generate_in_background, model, pk, field_name, variants_field)
+
+    transaction.on_commit(run)
+
+
+def variant_urls(variants, url_for):
+    """Turn a stored variants map into ``{variant: {fmt: url, ...}}``"""
+    return {
+        name: {
+            key: url_for(value) if key in FORMATS else value
+            for key, value in entry.items()
+        }
+        for name, entry in (variants or {}).items()
+        if name != 'source'
+    }
@@ -0,0 +1,178 @@
+"""
+Fast serialization of product cards from ``values()`` rows.
+
+``ProductListSerializer`` builds a model instance per product and runs a
+DRF field object per attribute, which dominates the cost of large list
+pages.  ``ProductRowSerializer`` produces the same output (same keys, same
+value types, honouring ``?fields=``/``?expand=``) from plain dict rows:
+one joined ``values()`` query for the page, one query for its images and
+the grouped category/brand counts shared with the DRF path.
+
+Pagination works on the ``values()`` queryset as usual; keyset cursors
+read the ordering values straight from the rows.
+"""
+
+from decimal import Decimal
+
+from .images import variant_urls
+from .models import ProductImage
+from .serializers import (
+    ProductListSerializer, aprime_product_counts, media_url_builder,
+    prime_product_counts, sparse_fieldset,
+)
+
+
+CATEGORY_FIELDS = ['id', 'name', 'slug', 'description']
+BRAND_FIELDS = ['id', 'name', 'slug', 'logo', 'logo_variants', 'description']
+
+# Everything the card renders or the list can be ordered by
+ROW_FIELDS = [
+    'id', 'name', 'slug', 'price', 'discount_price', 'effective_price', 'stock',
+    'is_available', 'featured', 'average_rating', 'review_count',
+    'created_at', 'views_count', 'popularity_score', 'category_id', 'brand_id',
+]
+
+
+def row_queryset(queryset, fields=None, expand=()):
+    """
+    Turn a product queryset into the ``values()`` queryset the row
+    serializer reads, joining category/brand columns only when rendered.
+    """
+    wanted = set(fields or ProductListSerializer.Meta.fields)
+    columns = list(ROW_FIELDS)
+    for relation, relation_fields in (('category', CATEGORY_FIELDS), ('brand', BRAND_FIELDS)):
+        if relation in wanted and (fields is None or relation in expand):
+            columns += [f'{relation}__{name}' for name in relation_fields]
+    # Keep annotations such as the search rank for ordering and cursors
+    columns += list(queryset.query.annotations)
+    return queryset.prefetch_related(None).values(*columns)
+
+
+class _RowRef(dict):
+    """A row with the foreign key attributes ``prime_product_counts`` reads"""
+
+    def __init__(self, row):
+        super().__init__(row)
+        self.category_id = row['category_id']
+        self.brand_id = row['brand_id']
+
+
+class ProductRowSerializer:
+    """
+    Render rows from ``row_queryset`` exactly like ``ProductListSerializer``
+    with ``many=True``.
+    """
+
+    def __init__(self, rows, context):
+        self.rows = list(rows)
+        self.context = context
+        request = context.get('request')
+        self.fields, self.expand = (
+            sparse_fieldset(request.query_params) if request else (None, set()))
+
+    def field_names(self):
+        names = ProductListSerializer.Meta.fields
+        if self.fields is None:
+            return names
+        return [name for name in names if name in self.fields]
+
+    def is_expanded(self, relation):
+        return self.fields is None or relation in self.expand
+
+    def needs_counts(self):
+        names = self.field_names()
+        return any(
+            name in names and self.is_expanded(name)
+            for name in ('category', 'brand'))
+
+    def needs_images(self):
+        names = self.field_names()
+        return 'primary_image' in names or 'primary_image_variants' in names
+
+    def image_rows(self):
+        return ProductImage.objects.filter(
+            product_id__in=[row['id'] for row in self.rows]
+        ).values_list('product_id', 'image', 'variants', 'is_primary')
+
+    def load(self):
+        """Run the image and count queries for the rows"""
+        images = {}
+        if self.rows and self.needs_images():
+            for product_id, *image in self.image_rows():
+                images.setdefault(product_id, []).append(tuple(image))
+        if self.rows and self.needs_counts():
+            prime_product_counts(self.context, [_RowRef(row) for row in self.rows])
+        return images
+
+    async def aload(self):
+        """``load`` with the async ORM"""
+        images = {}
+        if self.rows and self.needs_images():
+            async for product_id, *image in self.image_rows():
+                images.setdefault(product_id, []).append(tuple(image))
+        if self.rows and self.needs_counts():
+            await aprime_product_counts(self.context, [_RowRef(row) for row in self.rows])
+        return images
+
+    @property
+    def data(self):
+        return self.render(self.load())
+
+    async def adata(self):
+        return self.render(await self.aload())
+
+    def render(self, images):
+        names = self.field_names()
+        counts = self.context.get('product_counts', {})
+        url_for = media_url_builder(self.context)
+
+        results = []
+        for row in self.rows:
+            item = {}
+            for name in names:
+                if name in ('category', 'brand'):
+                    item[name] = self.relation(row, name, counts, url_for)
+                elif name in ('price', 'discount_price'):
+                    item[name] = _decimal(row[name])
+                elif name == 'final_price':
+                    item[name] = row['effective_price']
+                elif name == 'discount_percentage':
+                    price, discount_price = row['price'], row['discount_price']
+                    item[name] = (
+                        int(((price - discount_price) / price) * 100)
+                        if discount_price else 0)
+                elif name == 'primary_image':
+                    primary = _primary_image(images.get(row['id'], []))
+                    item[name] = url_for(primary[0]) if primary and primary[0] else None
+                elif name == 'primary_image_variants':
+                    primary = _primary_image(images.get(row['id'], []))
+                    item[name] = variant_urls(primary[1], url_for) if primary else {}
+                else:
+                    item[name] = row[name]
+            results.append(item)
+        return results
+
+    def relation(self, row, name, counts, url_for):
+        if not self.is_expanded(name):
+            return row[f'{name}_id']
+        relation_fields = CATEGORY_FIELDS if name == 'category' else BRAND_FIELDS
+        data = {field: row[f'{name}__{field}'] for field in relation_fields}
+        if name == 'brand':
+            data['logo'] = url_for(data['logo']) if data['logo'] else None
+            data['logo_variants'] = variant_urls(data['logo_variants'], url_for)
+        data['product_count'] = counts.get(name, {}).get(row[f'{name}_id'], 0)
+        return data
+
+
+def _primary_image(images):
+    # Same choice as ProductListSerializer: the primary image, else the
+    # first by ProductImage ordering
+    ordered = sorted(images, key=lambda image: not image[2])
+    return ordered[0] if ordered else None
+
+
+def _decimal(value):
+    # DecimalField output: a fixed two-place string, None stays None
+    if value is None:
+        return None
+    return str(Decimal(value).quantize(Decimal('0.01')))
@@ -0,0 +1,152 @@
+import asyncio
+import io
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        'In-process load test: the sync DRF endpoint through the WSGI handler '
+        'on a thread pool against the async endpoint through the ASGI handler '
+        'on one event loop. Reports throughput and p50/p99 latency.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', default='/api/products/',
+            help='Sync endpoint; the async one is the same path under /api/async/')
+        parser.add_argument(
+            '--requests', type=int, default=2000, help='Requests per mode (default: 2000)')
+        parser.add_argument(
+            '--concurrency', type=int, default=200,
+            help='Requests in flight at once (default: 200)')
+        parser.add_argument(
+            '--threads', type=int, default=16,
+            help='WSGI worker threads, as in a threaded WSGI server (default: 16)')
+        parser.add_argument(
+            '--client-delay', type=float, default=0.0,
+            help='Milliseconds each client takes to read its response, '
+                 'simulating slow connections (default: 0)')
+
+    def handle(self, *args, **options):
+        if min(options['requests'], options['concurrency'], options['threads']) < 1:
+            raise CommandError('--requests, --concurrency and --threads must be positive')
+        path = options['path']
+        if not path.startswith('/api/'):
+            raise CommandError('--path must be an /api/ endpoint')
+        async_path = '/api/async/' + path[len('/api/'):]
+
+        self.delay = options['client_delay'] / 1000
+        self.stdout.write(
+            f"{options['requests']} requests, {options['concurrency']} concurrent, "
+            f"client delay {options['client_delay']:g} ms")
+
+        for label, run, target in [
+            (f"WSGI sync ({options['threads']} threads)", self.run_wsgi, path),
+            ('ASGI async (1 event loop)', self.run_asgi, async_path),
+        ]:
+            started = time.perf_counter()
+            latencies, statuses = run(target, options)
+            elapsed = time.perf_counter() - started
+            errors = sum(1 for status in statuses if status != 200)
+            self.stdout.write(
+                f'  {label:<28} {target:<28} {len(latencies) / elapsed:8.1f} req/s  '
+                f'p50 {statistics.median(latencies) * 1000:7.1f} ms  '
+                f'p99 {_percentile(latencies, 0.99) * 1000:7.1f} ms'
+                + (f'  {errors} non-200' if errors else ''))
+
+    def run_wsgi(self, target, options):
+        application = get_wsgi_application()
+        url = urlsplit(target)
+
+        def request(submitted):
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': url.path,
+                'QUERY_STRING': url.query, 'SERVER_NAME': 'localhost',
+                'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+                'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+                'wsgi.errors': io.StringIO(),
+            }
+            status = []
+            body = application(environ, lambda s, headers, exc_info=None: status.append(s))
+            try:
+                for _ in body:
+                    # The worker thread is held while a slow client reads
+                    if self.delay:
+                        time.sleep(self.delay)
+            finally:
+                body.close()
+            return time.perf_counter() - submitted, int(status[0].split()[0])
+
+        # Keep ``concurrency`` requests in flight, as connections accepted by
+        # the server; latency includes the wait for a free worker thread
+        in_flight = threading.BoundedSemaphore(options['concurrency'])
+        futures = []
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            for _ in range(options['requests']):
+                in_flight.acquire()
+                future = pool.submit(request, time.perf_counter())
+                future.add_done_callback(lambda _: in_flight.release())
+                futures.append(future)
+        results = [future.result() for future in futures]
+        return [latency for latency, _ in results], [status for _, status in results]
+
+    def run_asgi(self, target, options):
+        application = get_asgi_application()
+        url = urlsplit(target)
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': url.path,
+            'raw_path': url.path.encode(), 'query_string': url.query.encode(),
+            'headers': [(b'host', b'localhost')], 'server': ('localhost', 80),
+            'client': ('127.0.0.1', 50000),
+        }
+
+        async def request(semaphore):
+            async with semaphore:
+                submitted = time.perf_counter()
+                status = []
+                body_sent = asyncio.Event()
+                requested = False
+
+                async def receive():
+                    nonlocal requested
+                    if not requested:
+                        requested = True
+                        return {'type': 'http.request', 'body': b'', 'more_body': False}
+                    # Django listens for a disconnect until the response is done
+                    await body_sent.wait()
+                    return {'type': 'http.disconnect'}
+
+                async def send(message):
+                    if message['type'] == 'http.response.start':
+                        status.append(message['status'])
+                    elif message['type'] == 'http.response.body':
+                        if self.delay:
+                            # A slow client only holds a suspended coroutine
+                            await asyncio.sleep(self.delay)
+                        if not message.get('more_body'):
+                            body_sent.set()
+
+                await application(dict(scope), receive, send)
+                return time.perf_counter() - submitted, status[0]
+
+        async def main():
+            semaphore = asyncio.Semaphore(options['concurrency'])
+            return await asyncio.gather(
+                *[request(semaphore) for _ in range(options['requests'])])
+
+        results = asyncio.run(main())
+        return [latency for latency, _ in results], [status for _, status in results]
@@ -0,0 +1,75 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+from products.listing import ProductRowSerializer, row_queryset
+from products.models import Product
+from products.serializers import ProductListSerializer, sparse_fieldset
+
+
+class Command(BaseCommand):
+    help = (
+        'Time product card serialization with ProductListSerializer and with '
+        'the values() row serializer, per 1,000 products of the current catalog'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count', type=int, default=1000,
+            help='Products serialized per run (default: 1000)')
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Runs per serializer; the best is reported (default: 5)')
+        parser.add_argument('--fields', default='', help='As ?fields=')
+        parser.add_argument('--expand', default='', help='As ?expand=')
+
+    def handle(self, *args, **options):
+        count, repeat = options['count'], options['repeat']
+        if count < 1 or repeat < 1:
+            raise CommandError('--count and --repeat must be positive')
+
+        params = {k: options[k] for k in ('fields', 'expand') if options[k]}
+        request = Request(RequestFactory().get('/api/products/', params))
+        queryset = Product.objects.filter(is_available=True).order_by('-created_at')
+        available = queryset.count()
+        if not available:
+            raise CommandError('No products to serialize; import a catalog first')
+        count = min(count, available)
+
+        def model_serializer():
+            products = list(
+                queryset.select_related('category', 'brand')
+                .prefetch_related('images')[:count])
+            fetched = time.perf_counter()
+            ProductListSerializer(products, many=True, context={'request': request}).data
+            return fetched
+
+        def row_serializer():
+            rows = list(row_queryset(
+                queryset, *sparse_fieldset(request.query_params))[:count])
+            fetched = time.perf_counter()
+            ProductRowSerializer(rows, {'request': request}).data
+            return fetched
+
+        scale = 1000 / count
+        results = {}
+        for label, run in [('ProductListSerializer', model_serializer),
+                           ('ProductRowSerializer', row_serializer)]:
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                fetched = run()
+                finished = time.perf_counter()
+                timing = (finished - started, finished - fetched)
+                best = timing if best is None or timing[0] < best[0] else best
+            results[label] = best
+            total, serialize = best
+            self.stdout.write(
+                f'{label:<22} total {total * scale * 1000:8.1f} ms  '
+                f'serialize {serialize * scale * 1000:8.1f} ms  per 1,000 products')
+
+        speedup = results['ProductListSerializer'][0] / results['ProductRowSerializer'][0]
+        self.stdout.write(self.style.SUCCESS(
+            f'{count} products, best of {repeat}: row serializer is {speedup:.1f}x faster'))
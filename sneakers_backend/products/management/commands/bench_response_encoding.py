@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from products.listing import ProductRowSerializer, row_queryset
+from products.models import Product
+from sneakers_backend import compression
+from sneakers_backend.renderers import FastJSONRenderer, orjson
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure JSON encode time and payload size of a product list with '
+        'the default and fast renderers, uncompressed, gzip and brotli'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count', type=int, default=1000,
+            help='Products in the payload (default: 1000)')
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Runs per measurement; the best is reported (default: 5)')
+
+    def best_of(self, repeat, func):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def handle(self, *args, **options):
+        count, repeat = options['count'], options['repeat']
+        if count < 1 or repeat < 1:
+            raise CommandError('--count and --repeat must be positive')
+
+        queryset = Product.objects.filter(is_available=True).order_by('-created_at')
+        rows = list(row_queryset(queryset)[:count])
+        if not rows:
+            raise CommandError('No products to render; import a catalog first')
+        data = ProductRowSerializer(rows, {}).data
+        self.stdout.write(f'{len(data)} products, best of {repeat}')
+
+        renderers = [('JSONRenderer', JSONRenderer())]
+        if orjson is not None:
+            renderers.append(('FastJSONRenderer', FastJSONRenderer()))
+        else:
+            self.stdout.write(self.style.WARNING('orjson is not installed'))
+
+        body = None
+        for label, renderer in renderers:
+            elapsed, body = self.best_of(repeat, lambda: renderer.render(data))
+            self.stdout.write(f'  {label:<18} encode {elapsed * 1000:8.2f} ms')
+
+        self.stdout.write(f'  {"identity":<18} {len(body):>10,} bytes')
+        for encoding in compression.available_encodings():
+            elapsed, compressed = self.best_of(
+                repeat, lambda: compression.compress(body, encoding))
+            self.stdout.write(
+                f'  {encoding:<18} {len(compressed):>10,} bytes '
+                f'({len(compressed) / len(body):.1%})  compress {elapsed * 1000:8.2f} ms')
+        if 'br' not in compression.available_encodings():
+            self.stdout.write(self.style.WARNING('brotli is not installed; gzip only'))
@@ -0,0 +1,154 @@
+import re
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from orders.models import Order
+from products.models import Product
+
+
+# Plan lines that read a whole table, per database vendor
+FULL_SCAN = {
+    'sqlite': re.compile(r'^\s*SCAN (?:TABLE )?(\w+)\b(?! USING)', re.M),
+    'postgresql': re.compile(r'\bSeq Scan on (\w+)'),
+}
+EXPLAIN_PREFIX = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN ',
+}
+
+# Small lookup tables a scan of which costs nothing
+SMALL_TABLES = ['products_category', 'products_brand']
+
+
+def representative_endpoints():
+    """``(label, path)`` for the catalog and order read paths"""
+    product = Product.objects.filter(is_available=True).order_by('-created_at').first()
+    order = Order.objects.order_by('-created_at').first()
+    endpoints = [
+        ('product list', '/api/products/'),
+        ('product list, cursor', '/api/products/?pagination=cursor'),
+        ('product list by price', '/api/products/?ordering=price&min_price=50&max_price=150'),
+        ('product list by popularity', '/api/products/?ordering=-popularity_score'),
+        ('product list, featured', '/api/products/?featured=true'),
+        ('product list, new arrivals', '/api/products/?new_arrival=true'),
+        ('product list, best sellers', '/api/products/?best_seller=true'),
+        ('featured', '/api/products/featured/'),
+        ('new arrivals', '/api/products/new_arrivals/'),
+        ('best sellers', '/api/products/best_sellers/'),
+        ('on sale', '/api/products/on_sale/'),
+        ('trending', '/api/products/trending/'),
+        ('filters', '/api/products/filters/'),
+        ('reviews', '/api/reviews/'),
+        ('categories', '/api/categories/'),
+        ('brands', '/api/brands/'),
+    ]
+    if product is not None:
+        endpoints += [
+            ('product detail', f'/api/products/{product.slug}/'),
+            ('related products', f'/api/products/{product.slug}/related/'),
+            ('product reviews', f'/api/reviews/?product={product.pk}'),
+        ]
+    if order is not None:
+        endpoints += [
+            ('order tracking', f'/api/orders/{order.order_number}/track/'),
+        ]
+    return endpoints
+
+
+def staff_endpoints():
+    """``(label, path)`` for the read paths only staff may use"""
+    order = Order.objects.order_by('-created_at').first()
+    if order is None:
+        return []
+    return [('orders by email', f'/api/orders/?email={order.email}')]
+
+
+class Command(BaseCommand):
+    help = (
+        "Request each catalog and order endpoint, run the SELECTs it issues "
+        "through EXPLAIN and flag the ones that scan a whole table. Uses the "
+        "current database, so run it against realistic data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verbose-plans', action='store_true',
+            help='Print the plan of every query, not only the flagged ones')
+        parser.add_argument(
+            '--strict', action='store_true',
+            help='Exit with an error when any full scan is found (for CI)')
+        parser.add_argument(
+            '--allow', nargs='*', default=SMALL_TABLES, metavar='TABLE',
+            help='Tables whose full scans are not flagged '
+                 f'(default: {" ".join(SMALL_TABLES)})')
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in EXPLAIN_PREFIX:
+            raise CommandError(f'EXPLAIN parsing is not supported for {vendor}')
+        allowed = set(options['allow'])
+        # Only real tables: SQLite also scans its own subquery results
+        tables = set(connection.introspection.table_names())
+
+        requests = [(Client(), label, path) for label, path in representative_endpoints()]
+        staff = User.objects.filter(is_staff=True, is_active=True).first()
+        if staff is None:
+            self.stdout.write('No staff user, skipping the staff only endpoints')
+        else:
+            # Authenticated per request, without a login or session write
+            staff_client = APIClient()
+            staff_client.force_authenticate(staff)
+            requests += [(staff_client, label, path) for label, path in staff_endpoints()]
+
+        caches = {**settings.CACHES, 'explain': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        flagged = 0
+        # Bypass the response cache and the replicas, so every endpoint
+        # runs its queries on this connection
+        with override_settings(
+                CACHES=caches, CATALOG_CACHE_ALIAS='explain', DATABASE_REPLICAS=[],
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for client, label, path in requests:
+                with CaptureQueriesContext(connection) as captured:
+                    response = client.get(path)
+                selects = [
+                    query['sql'] for query in captured.captured_queries
+                    if query['sql'].lstrip().upper().startswith('SELECT')]
+                self.stdout.write(
+                    f'{label} ({path}): {response.status_code}, {len(selects)} queries')
+                for sql in selects:
+                    plan = self.explain(vendor, sql)
+                    scans = [
+                        table for table in FULL_SCAN[vendor].findall(plan)
+                        if table in tables and table not in allowed]
+                    if scans:
+                        flagged += 1
+                        self.stdout.write(self.style.WARNING(
+                            f'  FULL SCAN of {", ".join(sorted(set(scans)))}'))
+                    if scans or options['verbose_plans']:
+                        self.stdout.write(f'    {sql}')
+                        for line in plan.splitlines():
+                            self.stdout.write(f'      {line}')
+
+        if flagged:
+            message = f'{flagged} queries scan a whole table'
+            if options['strict']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('No full table scans'))
+
+    def explain(self, vendor, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(EXPLAIN_PREFIX[vendor] + sql)
+            rows = cursor.fetchall()
+        if vendor == 'sqlite':
+            # (id, parent, notused, detail)
+            return '\n'.join(row[-1] for row in rows)
+        return '\n'.join(row[0] for row in rows)
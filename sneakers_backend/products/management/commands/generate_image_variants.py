@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products.images import backfill
+from products.models import Brand, ProductImage
+
+
+TARGETS = {
+    'products': (ProductImage, 'image', 'variants'),
+    'brands': (Brand, 'logo', 'logo_variants'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate resized WebP/JPEG variants for product images and brand '
+        'logos that are missing them or whose image has changed'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--only', choices=sorted(TARGETS), action='append', dest='targets',
+            help='Limit to product images or brand logos (repeatable)')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Regenerate variants that are already up to date')
+        parser.add_argument(
+            '--workers', type=int,
+            help='Resizing processes (default: IMAGE_DERIVATIVE_WORKERS)')
+
+    def handle(self, *args, **options):
+        if options['workers'] is not None and options['workers'] < 1:
+            raise CommandError('--workers must be positive')
+
+        for target in options['targets'] or TARGETS:
+            model, field_name, variants_field = TARGETS[target]
+            generated, failed = backfill(
+                model, field_name, variants_field,
+                force=options['force'], workers=options['workers'],
+                progress=lambda done, total, target=target: self.stdout.write(
+                    f'  {target}: {done}/{total}'),
+            )
+            style = self.style.WARNING if failed else self.style.SUCCESS
+            self.stdout.write(style(
+                f'{target}: {generated} generated, {failed} failed'))
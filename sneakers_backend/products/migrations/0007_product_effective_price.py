@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:18
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_available_price',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_on_sale_recent',
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.comparison.Coalesce(django.db.models.functions.comparison.NullIf('discount_price', 0), 'price'), output_field=models.DecimalField(decimal_places=2, max_digits=10)),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['effective_price', 'id'], name='product_available_price'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('effective_price__lt', models.F('price')), ('is_available', True)), fields=['-created_at'], name='product_on_sale_recent'),
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import F, Q
+from django.db.models.functions import Coalesce, NullIf
 from django.utils.text import slugify
 from django.conf import settings
 
@@ -28,6 +30,8 @@ class Brand(models.Model):
     slug = models.SlugField(unique=True, blank=True)
     is_active = models.BooleanField(default=True)
     logo = models.ImageField(upload_to='brands/', blank=True, null=True)
+    # Resized copies of the logo, see products.images
+    logo_variants = models.JSONField(default=dict, blank=True)
     description = models.TextField(blank=True)
 
     def save(self, *args, **kwargs):
@@ -40,27 +44,83 @@ class Brand(models.Model):
 
 
 class Product(models.Model):
+    GENDER_CHOICES = [
+        ('men', 'Men'),
+        ('women', 'Women'),
+        ('unisex', 'Unisex'),
+        ('kids', 'Kids'),
+    ]
+
     name = models.CharField(max_length=200)
     slug = models.SlugField(unique=True, blank=True)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     discount_price = models.DecimalField(
         max_digits=10, decimal_places=2, blank=True, null=True)
+    # final_price computed by the database, so that filtering, sorting and
+    # the price facets see discounts, and bulk updates keep it consistent
+    effective_price = models.GeneratedField(
+        expression=Coalesce(NullIf('discount_price', 0), 'price'),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        db_persist=True)
     category = models.ForeignKey(
         Category, on_delete=models.CASCADE, related_name='products')
     brand = models.ForeignKey(
         Brand, on_delete=models.CASCADE, related_name='products')
+    gender = models.CharField(
+        max_length=10, choices=GENDER_CHOICES, default='unisex')
+    color = models.CharField(max_length=50, blank=True)
     stock = models.IntegerField(default=0)
     is_available = models.BooleanField(default=True)
     is_featured = models.BooleanField(default=False)
     is_new_arrival = models.BooleanField(default=False)
     is_best_seller = models.BooleanField(default=False)
     featured = models.BooleanField(default=False)
+
+    # Written in batches by products.popularity, never on the request path
+    views_count = models.PositiveIntegerField(default=0)
+    popularity_score = models.FloatField(default=0)
+
+    # Denormalized from approved reviews, see products.ratings
+    average_rating = models.FloatField(default=0)
+    review_count = models.PositiveIntegerField(default=0)
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
+        # Listings only ever show available products, so the indexes are
+        # partial on is_available and ordered as the endpoints read them
+        # (keyset pagination appends -id). Checked by explain_endpoints.
+        indexes = [
+            models.Index(
+                fields=['-created_at', '-id'], name='product_available_recent',
+                condition=Q(is_available=True)),
+            models.Index(
+                fields=['effective_price', 'id'], name='product_available_price',
+                condition=Q(is_available=True)),
+            models.Index(
+                fields=['-popularity_score', '-id'], name='product_available_popular',
+                condition=Q(is_available=True)),
+            models.Index(
+                fields=['-created_at'], name='product_featured_recent',
+                condition=Q(is_available=True, is_featured=True)),
+            models.Index(
+                fields=['-created_at'], name='product_new_arrival_recent',
+                condition=Q(is_available=True, is_new_arrival=True)),
+            models.Index(
+                fields=['-popularity_score'], name='product_best_seller_popular',
+                condition=Q(is_available=True, is_best_seller=True)),
+            models.Index(
+                fields=['-created_at'], name='product_on_sale_recent',
+                condition=Q(is_available=True, effective_price__lt=F('price'))),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.slug:
@@ -72,6 +132,7 @@ class Product(models.Model):
 
     @property
     def final_price(self):
+        # Same rule as effective_price, which is only current once reloaded
         if self.discount_price:
             return self.discount_price
         return self.price
@@ -82,11 +143,19 @@ class Product(models.Model):
             return int(((self.price - self.discount_price) / self.price) * 100)
         return 0
 
+    @property
+    def rating_histogram(self):
+        return {
+            star: getattr(self, f'rating_{star}_count') for star in range(1, 6)
+        }
+
 
 class ProductImage(models.Model):
     product = models.ForeignKey(
         Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='products/')
+    # Resized copies of the image, see products.images
+    variants = models.JSONField(default=dict, blank=True)
     is_primary = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -134,6 +203,28 @@ class Review(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(
+                fields=['product', '-created_at'], name='review_approved_product',
+                condition=Q(is_approved=True)),
+            models.Index(
+                fields=['-created_at'], name='review_approved_recent',
+                condition=Q(is_approved=True)),
+        ]
 
     def __str__(self):
         return f"{self.user_name} - {self.product.name} ({self.rating}★)"
+
+
+class CatalogState(models.Model):
+    """
+    The catalog version as one row every process reads, see products.cache
+    """
+    version = models.BigIntegerField(default=0)
+    # Unix time of the last catalog change
+    modified = models.FloatField(default=0)
+    # Bumped by bulk writes that bypass the search index signals
+    search_generation = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Catalog version {self.version}"
@@ -0,0 +1,165 @@
+"""
+Write-behind product view counting and a time-decayed popularity score.
+
+Product page views are buffered in process memory and flushed as one
+batched ``UPDATE`` using ``F()`` expressions, so the read path never writes
+a row and concurrent increments are never lost.
+
+The popularity score is an exponentially decayed view count.  Rather than
+decaying every row over time, each view is weighted by
+``exp(λ · (t - epoch))`` and added to a stored sum: ordering by the stored
+value is identical to ordering by the decayed score at any moment, since
+all rows share the same ``exp(-λ · (now - epoch))`` factor.  With the
+default 72 hour half-life stored scores stay within float range for about
+seven years past ``POPULARITY_EPOCH``; move the epoch and reset the scores
+before then.
+"""
+
+import atexit
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Case, F, FloatField, IntegerField, Value, When
+
+
+POPULARITY_EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp()
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def view_weight(timestamp=None):
+    """Weight of a single view at the given unix time"""
+    half_life = _setting('TRENDING_HALF_LIFE_HOURS', 72) * 3600
+    if timestamp is None:
+        timestamp = time.time()
+    return math.exp(math.log(2) * (timestamp - POPULARITY_EPOCH) / half_life)
+
+
+def decayed_score(stored_score, now=None):
+    """Convert a stored popularity score to decayed views as of now"""
+    return stored_score / view_weight(now)
+
+
+class ViewCountBuffer:
+    """
+    Accumulates views per product and flushes them in batches.
+
+    A flush happens when the buffer is older than
+    ``VIEW_COUNT_FLUSH_INTERVAL`` seconds or holds more than
+    ``VIEW_COUNT_FLUSH_THRESHOLD`` views, and at interpreter exit.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}  # product_id -> [views, popularity weight]
+        self._pending_views = 0
+        self._last_flush = time.monotonic()
+
+    def _add(self, product_id, timestamp):
+        """Buffer one view and return whether a flush is due"""
+        weight = view_weight(timestamp)
+        with self._lock:
+            entry = self._pending.setdefault(product_id, [0, 0.0])
+            entry[0] += 1
+            entry[1] += weight
+            self._pending_views += 1
+            return (
+                self._pending_views >= _setting('VIEW_COUNT_FLUSH_THRESHOLD', 500)
+                or time.monotonic() - self._last_flush
+                >= _setting('VIEW_COUNT_FLUSH_INTERVAL', 10)
+            )
+
+    def record(self, product_id, timestamp=None):
+        if self._add(product_id, timestamp):
+            self._flush_quietly()
+
+    async def arecord(self, product_id, timestamp=None):
+        """``record`` for async views; only a due flush leaves the event loop"""
+        if self._add(product_id, timestamp):
+            await sync_to_async(self._flush_quietly)()
+
+    def _flush_quietly(self):
+        """
+        A flush due on the request path: a failed write must not fail the
+        page view, and ``flush`` keeps the views for the next attempt
+        """
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('View count flush failed; the views stay buffered')
+
+    def pending(self, product_id):
+        with self._lock:
+            entry = self._pending.get(product_id)
+            return entry[0] if entry else 0
+
+    def flush(self):
+        """Write buffered views to the database, returning the count"""
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._pending_views = 0
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+
+        try:
+            _write_views(pending)
+        except Exception:
+            # Put the views back so a transient database error loses nothing
+            with self._lock:
+                for product_id, (views, weight) in pending.items():
+                    entry = self._pending.setdefault(product_id, [0, 0.0])
+                    entry[0] += views
+                    entry[1] += weight
+                    self._pending_views += views
+            raise
+        return sum(views for views, _ in pending.values())
+
+
+def _write_views(pending, batch_size=500):
+    from .models import Product
+
+    items = list(pending.items())
+    for start in range(0, len(items), batch_size):
+        chunk = items[start:start + batch_size]
+        views = Case(
+            *[When(pk=pk, then=Value(n)) for pk, (n, _) in chunk],
+            output_field=IntegerField(),
+        )
+        weights = Case(
+            *[When(pk=pk, then=Value(w)) for pk, (_, w) in chunk],
+            output_field=FloatField(),
+        )
+        Product.objects.filter(pk__in=[pk for pk, _ in chunk]).update(
+            views_count=F('views_count') + views,
+            popularity_score=F('popularity_score') + weights,
+        )
+
+
+view_buffer = ViewCountBuffer()
+
+
+def record_view(product_id):
+    view_buffer.record(product_id)
+
+
+async def arecord_view(product_id):
+    await view_buffer.arecord(product_id)
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        view_buffer.flush()
+    except Exception:
+        pass
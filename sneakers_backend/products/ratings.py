@@ -0,0 +1,106 @@
+"""
+Maintenance of the denormalized rating aggregates on Product.
+
+Only approved reviews count.  Changes are applied as relative ``F()``
+updates so concurrent review writes never overwrite each other, and the
+average is recomputed in SQL from the histogram in the same transaction.
+"""
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Q, Value, When
+from django.db.models.functions import Cast
+
+from .models import Product, Review
+
+
+STARS = range(1, 6)
+
+
+def _average_expression():
+    weighted = sum(F(f'rating_{star}_count') * star for star in STARS)
+    return Case(
+        When(review_count=0, then=Value(0.0)),
+        default=Cast(weighted, FloatField()) / F('review_count'),
+        output_field=FloatField(),
+    )
+
+
+def apply_rating_delta(product_id, rating, delta):
+    """Add (delta=1) or remove (delta=-1) one approved review's rating"""
+    with transaction.atomic():
+        products = Product.objects.filter(pk=product_id)
+        products.update(**{
+            'review_count': F('review_count') + delta,
+            f'rating_{rating}_count': F(f'rating_{rating}_count') + delta,
+        })
+        products.update(average_rating=_average_expression())
+
+
+def review_state(review):
+    """The part of a review that contributes to the aggregates, or None"""
+    if not review.is_approved or review.rating not in STARS:
+        return None
+    return (review.product_id, review.rating)
+
+
+def apply_review_change(previous, current):
+    """Move a review's contribution from the previous to the current state"""
+    if previous == current:
+        return
+    with transaction.atomic():
+        if previous is not None:
+            apply_rating_delta(previous[0], previous[1], -1)
+        if current is not None:
+            apply_rating_delta(current[0], current[1], 1)
+
+
+def rebuild_ratings(product_ids=None, batch_size=1000):
+    """
+    Recompute the aggregates from the reviews table.
+
+    Returns the number of products that have at least one approved review.
+    """
+    stats = (
+        Review.objects.filter(is_approved=True)
+        .order_by()
+        .values('product_id')
+        .annotate(
+            total=Count('id'),
+            **{f'r{star}': Count('id', filter=Q(rating=star)) for star in STARS}
+        )
+    )
+    products = Product.objects.all()
+    if product_ids is not None:
+        stats = stats.filter(product_id__in=product_ids)
+        products = products.filter(pk__in=product_ids)
+
+    reset = {f'rating_{star}_count': 0 for star in STARS}
+    updated = 0
+    with transaction.atomic():
+        products.update(average_rating=0, review_count=0, **reset)
+
+        batch = []
+        for row in stats.iterator(chunk_size=batch_size):
+            product = Product(
+                pk=row['product_id'],
+                review_count=row['total'],
+                average_rating=sum(
+                    row[f'r{star}'] * star for star in STARS) / row['total'],
+                **{f'rating_{star}_count': row[f'r{star}'] for star in STARS}
+            )
+            batch.append(product)
+            if len(batch) >= batch_size:
+                updated += _flush(batch)
+        updated += _flush(batch)
+    return updated
+
+
+def _flush(batch):
+    if not batch:
+        return 0
+    fields = ['average_rating', 'review_count'] + [
+        f'rating_{star}_count' for star in STARS]
+    Product.objects.bulk_update(batch, fields)
+    count = len(batch)
+    batch.clear()
+    return count
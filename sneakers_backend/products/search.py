@@ -0,0 +1,362 @@
+"""
+In-process inverted index for product search.
+
+Replaces the ``icontains`` scans of DRF's ``SearchFilter`` with a tokenized
+index over product name, description, brand, category and color.  Results
+are ranked with BM25, the last query term matches as a prefix and terms
+that match nothing fall back to a one-edit typo lookup.
+
+The index lives in process memory, is built lazily on the first query and
+is kept current by the signal handlers in ``products.signals``.  Bulk
+writes that bypass those signals (``manage.py import_catalog``) bump the
+search generation shared through the database instead, and every process
+rebuilds its index on the first query that sees the new generation.
+"""
+
+import math
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.db.models import Case, IntegerField, When
+from rest_framework import filters
+
+from .cache import get_search_generation
+
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Field weights, applied as term-frequency multipliers (BM25F-lite)
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'brand': 2.0,
+    'category': 2.0,
+    'color': 1.5,
+    'description': 1.0,
+}
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+PREFIX_PENALTY = 0.8
+FUZZY_PENALTY = 0.6
+MIN_PREFIX_LENGTH = 2
+MIN_FUZZY_LENGTH = 4
+MAX_PREFIX_EXPANSIONS = 50
+
+# Upper bound on ids handed back to the database per search
+MAX_RESULTS = 1000
+
+
+def tokenize(text):
+    """Lowercase, strip accents and split text into alphanumeric tokens"""
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', str(text))
+    text = text.encode('ascii', 'ignore').decode('ascii').lower()
+    return TOKEN_RE.findall(text)
+
+
+def _deletes(term):
+    """All variants of term with a single character removed"""
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def _within_one_edit(a, b):
+    """True if a and b differ by at most one insert, delete, substitution
+    or adjacent transposition"""
+    if a == b:
+        return True
+    la, lb = len(a), len(b)
+    if abs(la - lb) > 1:
+        return False
+    if la == lb:
+        diff = [i for i in range(la) if a[i] != b[i]]
+        if len(diff) == 1:
+            return True
+        return (len(diff) == 2 and diff[1] == diff[0] + 1
+                and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]])
+    if la > lb:
+        a, b = b, a
+    for i in range(len(b)):
+        if b[:i] + b[i + 1:] == a:
+            return True
+    return False
+
+
+class InvertedIndex:
+    """
+    Thread-safe inverted index with BM25 ranking.
+
+    Documents are dicts of field name -> text, keyed by product id.
+    """
+
+    def __init__(self, field_weights=None):
+        self.field_weights = field_weights or FIELD_WEIGHTS
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.postings = defaultdict(dict)   # term -> {doc_id: weighted tf}
+            self.doc_terms = {}                 # doc_id -> set of terms
+            self.doc_lengths = {}               # doc_id -> weighted length
+            self.total_length = 0.0
+            self.sorted_terms = []
+            self.delete_map = defaultdict(set)  # one-char delete -> terms
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.doc_lengths
+
+    # Indexing
+
+    def add(self, doc_id, fields):
+        """Index (or re-index) a document"""
+        weighted = defaultdict(float)
+        for field, text in fields.items():
+            weight = self.field_weights.get(field, 1.0)
+            for token in tokenize(text):
+                weighted[token] += weight
+
+        with self._lock:
+            self._remove(doc_id)
+            for term, tf in weighted.items():
+                if term not in self.postings:
+                    self._add_term(term)
+                self.postings[term][doc_id] = tf
+            length = sum(weighted.values())
+            self.doc_terms[doc_id] = set(weighted)
+            self.doc_lengths[doc_id] = length
+            self.total_length += length
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self.total_length -= self.doc_lengths.pop(doc_id)
+        for term in terms:
+            docs = self.postings.get(term)
+            if docs is None:
+                continue
+            docs.pop(doc_id, None)
+            if not docs:
+                del self.postings[term]
+                self._drop_term(term)
+
+    def _add_term(self, term):
+        i = bisect_left(self.sorted_terms, term)
+        self.sorted_terms.insert(i, term)
+        if len(term) >= MIN_FUZZY_LENGTH - 1:
+            for variant in _deletes(term):
+                self.delete_map[variant].add(term)
+
+    def _drop_term(self, term):
+        i = bisect_left(self.sorted_terms, term)
+        if i < len(self.sorted_terms) and self.sorted_terms[i] == term:
+            del self.sorted_terms[i]
+        if len(term) >= MIN_FUZZY_LENGTH - 1:
+            for variant in _deletes(term):
+                bucket = self.delete_map.get(variant)
+                if bucket is not None:
+                    bucket.discard(term)
+                    if not bucket:
+                        del self.delete_map[variant]
+
+    # Querying
+
+    def _prefix_terms(self, prefix):
+        i = bisect_left(self.sorted_terms, prefix)
+        matches = []
+        while i < len(self.sorted_terms) and len(matches) < MAX_PREFIX_EXPANSIONS:
+            term = self.sorted_terms[i]
+            if not term.startswith(prefix):
+                break
+            if term != prefix:
+                matches.append(term)
+            i += 1
+        return matches
+
+    def _fuzzy_terms(self, term):
+        if len(term) < MIN_FUZZY_LENGTH:
+            return []
+        candidates = set(self.delete_map.get(term, ()))
+        for variant in _deletes(term):
+            if variant in self.postings:
+                candidates.add(variant)
+            candidates.update(self.delete_map.get(variant, ()))
+        candidates.discard(term)
+        return [c for c in candidates if _within_one_edit(term, c)]
+
+    def expand(self, term, allow_prefix=False):
+        """Return [(indexed_term, penalty)] that a query term matches"""
+        expansions = []
+        if term in self.postings:
+            expansions.append((term, 1.0))
+        if allow_prefix and len(term) >= MIN_PREFIX_LENGTH:
+            expansions.extend((t, PREFIX_PENALTY) for t in self._prefix_terms(term))
+        if not expansions:
+            expansions.extend((t, FUZZY_PENALTY) for t in self._fuzzy_terms(term))
+        return expansions
+
+    def search(self, query, limit=MAX_RESULTS):
+        """
+        Return product ids ranked by BM25 score, best first.
+
+        Every query term must match (exactly, as a prefix for the last term,
+        or within one edit) for a document to be returned.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            n_docs = len(self.doc_lengths)
+            if not n_docs:
+                return []
+            avg_length = self.total_length / n_docs or 1.0
+
+            scores = None
+            for position, term in enumerate(terms):
+                allow_prefix = position == len(terms) - 1
+                term_scores = defaultdict(float)
+                for indexed, penalty in self.expand(term, allow_prefix):
+                    docs = self.postings[indexed]
+                    df = len(docs)
+                    idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                    for doc_id, tf in docs.items():
+                        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc_id] / avg_length)
+                        score = penalty * idf * tf * (BM25_K1 + 1) / (tf + norm)
+                        # Keep the best expansion per query term
+                        if score > term_scores[doc_id]:
+                            term_scores[doc_id] = score
+
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {
+                        doc_id: score + term_scores[doc_id]
+                        for doc_id, score in scores.items()
+                        if doc_id in term_scores
+                    }
+                if not scores:
+                    return []
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [doc_id for doc_id, _ in ranked[:limit]]
+
+
+def product_document(product):
+    """Build the indexed fields for a product instance"""
+    return {
+        'name': product.name,
+        'description': product.description,
+        'brand': product.brand.name if product.brand_id else '',
+        'category': product.category.name if product.category_id else '',
+        'color': getattr(product, 'color', ''),
+    }
+
+
+class ProductSearchIndex:
+    """Process-wide product index, populated lazily from the database"""
+
+    def __init__(self):
+        self.index = InvertedIndex()
+        self._built = False
+        self._generation = None
+        self._build_lock = threading.Lock()
+
+    @property
+    def is_built(self):
+        return self._built
+
+    def ensure_built(self):
+        generation = get_search_generation()
+        if self._built and self._generation == generation:
+            return
+        with self._build_lock:
+            if not self._built or self._generation != generation:
+                self.rebuild()
+                self._generation = generation
+
+    def rebuild(self):
+        from .models import Product
+
+        fields = ['id', 'name', 'description', 'brand__name', 'category__name']
+        if any(f.name == 'color' for f in Product._meta.get_fields()):
+            fields.append('color')
+
+        self.index.clear()
+        rows = Product.objects.order_by().values(*fields)
+        for row in rows.iterator(chunk_size=2000):
+            self.index.add(row['id'], {
+                'name': row['name'],
+                'description': row['description'],
+                'brand': row['brand__name'],
+                'category': row['category__name'],
+                'color': row.get('color', ''),
+            })
+        self._built = True
+
+    def index_product(self, product):
+        # Changes made before the first search are picked up by the build
+        if self._built:
+            self.index.add(product.pk, product_document(product))
+
+    def remove_product(self, product_id):
+        if self._built:
+            self.index.remove(product_id)
+
+    def reindex_products(self, queryset):
+        if self._built:
+            for product in queryset.select_related('brand', 'category'):
+                self.index.add(product.pk, product_document(product))
+
+    def search(self, query, limit=MAX_RESULTS):
+        self.ensure_built()
+        return self.index.search(query, limit)
+
+    def reset(self):
+        with self._build_lock:
+            self.index.clear()
+            self._built = False
+
+
+product_index = ProductSearchIndex()
+
+
+class InvertedIndexSearchFilter(filters.SearchFilter):
+    """
+    Search backend backed by the in-process product index.
+
+    Uses the same ``search`` query parameter as ``SearchFilter``.  Results
+    are ordered by relevance unless the client passes an explicit
+    ``ordering``, so this backend must run after ``OrderingFilter``.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not query.strip():
+            return queryset
+
+        ids = product_index.search(query)
+        if not ids:
+            return queryset.none()
+
+        queryset = queryset.filter(id__in=ids)
+        if request.query_params.get(filters.OrderingFilter.ordering_param):
+            return queryset
+
+        rank = Case(
+            *[When(id=pk, then=position) for position, pk in enumerate(ids)],
+            output_field=IntegerField(),
+        )
+        return queryset.annotate(search_rank=rank).order_by('search_rank')
@@ -1,45 +1,203 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db.models import Count
+from django.db.models.manager import BaseManager
+from django.utils.encoding import filepath_to_uri
+from .images import variant_urls
 from .models import Category, Brand, Product, ProductImage, Size, Review
 
 
-class CategorySerializer(serializers.ModelSerializer):
+def media_url_builder(context):
+    """
+    Return a function turning a storage name into an absolute URL.
+
+    The request's scheme and host are resolved once and kept in the
+    serializer context, instead of calling ``build_absolute_uri`` for
+    every image of every product.  For local file storage the URL prefix is
+    joined once as well.
+    """
+    builder = context.get('media_url')
+    if builder is None:
+        request = context.get('request')
+        origin = request.build_absolute_uri('/')[:-1] if request else ''
+
+        if isinstance(default_storage, FileSystemStorage):
+            prefix = default_storage.url('')
+            if prefix.startswith('/'):
+                prefix = origin + prefix
+
+            def builder(name):
+                return prefix + filepath_to_uri(name).lstrip('/')
+        else:
+            def builder(name):
+                url = default_storage.url(name)
+                return origin + url if url.startswith('/') else url
+
+        context['media_url'] = builder
+    return builder
+
+
+def product_count_queries(context, products):
+    """
+    Yield ``(column, counts, rows)`` for each relation with ids not yet
+    counted, where ``rows`` is the grouped count query to feed into
+    ``counts``; shared by the sync and async priming functions.
+    """
+    cache = context.setdefault('product_counts', {'category': {}, 'brand': {}})
+    for relation, counts in cache.items():
+        column = f'{relation}_id'
+        missing = {getattr(p, column) for p in products} - counts.keys()
+        if not missing:
+            continue
+        rows = (
+            Product.objects.filter(**{f'{column}__in': missing})
+            .order_by().values(column).annotate(total=Count('id'))
+        )
+        counts.update((pk, 0) for pk in missing)
+        yield column, counts, rows
+
+
+def prime_product_counts(context, products):
+    """
+    Count the products of every category and brand referenced by
+    ``products`` with one grouped query per relation, and cache the result
+    in the serializer context for ``ProductCountMixin``.
+    """
+    for column, counts, rows in product_count_queries(context, products):
+        counts.update((row[column], row['total']) for row in rows)
+
+
+async def aprime_product_counts(context, products):
+    """``prime_product_counts`` with the async ORM"""
+    for column, counts, rows in product_count_queries(context, products):
+        counts.update([(row[column], row['total']) async for row in rows])
+
+
+class ProductCountListSerializer(serializers.ListSerializer):
+    """List serializer that primes category/brand counts for all rows"""
+
+    def get_products(self, items):
+        return items
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, BaseManager) else data)
+        prime_product_counts(self.context, self.get_products(items))
+        return super().to_representation(items)
+
+
+def sparse_fieldset(query_params):
+    """
+    Parse ``?fields=`` and ``?expand=`` into ``(fields, expand)``.
+
+    ``fields`` is None when the client did not ask for a subset.
+    """
+    def names(param):
+        return [name for name in query_params.get(param, '').replace(' ', '').split(',') if name]
+
+    fields = names('fields')
+    return (fields or None), set(names('expand'))
+
+
+class SparseFieldsMixin:
+    """
+    Let clients trim a top-level serializer with ``?fields=id,name,price``.
+
+    When ``fields`` is given, the relations in ``Meta.expandable_fields``
+    render as their primary key unless also listed in ``?expand=``;
+    without ``fields`` the full representation is returned.  Nested uses of
+    the serializer (e.g. products inside cart items) are never trimmed.
+    """
+
+    def is_root(self):
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        return parent is None
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or not self.is_root():
+            return fields
+
+        requested, expand = sparse_fieldset(request.query_params)
+        if requested is None:
+            return fields
+        fields = {name: field for name, field in fields.items() if name in requested}
+        for name in getattr(self.Meta, 'expandable_fields', ()):
+            if name in fields and name not in expand:
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+        return fields
+
+
+class SparseProductListSerializer(ProductCountListSerializer):
+    """Skips the count queries when category and brand are not rendered"""
+
+    def to_representation(self, data):
+        fields = self.child.fields
+        if any(isinstance(fields.get(name), ProductCountMixin)
+               for name in ('category', 'brand')):
+            return super().to_representation(data)
+        return serializers.ListSerializer.to_representation(self, data)
+
+
+class ProductCountMixin:
+    """
+    ``product_count`` without a COUNT per row: read from a ``product_count``
+    annotation or from counts primed by ``prime_product_counts``, and only
+    fall back to counting for a lone object.
+    """
+    count_relation = None
+
+    def get_product_count(self, obj):
+        if hasattr(obj, 'product_count'):
+            return obj.product_count
+        counts = self.context.get('product_counts', {}).get(self.count_relation, {})
+        if obj.pk in counts:
+            return counts[obj.pk]
+        return obj.products.count()
+
+
+class CategorySerializer(ProductCountMixin, serializers.ModelSerializer):
     product_count = serializers.SerializerMethodField()
+    count_relation = 'category'
 
     class Meta:
         model = Category
         fields = ['id', 'name', 'slug', 'description', 'product_count']
 
-    def get_product_count(self, obj):
-        return obj.products.count()
-
 
-class BrandSerializer(serializers.ModelSerializer):
+class BrandSerializer(ProductCountMixin, serializers.ModelSerializer):
     product_count = serializers.SerializerMethodField()
+    logo_variants = serializers.SerializerMethodField()
+    count_relation = 'brand'
 
     class Meta:
         model = Brand
-        fields = ['id', 'name', 'slug', 'logo', 'description', 'product_count']
+        fields = ['id', 'name', 'slug', 'logo', 'logo_variants',
+                  'description', 'product_count']
 
-    def get_product_count(self, obj):
-        return obj.products.count()
+    def get_logo_variants(self, obj):
+        return variant_urls(obj.logo_variants, media_url_builder(self.context))
 
 
 class ProductImageSerializer(serializers.ModelSerializer):
     image_url = serializers.SerializerMethodField()
+    variants = serializers.SerializerMethodField()
 
     class Meta:
         model = ProductImage
-        fields = ['id', 'image', 'image_url', 'is_primary']
+        fields = ['id', 'image', 'image_url', 'variants', 'is_primary']
 
     def get_image_url(self, obj):
-        request = self.context.get('request')
-        if obj.image and hasattr(obj.image, 'url'):
-            if request:
-                return request.build_absolute_uri(obj.image.url)
-            return obj.image.url
+        if obj.image:
+            return media_url_builder(self.context)(obj.image.name)
         return None
 
+    def get_variants(self, obj):
+        return variant_urls(obj.variants, media_url_builder(self.context))
+
 
 class SizeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -55,34 +213,46 @@ class ReviewSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at']
 
 
-class ProductListSerializer(serializers.ModelSerializer):
+class ProductListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for product list view - shows minimal info"""
     category = CategorySerializer(read_only=True)
     brand = BrandSerializer(read_only=True)
     primary_image = serializers.SerializerMethodField()
+    primary_image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
         fields = [
             'id', 'name', 'slug', 'price', 'discount_price',
             'final_price', 'discount_percentage', 'category',
-            'brand', 'stock', 'is_available', 'featured', 'primary_image'
+            'brand', 'stock', 'is_available', 'featured', 'primary_image',
+            'primary_image_variants', 'average_rating', 'review_count'
         ]
+        expandable_fields = ['category', 'brand']
+        list_serializer_class = SparseProductListSerializer
+
+    def _primary_image(self, obj):
+        # Iterate the prefetched images; ProductImage ordering puts the
+        # primary image first
+        images = list(obj.images.all())
+        return next(
+            (image for image in images if image.is_primary),
+            images[0] if images else None)
 
     def get_primary_image(self, obj):
-        primary_image = obj.images.filter(is_primary=True).first()
-        if not primary_image:
-            primary_image = obj.images.first()
-
-        if primary_image:
-            request = self.context.get('request')
-            if request and hasattr(primary_image.image, 'url'):
-                return request.build_absolute_uri(primary_image.image.url)
-            return primary_image.image.url if hasattr(primary_image.image, 'url') else None
+        primary_image = self._primary_image(obj)
+        if primary_image and primary_image.image:
+            return media_url_builder(self.context)(primary_image.image.name)
         return None
 
+    def get_primary_image_variants(self, obj):
+        primary_image = self._primary_image(obj)
+        if primary_image is None:
+            return {}
+        return variant_urls(primary_image.variants, media_url_builder(self.context))
+
 
-class ProductDetailSerializer(serializers.ModelSerializer):
+class ProductDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for product detail view - shows all info"""
     category = CategorySerializer(read_only=True)
     brand = BrandSerializer(read_only=True)
@@ -90,7 +260,8 @@ class ProductDetailSerializer(serializers.ModelSerializer):
     sizes = SizeSerializer(many=True, read_only=True)
     reviews = ReviewSerializer(many=True, read_only=True)
     average_rating = serializers.SerializerMethodField()
-    review_count = serializers.SerializerMethodField()
+    rating_histogram = serializers.DictField(
+        child=serializers.IntegerField(), read_only=True)
 
     class Meta:
         model = Product
@@ -99,18 +270,12 @@ class ProductDetailSerializer(serializers.ModelSerializer):
             'discount_price', 'final_price', 'discount_percentage',
             'category', 'brand', 'stock', 'is_available', 'featured',
             'images', 'sizes', 'reviews', 'average_rating',
-            'review_count', 'created_at', 'updated_at'
+            'review_count', 'rating_histogram', 'created_at', 'updated_at'
         ]
+        expandable_fields = ['category', 'brand']
 
     def get_average_rating(self, obj):
-        reviews = obj.reviews.all()
-        if reviews.exists():
-            total = sum(r.rating for r in reviews)
-            return round(total / reviews.count(), 1)
-        return 0
-
-    def get_review_count(self, obj):
-        return obj.reviews.count()
+        return round(obj.average_rating, 1)
 
 
 class CreateReviewSerializer(serializers.ModelSerializer):
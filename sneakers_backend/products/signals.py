@@ -0,0 +1,78 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import images
+from .cache import bump_catalog_version
+from .models import Category, Brand, Product, ProductImage, Size, Review
+from .ratings import apply_review_change, review_state
+from .search import product_index
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    product_index.index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    product_index.remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, **kwargs):
+    if not created:
+        product_index.reindex_products(instance.products.all())
+
+
+@receiver(post_save, sender=Brand)
+def reindex_brand_products(sender, instance, created, **kwargs):
+    if not created:
+        product_index.reindex_products(instance.products.all())
+
+
+@receiver(post_save, sender=ProductImage)
+def schedule_image_variants(sender, instance, raw=False, **kwargs):
+    if not raw:
+        images.schedule(instance, 'image', 'variants')
+
+
+@receiver(post_save, sender=Brand)
+def schedule_logo_variants(sender, instance, raw=False, **kwargs):
+    if not raw:
+        images.schedule(instance, 'logo', 'logo_variants')
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_state(sender, instance, **kwargs):
+    previous = None
+    if instance.pk:
+        old = Review.objects.filter(pk=instance.pk).only(
+            'product_id', 'rating', 'is_approved').first()
+        if old is not None:
+            previous = review_state(old)
+    instance._previous_rating_state = previous
+
+
+@receiver(post_save, sender=Review)
+def update_ratings_on_save(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_rating_state', None)
+    apply_review_change(previous, review_state(instance))
+    instance._previous_rating_state = review_state(instance)
+
+
+@receiver(post_delete, sender=Review)
+def update_ratings_on_delete(sender, instance, **kwargs):
+    apply_review_change(review_state(instance), None)
+
+
+def invalidate_catalog_cache(sender, **kwargs):
+    bump_catalog_version()
+
+
+for model in (Product, ProductImage, Size, Review, Category, Brand):
+    post_save.connect(
+        invalidate_catalog_cache, sender=model,
+        dispatch_uid=f'catalog_cache_save_{model.__name__}')
+    post_delete.connect(
+        invalidate_catalog_cache, sender=model,
+        dispatch_uid=f'catalog_cache_delete_{model.__name__}')
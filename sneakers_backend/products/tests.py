@@ -1,3 +1,907 @@
-from django.test import TestCase
+import gzip
+import json
+import tempfile
+import uuid
+import warnings
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.paginator import UnorderedObjectListWarning
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError
+from django.db.models import F
+from asgiref.sync import sync_to_async
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from orders.models import Order
+from sneakers_backend.renderers import FastJSONRenderer
+from sneakers_backend.replicas import PIN_COOKIE, ReplicaRouter, replica_reads
+
+from .models import Category, Brand, CatalogState, Product, ProductImage, Size, Review
+from .cache import get_catalog_version, get_search_generation, response_cache_key
+from .images import VARIANTS, render_variants
+from .popularity import ViewCountBuffer, decayed_score
+from .ratings import rebuild_ratings
+from .search import InvertedIndex, product_index, tokenize
+
+
+class InvertedIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = InvertedIndex()
+        self.index.add(1, {'name': 'Air Jordan 1 Retro', 'brand': 'Nike',
+                           'category': 'Basketball', 'description': 'Classic high top'})
+        self.index.add(2, {'name': 'Air Max 2090', 'brand': 'Nike',
+                           'category': 'Running', 'description': 'Cushioned running shoe'})
+        self.index.add(3, {'name': 'Ultraboost', 'brand': 'Adidas',
+                           'category': 'Running', 'description': 'Nike rival runner'})
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('Café AIR-max 90'), ['cafe', 'air', 'max', '90'])
+
+    def test_ranks_name_match_above_description_match(self):
+        self.assertEqual(self.index.search('nike')[-1], 3)
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(self.index.search('air running'), [2])
+
+    def test_prefix_match_on_last_term(self):
+        self.assertEqual(self.index.search('ultra'), [3])
+
+    def test_typo_tolerance(self):
+        self.assertEqual(self.index.search('jorden'), [1])
+        self.assertEqual(self.index.search('ultarboost'), [3])
+
+    def test_reindex_and_remove(self):
+        self.index.add(3, {'name': 'Superstar', 'brand': 'Adidas'})
+        self.assertEqual(self.index.search('ultraboost'), [])
+        self.index.remove(1)
+        self.assertEqual(self.index.search('jordan'), [])
+        self.assertNotIn('jordan', self.index.postings)
+
+
+class ProductFiltersTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        running = Category.objects.create(name='Running')
+        lifestyle = Category.objects.create(name='Lifestyle')
+        nike = Brand.objects.create(name='Nike')
+        adidas = Brand.objects.create(name='Adidas')
+        for name, category, brand, gender, color, price in [
+            ('Pegasus', running, nike, 'men', 'Black', '120.00'),
+            ('Vomero', running, nike, 'women', 'White', '160.00'),
+            ('Ultraboost', running, adidas, 'men', 'Black', '180.00'),
+            ('Samba', lifestyle, adidas, 'unisex', 'White', '100.00'),
+        ]:
+            Product.objects.create(
+                name=name, description=name, category=category, brand=brand,
+                gender=gender, color=color, price=Decimal(price), stock=5)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_single_query(self):
+        with self.assertNumQueries(1):
+            self.client.get('/api/products/filters/')
+
+    def test_counts_reflect_other_filters(self):
+        response = self.client.get('/api/products/filters/', {'brand': 'nike'})
+        data = response.json()
+        # Brand counts ignore the brand selection itself
+        self.assertEqual(
+            {b['slug']: b['product_count'] for b in data['brands']},
+            {'nike': 2, 'adidas': 2})
+        # Other facets are narrowed to Nike
+        self.assertEqual(
+            {c['slug']: c['product_count'] for c in data['categories']},
+            {'running': 2})
+        self.assertEqual(data['price_range'], {'min': 120.0, 'max': 160.0})
+
+    def test_color_filter_is_case_insensitive(self):
+        data = self.client.get('/api/products/filters/', {'color': 'black'}).json()
+        self.assertEqual(
+            data['genders'], [{'value': 'men', 'count': 2}])
+
+    def test_prices_use_discounts(self):
+        # Ultraboost at 90 is now the cheapest; bulk updates keep it in sync
+        Product.objects.filter(name='Ultraboost').update(discount_price=Decimal('90.00'))
+        Product.objects.filter(name='Samba').update(discount_price=Decimal('0'))
+
+        data = self.client.get('/api/products/', {'ordering': 'price'}).json()
+        self.assertEqual(
+            [(p['name'], p['final_price']) for p in data['results']],
+            [('Ultraboost', 90.0), ('Samba', 100.0), ('Pegasus', 120.0), ('Vomero', 160.0)])
+
+        data = self.client.get('/api/products/', {'max_price': '95'}).json()
+        self.assertEqual([p['name'] for p in data['results']], ['Ultraboost'])
+
+        data = self.client.get('/api/products/filters/').json()
+        self.assertEqual(data['price_range'], {'min': 90.0, 'max': 160.0})
+
+        data = self.client.get('/api/products/on_sale/').json()
+        self.assertEqual([p['name'] for p in data], ['Ultraboost'])
+
+    def test_price_cursor_pagination(self):
+        Product.objects.filter(name='Vomero').update(discount_price=Decimal('110.00'))
+        names = []
+        params = {'ordering': '-price', 'pagination': 'cursor', 'page_size': 1}
+        response = self.client.get('/api/products/', params).json()
+        while True:
+            names += [p['name'] for p in response['results']]
+            if not response['next']:
+                break
+            response = self.client.get(response['next']).json()
+        self.assertEqual(names, ['Ultraboost', 'Pegasus', 'Vomero', 'Samba'])
+
+
+class ProductRatingAggregateTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name='Pegasus', description='Runner', price=Decimal('120.00'),
+            category=Category.objects.create(name='Running'),
+            brand=Brand.objects.create(name='Nike'))
+
+    def review(self, rating, approved=True):
+        return Review.objects.create(
+            product=self.product, user_name='tester', rating=rating,
+            comment='ok', is_approved=approved)
+
+    def assertAggregates(self, count, average, histogram):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, count)
+        self.assertAlmostEqual(self.product.average_rating, average)
+        self.assertEqual(self.product.rating_histogram, histogram)
+
+    def test_lifecycle(self):
+        five = self.review(5)
+        pending = self.review(1, approved=False)
+        self.assertAggregates(1, 5.0, {1: 0, 2: 0, 3: 0, 4: 0, 5: 1})
+
+        pending.is_approved = True
+        pending.save()
+        self.assertAggregates(2, 3.0, {1: 1, 2: 0, 3: 0, 4: 0, 5: 1})
+
+        five.rating = 4
+        five.save()
+        self.assertAggregates(2, 2.5, {1: 1, 2: 0, 3: 0, 4: 1, 5: 0})
+
+        pending.delete()
+        self.assertAggregates(1, 4.0, {1: 0, 2: 0, 3: 0, 4: 1, 5: 0})
+
+    def test_rebuild(self):
+        self.review(5)
+        self.review(2)
+        Product.objects.update(review_count=0, average_rating=0, rating_5_count=0)
+        self.assertEqual(rebuild_ratings(), 1)
+        self.assertAggregates(2, 3.5, {1: 0, 2: 1, 3: 0, 4: 0, 5: 1})
+
+
+@override_settings(VIEW_COUNT_FLUSH_INTERVAL=3600, VIEW_COUNT_FLUSH_THRESHOLD=1000)
+class ViewCountBufferTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Running')
+        brand = Brand.objects.create(name='Nike')
+        self.old, self.new = [
+            Product.objects.create(
+                name=name, description=name, price=Decimal('100.00'),
+                category=category, brand=brand)
+            for name in ('Old', 'New')
+        ]
+
+    def test_views_are_buffered_then_flushed_in_one_query(self):
+        buffer = ViewCountBuffer()
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                buffer.record(self.old.pk)
+            buffer.record(self.new.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(buffer.flush(), 4)
+        self.old.refresh_from_db()
+        self.new.refresh_from_db()
+        self.assertEqual((self.old.views_count, self.new.views_count), (3, 1))
+
+    def test_recent_views_outrank_older_ones(self):
+        buffer = ViewCountBuffer()
+        week_ago = 1_760_000_000 - 7 * 86400
+        for _ in range(4):
+            buffer.record(self.old.pk, timestamp=week_ago)
+        buffer.record(self.new.pk, timestamp=1_760_000_000)
+        buffer.flush()
+        self.old.refresh_from_db()
+        self.new.refresh_from_db()
+        self.assertGreater(self.new.popularity_score, self.old.popularity_score)
+        # Four views a week ago at a 72h half-life are worth about 0.8 now
+        self.assertAlmostEqual(
+            decayed_score(self.old.popularity_score, 1_760_000_000), 0.79, places=2)
+
+    @override_settings(VIEW_COUNT_FLUSH_INTERVAL=0)
+    def test_failed_flush_keeps_views_without_failing_the_view(self):
+        buffer = ViewCountBuffer()
+        with mock.patch('products.popularity._write_views', side_effect=DatabaseError), \
+                self.assertLogs('products.popularity', 'ERROR'):
+            buffer.record(self.old.pk)
+        self.assertEqual(buffer.pending(self.old.pk), 1)
+        version = get_catalog_version()
+        buffer.flush()
+        self.old.refresh_from_db()
+        self.assertEqual(self.old.views_count, 1)
+        # Views only age cached trending responses within their timeout;
+        # bumping the catalog version would drop every cached page and ETag
+        self.assertEqual(get_catalog_version(), version)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Running')
+        brand = Brand.objects.create(name='Nike')
+        # Repeated prices exercise the primary key tiebreaker
+        for i in range(7):
+            Product.objects.create(
+                name=f'Shoe {i}', description='Runner', category=category,
+                brand=brand, price=Decimal(100 + 10 * (i % 3)))
+
+    def walk(self, url, params):
+        client = APIClient()
+        ids = []
+        response = client.get(url, params).json()
+        ids += [p['id'] for p in response['results']]
+        while response['next']:
+            response = client.get(response['next']).json()
+            ids += [p['id'] for p in response['results']]
+        return ids, response
+
+    def test_walk_matches_offset_ordering(self):
+        expected = list(
+            Product.objects.order_by('price', 'id').values_list('id', flat=True))
+        ids, _ = self.walk('/api/products/', {
+            'pagination': 'cursor', 'ordering': 'price', 'page_size': 2})
+        self.assertEqual(ids, expected)
+
+    def test_previous_link_returns_prior_page(self):
+        client = APIClient()
+        first = client.get('/api/products/', {
+            'pagination': 'cursor', 'ordering': '-price', 'page_size': 3}).json()
+        second = client.get(first['next']).json()
+        back = client.get(second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+
+    def test_optional_total(self):
+        response = APIClient().get('/api/products/', {
+            'pagination': 'cursor', 'include_total': 'true'}).json()
+        self.assertEqual(response['count'], 7)
+        self.assertFalse(response['count_is_approximate'])
+
+    def test_invalid_cursor(self):
+        response = APIClient().get('/api/products/', {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+
+def seed_catalog(products=24):
+    """A small catalog spread over several categories and brands"""
+    categories = [Category.objects.create(name=f'Category {i}') for i in range(3)]
+    brands = [Brand.objects.create(name=f'Brand {i}') for i in range(4)]
+    catalog = []
+    for i in range(products):
+        product = Product.objects.create(
+            name=f'Sneaker {i}', description='Seeded', price=Decimal('100.00') + i,
+            category=categories[i % 3], brand=brands[i % 4], stock=10,
+            is_featured=i % 2 == 0, is_new_arrival=i % 3 == 0,
+            is_best_seller=i % 4 == 0,
+            discount_price=Decimal('80.00') if i % 5 == 0 else None)
+        ProductImage.objects.create(product=product, image=f'products/{i}.png', is_primary=True)
+        ProductImage.objects.create(product=product, image=f'products/{i}-side.png')
+        Size.objects.create(product=product, size='M', us_size=Decimal('9.0'), stock=5)
+        Size.objects.create(product=product, size='L', us_size=Decimal('10.0'), stock=5)
+        Review.objects.create(
+            product=product, user_name='tester', rating=4, comment='ok', is_approved=True)
+        catalog.append(product)
+    return catalog
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Fixed query counts per endpoint, independent of page size and catalog
+    size. Raise a budget only together with a change that justifies it.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog()
+
+    def setUp(self):
+        cache.clear()
+        # The catalog version is read once per CATALOG_STATE_TTL, not per request
+        get_catalog_version()
+        self.client = APIClient()
+
+    def test_product_list(self):
+        # count, products, images, category counts, brand counts
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/products/')
+        self.assertEqual(len(response.json()['results']), 12)
+
+    def test_product_list_cursor(self):
+        # products, images, category counts, brand counts
+        with self.assertNumQueries(4):
+            self.client.get('/api/products/', {'pagination': 'cursor'})
+
+    def test_product_actions(self):
+        # products, images, category counts, brand counts
+        for action in ['featured', 'new_arrivals', 'best_sellers',
+                       'trending', 'on_sale']:
+            with self.subTest(action=action), self.assertNumQueries(4):
+                self.client.get(f'/api/products/{action}/')
+
+    def test_product_detail(self):
+        # validators, product, images, sizes, reviews, category count,
+        # brand count
+        with self.assertNumQueries(7):
+            self.client.get(f'/api/products/{self.catalog[0].slug}/')
+
+    def test_categories_and_brands(self):
+        with self.assertNumQueries(2):
+            self.client.get('/api/categories/')
+        with self.assertNumQueries(2):
+            self.client.get('/api/brands/')
+
+    def test_categories_and_brands_paginate_in_name_order(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', UnorderedObjectListWarning)
+            for path in ['/api/categories/', '/api/brands/']:
+                names = [row['name'] for row in self.client.get(path).json()['results']]
+                self.assertEqual(names, sorted(names))
+
+    def test_reviews(self):
+        with self.assertNumQueries(2):
+            self.client.get('/api/reviews/')
+
+
+class CatalogResponseCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(products=6)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_second_anonymous_hit_skips_the_database(self):
+        first = self.client.get('/api/products/featured/')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/products/featured/')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.json(), first.json())
+
+    def test_catalog_change_invalidates(self):
+        self.client.get('/api/categories/')
+        category = Category.objects.first()
+        category.name = 'Renamed'
+        category.save()
+        response = self.client.get('/api/categories/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn('Renamed', [c['name'] for c in response.json()['results']])
+
+    @override_settings(CATALOG_CACHE_TIMEOUT=0)
+    def test_stale_entry_served_while_another_worker_rebuilds(self):
+        self.client.get('/api/brands/')
+        request = Request(APIRequestFactory().get('/api/brands/'))
+        key = response_cache_key(request, get_catalog_version())
+        cache.add(f'{key}:lock', 1)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/brands/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(products=3)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_product_detail_not_modified(self):
+        url = f'/api/products/{self.catalog[0].slug}/'
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Review.objects.create(
+            product=self.catalog[0], user_name='late', rating=1,
+            comment='meh', is_approved=True)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_product_detail_views_counted_after_the_response(self):
+        product = self.catalog[0]
+        url = f'/api/products/{product.slug}/'
+        with mock.patch('products.views.record_view') as record_view:
+            etag = self.client.get(url)['ETag']
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.client.get('/api/products/missing/')
+        self.assertEqual(record_view.call_count, 2)
+        record_view.assert_called_with(product.pk)
+
+    @override_settings(CATALOG_STATE_TTL=0)
+    def test_change_made_by_another_process(self):
+        etag = self.client.get('/api/products/')['ETag']
+        # A bump elsewhere reaches this process through the database only
+        CatalogState.objects.filter(pk=1).update(version=F('version') + 1)
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_product_list_not_modified_without_queries(self):
+        etag = self.client.get('/api/products/', {'brand': 'brand-1'})['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                '/api/products/', {'brand': 'brand-1'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # A different query is a different representation
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class ImportCatalogTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def feed(self, name, content):
+        path = Path(self.tmp.name) / name
+        path.write_text(content)
+        return str(path)
+
+    def test_import_and_upsert(self):
+        categories = self.feed('categories.csv', 'name,description\nRunning,Road\n')
+        brands = self.feed('brands.jsonl', json.dumps({'name': 'Nike'}) + '\n')
+        products = self.feed('products.jsonl', '\n'.join(json.dumps(row) for row in [
+            {'name': 'Pegasus', 'slug': 'pegasus-40', 'description': 'Daily trainer',
+             'price': '130.00', 'category': 'running', 'brand': 'Nike', 'stock': 5},
+            {'name': 'Vomero', 'description': 'Cushioned', 'price': '160',
+             'category': 'Running', 'brand': 'nike'},
+            {'name': 'Vomero', 'description': 'Second colourway', 'price': '160',
+             'category': 'Running', 'brand': 'nike'},
+            {'name': 'Ghost', 'price': '140', 'category': 'Trail', 'brand': 'nike'},
+        ]))
+        sizes = self.feed('sizes.csv', 'product,size,us_size,stock\npegasus-40,M,9.5,3\n')
+        out = StringIO()
+        call_command(
+            'import_catalog', categories=categories, brands=brands,
+            products=products, sizes=sizes, batch_size=2, stdout=out, stderr=StringIO())
+
+        # Rows without a slug are one product per brand and name
+        self.assertEqual(
+            sorted(Product.objects.values_list('slug', flat=True)),
+            ['pegasus-40', 'vomero'])
+        self.assertEqual(Product.objects.get(slug='vomero').description, 'Second colourway')
+        self.assertIn('1 skipped', out.getvalue())
+        self.assertEqual(Size.objects.get().stock, 3)
+
+        # Re-importing a slugged row updates it in place
+        update = self.feed('update.jsonl', json.dumps({
+            'name': 'Pegasus 40', 'slug': 'pegasus-40', 'description': 'Updated',
+            'price': '120', 'category': 'running', 'brand': 'nike'}))
+        call_command('import_catalog', products=update, stdout=StringIO())
+        product = Product.objects.get(slug='pegasus-40')
+        self.assertEqual((product.name, product.price), ('Pegasus 40', Decimal('120')))
+        self.assertEqual(Product.objects.count(), 2)
+
+        # So does re-running a feed without slugs
+        call_command('import_catalog', products=products, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_missing_columns_keep_existing_values(self):
+        Brand.objects.create(name='Nike', logo='brands/nike.png', description='Swoosh')
+        brands = self.feed('brands.csv', 'name,is_active\nNike,false\n')
+        call_command('import_catalog', brands=brands, stdout=StringIO())
+        brand = Brand.objects.get()
+        self.assertEqual(
+            (brand.logo.name, brand.description, brand.is_active),
+            ('brands/nike.png', 'Swoosh', False))
+
+    def test_search_sees_imported_products(self):
+        category = Category.objects.create(name='Running')
+        Product.objects.create(
+            name='Pegasus', description='Daily trainer', price=Decimal('130.00'),
+            category=category, brand=Brand.objects.create(name='Nike'))
+        self.assertEqual(product_index.search('vomero'), [])
+        generation = get_search_generation()
+        products = self.feed('products.jsonl', json.dumps({
+            'name': 'Vomero', 'description': 'Cushioned', 'price': '160',
+            'category': 'running', 'brand': 'nike'}))
+        call_command('import_catalog', products=products, stdout=StringIO())
+        # Published for every process, not only reset in the command's own
+        cache.clear()
+        self.assertEqual(get_search_generation(), generation + 1)
+        self.assertEqual(
+            product_index.search('vomero'), [Product.objects.get(name='Vomero').pk])
+
+    def test_dry_run_rolls_back(self):
+        categories = self.feed('categories.csv', 'name\nRunning\n')
+        call_command('import_catalog', categories=categories, dry_run=True,
+                     stdout=StringIO())
+        self.assertFalse(Category.objects.exists())
+
+
+def png_bytes(size=(800, 600), mode='RGBA'):
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new(mode, size, (200, 30, 30, 128)[:len(mode)]).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        settings = override_settings(MEDIA_ROOT=self.media.name, IMAGE_DERIVATIVES_SYNC=True)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        category = Category.objects.create(name='Running')
+        self.brand = Brand.objects.create(name='Nike')
+        self.product = Product.objects.create(
+            name='Pegasus', description='Daily trainer', price=Decimal('130'),
+            category=category, brand=self.brand, stock=5)
+
+    def test_render_fits_box_without_upscaling(self):
+        rendered = render_variants(png_bytes((800, 600)))
+        self.assertEqual(
+            (rendered['thumbnail']['width'], rendered['thumbnail']['height']), (160, 120))
+        self.assertEqual(
+            (rendered['zoom']['width'], rendered['zoom']['height']), (800, 600))
+        self.assertTrue(rendered['card']['jpeg'].startswith(b'\xff\xd8'))
+
+    def test_variants_generated_on_upload_and_serialized(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(
+                product=self.product, is_primary=True,
+                image=SimpleUploadedFile('shoe.png', png_bytes()))
+        image.refresh_from_db()
+        self.assertEqual(image.variants['source'], image.image.name)
+        self.assertEqual(set(image.variants) - {'source'}, set(VARIANTS))
+
+        response = APIClient().get(f'/api/products/{self.product.slug}/')
+        variants = response.data['images'][0]['variants']
+        self.assertTrue(variants['card']['webp'].startswith('http://testserver/media/derivatives/'))
+        self.assertEqual(variants['card']['width'], 480)
+
+        response = APIClient().get('/api/products/')
+        listed = response.data['results'][0]['primary_image_variants']
+        self.assertEqual(listed['thumbnail'], variants['thumbnail'])
+
+    def test_backfill_command(self):
+        # Bulk-created rows skip the signals, as in the catalog import
+        name = default_storage.save('products/logo.png', ContentFile(png_bytes(mode='RGB')))
+        ProductImage.objects.bulk_create([ProductImage(product=self.product, image=name)])
+        Brand.objects.filter(pk=self.brand.pk).update(logo=name)
+
+        out = StringIO()
+        call_command('generate_image_variants', workers=1, stdout=out)
+        self.assertIn('products: 1 generated', out.getvalue())
+        self.assertIn('brands: 1 generated', out.getvalue())
+        self.assertEqual(ProductImage.objects.get().variants['source'], name)
+
+        out = StringIO()
+        call_command('generate_image_variants', workers=1, stdout=out)
+        self.assertIn('products: 0 generated', out.getvalue())
+
+
+class SparseFieldsetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(6)
+
+    def setUp(self):
+        cache.clear()
+        # The catalog version is read once per CATALOG_STATE_TTL, not per request
+        get_catalog_version()
+        self.client = APIClient()
+
+    def test_fields_and_expand(self):
+        response = self.client.get('/api/products/', {'fields': 'id,name,price,category'})
+        item = response.json()['results'][0]
+        self.assertEqual(list(item), ['id', 'name', 'price', 'category'])
+        self.assertIsInstance(item['category'], int)
+
+        response = self.client.get(
+            '/api/products/', {'fields': 'id,category', 'expand': 'category'})
+        category = response.json()['results'][0]['category']
+        self.assertEqual(category['product_count'], 2)
+
+        response = self.client.get(
+            f'/api/products/{self.catalog[0].slug}/', {'fields': 'name,sizes,brand'})
+        self.assertEqual(list(response.json()), ['name', 'brand', 'sizes'])
+
+    def test_trimmed_list_skips_joins_and_counts(self):
+        # count, products, images
+        with self.assertNumQueries(3):
+            self.client.get('/api/products/', {'fields': 'id,name,slug,price,primary_image'})
+
+    def test_fast_path_matches_model_serializer(self):
+        queries = [
+            {}, {'fields': 'id,slug,brand,final_price'},
+            {'fields': 'brand,discount_percentage', 'expand': 'brand'},
+            {'pagination': 'cursor', 'ordering': 'price'},
+            {'search': 'sneaker'},
+        ]
+        paths = ['/api/products/', '/api/products/on_sale/',
+                 f'/api/products/{self.catalog[0].slug}/related/']
+        for path in paths:
+            for params in queries:
+                with self.subTest(path=path, params=params):
+                    cache.clear()
+                    fast = self.client.get(path, params).json()
+                    cache.clear()
+                    with override_settings(PRODUCT_LIST_FAST_PATH=False):
+                        slow = self.client.get(path, params).json()
+                    self.assertEqual(fast, slow)
+
+
+class ResponseEncodingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(12)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_fast_renderer_matches_json_renderer(self):
+        data = {
+            'price': Decimal('129.90'),
+            'created_at': datetime(2025, 3, 1, 12, 30, 5, 123456, tzinfo=dt_timezone.utc),
+            'day': date(2025, 3, 1),
+            'histogram': {1: 0, 5: 3},
+            'label': gettext_lazy('Unisex'),
+            'id': uuid.UUID(int=1),
+            'text': 'café  ',
+            'items': [None, True, 1.5, ('a', 'b')],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_large_responses_are_compressed(self):
+        plain = self.client.get('/api/products/')
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        response = self.client.get('/api/products/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response['ETag'].startswith('W/'))
+        self.assertEqual(json.loads(gzip.decompress(response.content)), plain.json())
+
+    def test_html_is_not_compressed(self):
+        # The browsable API embeds a CSRF token (BREACH)
+        response = self.client.get(
+            '/api/products/', HTTP_ACCEPT='text/html', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+        self.assertNotIn('Content-Encoding', response)
+
+    @override_settings(COMPRESSION_MIN_SIZE=10 ** 6)
+    def test_small_responses_are_not_compressed(self):
+        response = self.client.get('/api/products/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_cache_hits_are_served_precompressed(self):
+        first = self.client.get('/api/products/featured/')
+        with self.assertNumQueries(0):
+            hit = self.client.get('/api/products/featured/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(hit['X-Cache'], 'HIT')
+        self.assertEqual(hit['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(hit.content)), first.json())
+
+
+class ProductBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(5)
+        cls.hidden = cls.catalog[4]
+        Product.objects.filter(pk=cls.hidden.pk).update(is_available=False)
+
+    def setUp(self):
+        cache.clear()
+        # The catalog version is read once per CATALOG_STATE_TTL, not per request
+        get_catalog_version()
+        self.client = APIClient()
+
+    def test_ids_in_requested_order_with_missing(self):
+        a, b, c = self.catalog[:3]
+        ids = f'{c.id},{a.id},999,{c.id},{self.hidden.id},{b.id}'
+        # products, images, category counts, brand counts
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/products/batch/', {'ids': ids})
+        data = response.json()
+        self.assertEqual([p['id'] for p in data['results']], [c.id, a.id, b.id])
+        self.assertEqual(data['missing'], [999, self.hidden.id])
+        self.assertFalse(Product.objects.filter(views_count__gt=0).exists())
+
+    def test_slugs(self):
+        slugs = f'{self.catalog[1].slug},nope,{self.catalog[0].slug}'
+        response = self.client.get('/api/products/batch/', {'slugs': slugs, 'fields': 'slug'})
+        self.assertEqual(response.json(), {
+            'results': [{'slug': self.catalog[1].slug}, {'slug': self.catalog[0].slug}],
+            'missing': ['nope'],
+        })
+
+    @override_settings(PRODUCT_BATCH_MAX_SIZE=2)
+    def test_invalid_requests(self):
+        for params in [{}, {'ids': '1', 'slugs': 'a'}, {'ids': '1,x'}, {'ids': '1,2,3'}]:
+            with self.subTest(params=params):
+                response = self.client.get('/api/products/batch/', params)
+                self.assertEqual(response.status_code, 400)
+
+
+class AsyncReadPathTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(14)
+
+    def setUp(self):
+        cache.clear()
+
+    def sync_get(self, path, params):
+        return APIClient().get(path, params).json()
+
+    async def assert_same_as_sync(self, path, params=None):
+        params = params or {}
+        response = await AsyncClient().get(f'/api/async{path}', params)
+        self.assertEqual(response.status_code, 200)
+        expected = await sync_to_async(self.sync_get)(f'/api{path}', params)
+        data = response.json()
+        for link in ('next', 'previous'):
+            if isinstance(data, dict) and data.get(link):
+                self.assertIn('/api/async/', data[link])
+                data[link] = data[link].replace('/api/async/', '/api/')
+        self.assertEqual(data, expected)
+        return data
+
+    async def test_product_list(self):
+        await self.assert_same_as_sync('/products/')
+        await self.assert_same_as_sync('/products/', {'page': 2, 'ordering': 'price'})
+        await self.assert_same_as_sync('/products/', {'search': 'sneaker', 'fields': 'id,name'})
+        data = await self.assert_same_as_sync(
+            '/products/', {'pagination': 'cursor', 'include_total': 'true'})
+        self.assertEqual(data['count'], 14)
+
+    async def test_product_detail(self):
+        slug = self.catalog[0].slug
+        await self.assert_same_as_sync(f'/products/{slug}/')
+        response = await AsyncClient().get('/api/async/products/missing/')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_categories_brands_reviews(self):
+        for path in ['/categories/', '/brands/', '/reviews/']:
+            with self.subTest(path=path):
+                await self.assert_same_as_sync(path)
+
+    async def test_cached_lists_with_a_database_cache(self):
+        # A synchronous call to this cache from the event loop would raise
+        # SynchronousOnlyOperation
+        caches = {**settings.CACHES, 'catalog': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'catalog_cache'}}
+        with override_settings(CACHES=caches, CATALOG_CACHE_ALIAS='catalog'):
+            await sync_to_async(call_command)('createcachetable', verbosity=0)
+            first = await AsyncClient().get('/api/async/categories/')
+            second = await AsyncClient().get('/api/async/categories/')
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(first.json(), second.json())
+
+    async def test_cart_count_without_session(self):
+        response = await AsyncClient().get('/api/async/cart/count/')
+        self.assertEqual(response.json(), {'count': 0})
+        self.assertNotIn('sessionid', response.cookies)
+
+
+class RoutingLog:
+    """Records where ``ReplicaRouter`` would send each read; routes nothing"""
+
+    def __init__(self):
+        self.reads = []
+
+    def db_for_read(self, model, **hints):
+        self.reads.append((model, ReplicaRouter().db_for_read(model, **hints)))
+        return None
+
+    def replica_reads(self, model):
+        return [alias for read, alias in self.reads if read is model and alias]
+
+
+class ReadReplicaRoutingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(3)
+
+    def setUp(self):
+        cache.clear()
+        self.log = RoutingLog()
+        # ``default`` stands in for the replica: the test database is shared
+        settings = override_settings(
+            DATABASE_REPLICAS=['default'],
+            DATABASE_ROUTERS=[self.log, 'sneakers_backend.replicas.ReplicaRouter'])
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_catalog_reads_use_replicas(self):
+        client = APIClient()
+        client.get('/api/products/')
+        client.get(f'/api/products/{self.catalog[0].slug}/')
+        self.assertEqual(set(self.log.replica_reads(Product)), {'default'})
+        client.get('/api/categories/')
+        self.assertTrue(self.log.replica_reads(Category))
+
+    def test_reads_stick_to_primary_after_a_write(self):
+        client = APIClient()
+        response = client.post('/api/cart/clear/')
+        self.assertIn(PIN_COOKIE, response.cookies)
+        client.get('/api/products/')
+        self.assertFalse(self.log.replica_reads(Product))
+
+        # Once the pin expires the replicas take over again
+        client.cookies[PIN_COOKIE] = '0'
+        client.get('/api/products/')
+        self.assertTrue(self.log.replica_reads(Product))
+
+    def test_writes_and_other_apps_use_primary(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_write(Product), 'default')
+        request = APIRequestFactory().get('/')
+        with replica_reads(request):
+            self.assertEqual(router.db_for_read(Product), 'default')
+            self.assertIsNone(router.db_for_read(User))
+        self.assertIsNone(router.db_for_read(Product))
+        with replica_reads(APIRequestFactory().post('/')):
+            self.assertIsNone(router.db_for_read(Product))
+
+    def test_no_replicas_configured(self):
+        with override_settings(DATABASE_REPLICAS=[]):
+            response = APIClient().post('/api/cart/clear/')
+            APIClient().get('/api/products/')
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        self.assertFalse(self.log.replica_reads(Product))
+
+    async def test_async_endpoints_use_replicas(self):
+        await AsyncClient().get('/api/async/products/')
+        self.assertTrue(self.log.replica_reads(Product))
+
+
+class ExplainEndpointsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(6)
+        Order.objects.create(
+            full_name='Test Buyer', email='buyer@example.com', phone='555',
+            address='1 Main St', city='Town', postal_code='00000',
+            country='US', subtotal=Decimal('100.00'), total=Decimal('110.00'))
+        User.objects.create_user('clerk', is_staff=True)
+
+    def test_endpoints_use_indexes(self):
+        out = StringIO()
+        call_command('explain_endpoints', '--strict', '--verbose-plans', stdout=out)
+        output = out.getvalue()
+        self.assertIn('No full table scans', output)
+        for index in ['product_available_recent', 'product_featured_recent',
+                      'product_on_sale_recent', 'review_approved_recent',
+                      'order_email_recent']:
+            with self.subTest(index=index):
+                self.assertIn(index, output)
+
+    def test_full_scans_are_flagged(self):
+        with self.assertRaisesMessage(CommandError, 'scan a whole table'):
+            call_command('explain_endpoints', '--strict', '--allow', stdout=StringIO())
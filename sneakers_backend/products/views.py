@@ -1,50 +1,96 @@
+import hashlib
 
 from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, AllowAny
-from django.db.models import Q, Count, Avg
+from django.conf import settings
+from django.db.models import F, Q, Count, Avg
 from django.contrib.auth.models import User
+from sneakers_backend.conditional import conditional_get, to_timestamp
+from sneakers_backend.pagination import CatalogPagination
+from sneakers_backend.replicas import ReplicaReadMixin
 from .models import Category, Brand, Product, Review
+from .cache import (
+    cached_catalog_response, get_catalog_modified, get_catalog_version
+)
+from .facets import ProductFacets, apply_facet_filters, selected_facets
+from .listing import ProductRowSerializer, row_queryset
+from .popularity import record_view
+from .search import InvertedIndexSearchFilter, product_index
 from .serializers import (
     CategorySerializer, BrandSerializer,
     ProductListSerializer, ProductDetailSerializer,
-    ReviewSerializer, CreateReviewSerializer
+    ReviewSerializer, CreateReviewSerializer, sparse_fieldset
 )
 
 
-class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
+class CategoryViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     """API endpoint for categories"""
-    queryset = Category.objects.filter(is_active=True)
+    queryset = Category.objects.filter(is_active=True).annotate(
+        product_count=Count('products')).order_by('name')
     serializer_class = CategorySerializer
+    pagination_class = CatalogPagination
     lookup_field = 'slug'
 
+    @cached_catalog_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
 
-class BrandViewSet(viewsets.ReadOnlyModelViewSet):
+class BrandViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     """API endpoint for brands"""
-    queryset = Brand.objects.filter(is_active=True)
+    queryset = Brand.objects.filter(is_active=True).annotate(
+        product_count=Count('products')).order_by('name')
     serializer_class = BrandSerializer
+    pagination_class = CatalogPagination
     lookup_field = 'slug'
 
+    @cached_catalog_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+
+class ProductOrderingFilter(filters.OrderingFilter):
+    """``?ordering=price`` sorts by the discounted price the shop shows"""
+    aliases = {'price': 'effective_price'}
 
-class ProductViewSet(viewsets.ReadOnlyModelViewSet):
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not ordering:
+            return ordering
+        return [
+            ('-' if field.startswith('-') else '')
+            + self.aliases.get(field.lstrip('-'), field.lstrip('-'))
+            for field in ordering
+        ]
+
+
+class ProductViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint for products
 
     Supports:
     - Filtering by category, brand, gender, price range
-    - Search by name, description
-    - Ordering by price, date, name
+    - Search by name, description, brand, category and color, ranked by
+      relevance with prefix matching and typo tolerance
+    - Ordering by price, date, name, rating
+    - Keyset pagination with ?pagination=cursor
+    - Sparse fieldsets with ?fields=id,name,price and ?expand=category,brand
     """
     queryset = Product.objects.filter(is_available=True).select_related(
         'category', 'brand'
-    ).prefetch_related('images', 'sizes', 'reviews')
+    ).prefetch_related('images')
 
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    # Search runs last so it can order by relevance when no ordering is given
+    filter_backends = [ProductOrderingFilter, InvertedIndexSearchFilter]
     search_fields = ['name', 'description',
                      'brand__name', 'category__name', 'color']
-    ordering_fields = ['price', 'created_at', 'name', 'views_count']
+    ordering_fields = ['price', 'created_at', 'name', 'views_count',
+                       'popularity_score', 'average_rating', 'review_count']
     ordering = ['-created_at']
+    pagination_class = CatalogPagination
     lookup_field = 'slug'
 
     def get_serializer_class(self):
@@ -52,36 +98,89 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
             return ProductDetailSerializer
         return ProductListSerializer
 
+    def list_validators(self, request, *args, **kwargs):
+        """Validators for a product list: the catalog version and query"""
+        version = get_catalog_version()
+        etag = hashlib.md5(
+            f'{version}:{request.get_full_path()}'.encode()).hexdigest()
+        return etag, get_catalog_modified()
+
+    def detail_validators(self, request, slug=None, **kwargs):
+        """
+        Validators for a product page from its updated_at and the catalog
+        version; the product's id is kept for ``finalize_response``
+        """
+        row = Product.objects.filter(
+            slug=slug, is_available=True
+        ).values_list('id', 'updated_at').first()
+        if row is None:
+            return None, None
+        product_id, updated_at = row
+        self.viewed_product_id = product_id
+        etag = f'product-{product_id}-{to_timestamp(updated_at)}-{get_catalog_version()}'
+        return etag, max(to_timestamp(updated_at), get_catalog_modified())
+
+    def use_row_serializer(self):
+        return getattr(settings, 'PRODUCT_LIST_FAST_PATH', True)
+
+    def product_list_data(self, products):
+        """
+        Product cards for a queryset or page, built from ``values()`` rows
+        on the fast path
+        """
+        if not self.use_row_serializer():
+            return self.get_serializer(products, many=True).data
+        return ProductRowSerializer(products, self.get_serializer_context()).data
+
+    def product_list_response(self, queryset):
+        if self.use_row_serializer():
+            queryset = row_queryset(
+                queryset, *sparse_fieldset(self.request.query_params))
+        return Response(self.product_list_data(queryset))
+
+    @conditional_get('list_validators')
+    def list(self, request, *args, **kwargs):
+        if not self.use_row_serializer():
+            return super().list(request, *args, **kwargs)
+
+        queryset = row_queryset(
+            self.filter_queryset(self.get_queryset()),
+            *sparse_fieldset(request.query_params))
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(self.product_list_data(queryset))
+        return self.get_paginated_response(self.product_list_data(page))
+
+    @conditional_get('detail_validators')
     def retrieve(self, request, *args, **kwargs):
-        """Increment view count when product is viewed"""
+        """Product detail; the view is counted by finalize_response"""
         instance = self.get_object()
-        instance.views_count += 1
-        instance.save(update_fields=['views_count'])
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        # Revalidated (304) page views count too; record_view never raises
+        product_id = getattr(self, 'viewed_product_id', None)
+        if self.action == 'retrieve' and product_id is not None \
+                and response.status_code in (200, 304):
+            record_view(product_id)
+        return response
+
     def get_queryset(self):
+        queryset = self.get_unfaceted_queryset()
+        return apply_facet_filters(
+            queryset, selected_facets(self.request.query_params))
+
+    def get_unfaceted_queryset(self):
+        """
+        Products with every filter applied except the category, brand,
+        gender and color facets, which are handled by ``apply_facet_filters``
+        """
         queryset = super().get_queryset()
-
-        # Filter by category slug
-        category = self.request.query_params.get('category')
-        if category:
-            queryset = queryset.filter(category__slug=category)
-
-        # Filter by brand slug
-        brand = self.request.query_params.get('brand')
-        if brand:
-            queryset = queryset.filter(brand__slug=brand)
-
-        # Filter by gender
-        gender = self.request.query_params.get('gender')
-        if gender:
-            queryset = queryset.filter(gender=gender)
-
-        # Filter by color
-        color = self.request.query_params.get('color')
-        if color:
-            queryset = queryset.filter(color__icontains=color)
+        if self.action == 'retrieve':
+            # Only the detail serializer renders sizes and reviews
+            queryset = queryset.prefetch_related('sizes', 'reviews')
 
         # Filter by featured
         featured = self.request.query_params.get('featured')
@@ -103,9 +202,14 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         max_price = self.request.query_params.get('max_price')
 
         if min_price:
-            queryset = queryset.filter(price__gte=min_price)
+            queryset = queryset.filter(effective_price__gte=min_price)
         if max_price:
-            queryset = queryset.filter(price__lte=max_price)
+            queryset = queryset.filter(effective_price__lte=max_price)
+
+        # Filter by minimum average rating
+        min_rating = self.request.query_params.get('min_rating')
+        if min_rating:
+            queryset = queryset.filter(average_rating__gte=min_rating)
 
         # Filter by availability
         in_stock = self.request.query_params.get('in_stock')
@@ -115,41 +219,88 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         return queryset
 
     @action(detail=False, methods=['get'])
+    @cached_catalog_response
     def featured(self, request):
         """Get featured products"""
         products = self.get_queryset().filter(is_featured=True)[:8]
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        return self.product_list_response(products)
 
     @action(detail=False, methods=['get'])
+    @cached_catalog_response
     def new_arrivals(self, request):
         """Get new arrival products"""
         products = self.get_queryset().filter(
             is_new_arrival=True).order_by('-created_at')[:8]
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        return self.product_list_response(products)
 
     @action(detail=False, methods=['get'])
+    @cached_catalog_response
     def best_sellers(self, request):
         """Get best selling products"""
         products = self.get_queryset().filter(
-            is_best_seller=True).order_by('-views_count')[:8]
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+            is_best_seller=True).order_by('-popularity_score')[:8]
+        return self.product_list_response(products)
 
     @action(detail=False, methods=['get'])
+    @cached_catalog_response
     def on_sale(self, request):
         """Get products on sale"""
-        products = self.get_queryset().exclude(discount_price__isnull=True)
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        products = self.get_queryset().filter(effective_price__lt=F('price'))
+        return self.product_list_response(products)
 
     @action(detail=False, methods=['get'])
+    @cached_catalog_response
     def trending(self, request):
         """Get trending products (most viewed recently)"""
-        products = self.get_queryset().order_by('-views_count')[:8]
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        products = self.get_queryset().order_by('-popularity_score')[:8]
+        return self.product_list_response(products)
+
+    def parse_batch_keys(self, request):
+        """
+        The ``ids`` or ``slugs`` of a batch request as ``(field, keys)``,
+        deduplicated in request order
+        """
+        ids = request.query_params.get('ids')
+        slugs = request.query_params.get('slugs')
+        if (ids is None) == (slugs is None):
+            raise ValidationError({'detail': 'Give either ids or slugs'})
+
+        field, raw = ('id', ids) if ids is not None else ('slug', slugs)
+        keys = list(dict.fromkeys(
+            key.strip() for key in raw.split(',') if key.strip()))
+        if field == 'id':
+            try:
+                keys = list(dict.fromkeys(int(key) for key in keys))
+            except ValueError:
+                raise ValidationError({'ids': 'Ids must be integers'})
+
+        limit = getattr(settings, 'PRODUCT_BATCH_MAX_SIZE', 200)
+        if len(keys) > limit:
+            raise ValidationError(
+                {field + 's': f'At most {limit} products per request'})
+        return field, keys
+
+    @action(detail=False, methods=['get'])
+    @conditional_get('list_validators')
+    def batch(self, request):
+        """
+        Product cards for ``?ids=3,1,2`` or ``?slugs=a,b`` in one query, in
+        the requested order. Unknown or unavailable products are listed in
+        ``missing``; views are not counted.
+        """
+        field, keys = self.parse_batch_keys(request)
+        queryset = self.get_queryset().filter(**{f'{field}__in': keys})
+        if self.use_row_serializer():
+            queryset = row_queryset(queryset, *sparse_fieldset(request.query_params))
+            found = {row[field]: row for row in queryset}
+        else:
+            found = {getattr(product, field): product for product in queryset}
+
+        products = [found[key] for key in keys if key in found]
+        return Response({
+            'results': self.product_list_data(products),
+            'missing': [key for key in keys if key not in found],
+        })
 
     @action(detail=True, methods=['get'])
     def related(self, request, slug=None):
@@ -158,43 +309,28 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         related = self.get_queryset().filter(
             Q(category=product.category) | Q(brand=product.brand)
         ).exclude(id=product.id)[:4]
-        serializer = self.get_serializer(related, many=True)
-        return Response(serializer.data)
+        return self.product_list_response(related)
 
     @action(detail=False, methods=['get'])
     def filters(self, request):
-        """Get available filter options"""
-        queryset = self.get_queryset()
-
-        filters_data = {
-            'categories': CategorySerializer(
-                Category.objects.filter(
-                    is_active=True, products__in=queryset).distinct(),
-                many=True,
-                context={'request': request}
-            ).data,
-            'brands': BrandSerializer(
-                Brand.objects.filter(
-                    is_active=True, products__in=queryset).distinct(),
-                many=True,
-                context={'request': request}
-            ).data,
-            'genders': list(queryset.values_list('gender', flat=True).distinct()),
-            'colors': list(queryset.values_list('color', flat=True).distinct()),
-            'price_range': {
-                'min': queryset.order_by('price').first().price if queryset.exists() else 0,
-                'max': queryset.order_by('-price').first().price if queryset.exists() else 0,
-            }
-        }
-
-        return Response(filters_data)
-
-
-class ReviewViewSet(viewsets.ModelViewSet):
+        """Get available filter options with per-value product counts"""
+        queryset = self.get_unfaceted_queryset()
+
+        search = request.query_params.get('search', '').strip()
+        if search:
+            queryset = queryset.filter(id__in=product_index.search(search))
+
+        facets = ProductFacets(
+            queryset, selected_facets(request.query_params))
+        return Response(facets.compute())
+
+
+class ReviewViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     """API endpoint for product reviews"""
     queryset = Review.objects.filter(
         is_approved=True).select_related('product', 'user')
     permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = CatalogPagination
 
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
@@ -0,0 +1,62 @@
+"""
+Helpers for the native async read endpoints (``/api/async/...``).
+
+DRF views are synchronous, so under ASGI every request to them holds a
+thread for its whole duration.  The async endpoints are plain Django
+coroutine views that reuse the DRF viewsets' query building, pagination
+classes and serializers, but run their queries through the async ORM and
+render with ``FastJSONRenderer`` directly.
+
+They are read-only and anonymous: ``request.user`` is never touched, since
+resolving it would load the session synchronously.
+"""
+
+import functools
+
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+
+from .renderers import FastJSONRenderer
+from .replicas import replica_reads
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    return HttpResponse(
+        FastJSONRenderer().render(data), status=status,
+        content_type=FastJSONRenderer.media_type)
+
+
+def async_api_view(view):
+    """
+    Wrap a ``view(request, *args, **kwargs)`` coroutine taking a DRF
+    ``Request``: GET only, and DRF exceptions become JSON error responses
+    """
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return json_response(
+                {'detail': f'Method "{request.method}" not allowed.'},
+                status=status.HTTP_405_METHOD_NOT_ALLOWED)
+        try:
+            with replica_reads(request):
+                return await view(Request(request), *args, **kwargs)
+        except APIException as exc:
+            # As DRF's exception handler
+            if isinstance(exc.detail, (list, dict)):
+                data = exc.detail
+            else:
+                data = {'detail': exc.detail}
+            return json_response(data, status=exc.status_code)
+
+    return wrapper
+
+
+def viewset_for(viewset_class, request, action, **kwargs):
+    """A viewset instance set up as the router would, for its query logic"""
+    view = viewset_class(action=action, kwargs=kwargs, format_kwarg=None)
+    view.request = request
+    view.args = ()
+    return view
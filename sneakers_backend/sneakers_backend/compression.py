@@ -0,0 +1,155 @@
+"""
+Response compression for the API.
+
+``CompressionMiddleware`` encodes response bodies with brotli (when the
+``brotli`` package is installed and the client accepts it) or gzip, once
+they reach ``COMPRESSION_MIN_SIZE`` bytes; smaller bodies gain nothing
+from it.  Responses that already carry a ``Content-Encoding`` pass
+through untouched, which is how precompressed bodies from
+``precompressed_response`` (see ``products.cache``) skip the work.
+
+Only JSON and static asset types are compressed.  HTML pages (the admin,
+the browsable API) carry CSRF tokens next to attacker-influenced text, and
+compressing them would expose the tokens to BREACH.
+"""
+
+import gzip
+import re
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+
+COMPRESSIBLE_TYPES = re.compile(
+    r'^(application/(json|javascript|[\w.+-]*\+json)|text/(css|javascript))\b', re.I)
+_ACCEPT_ENCODING = re.compile(r'\s*([\w*]+)\s*(?:;\s*q\s*=\s*([\d.]+))?')
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def available_encodings():
+    """Encodings this process can produce, preferred first"""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=_setting('COMPRESSION_BROTLI_QUALITY', 5))
+    # mtime=0 keeps the output, and therefore ETags, deterministic
+    return gzip.compress(body, compresslevel=_setting('COMPRESSION_GZIP_LEVEL', 6), mtime=0)
+
+
+def compress_variants(body):
+    """
+    ``{encoding: bytes}`` for every available encoding worth sending,
+    always including the uncompressed ``identity`` body.
+    """
+    variants = {'identity': body}
+    if len(body) < _setting('COMPRESSION_MIN_SIZE', 1024):
+        return variants
+    for encoding in available_encodings():
+        compressed = compress(body, encoding)
+        if len(compressed) < len(body):
+            variants[encoding] = compressed
+    return variants
+
+
+def accepted_encodings(request):
+    accepted = {}
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        match = _ACCEPT_ENCODING.match(part)
+        if match:
+            try:
+                quality = float(match.group(2)) if match.group(2) else 1.0
+            except ValueError:
+                continue
+            accepted[match.group(1).lower()] = quality
+    return accepted
+
+
+def choose_encoding(request, offered):
+    """The first of ``offered`` the client accepts, or None"""
+    accepted = accepted_encodings(request)
+    for encoding in offered:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def _is_compressible(response):
+    return (
+        not response.streaming
+        and response.status_code not in (204, 206, 304)
+        and not response.has_header('Content-Encoding')
+        and COMPRESSIBLE_TYPES.match(response.get('Content-Type', ''))
+    )
+
+
+def _set_encoding(response, encoding, body):
+    response.content = body
+    response['Content-Length'] = str(len(body))
+    response['Content-Encoding'] = encoding
+    # A compressed body is a different byte sequence: make strong ETags weak
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = 'W/' + etag
+
+
+def precompressed_response(request, variants, content_type, status=200):
+    """Build a response from ``compress_variants`` output for this client"""
+    encoding = choose_encoding(
+        request, [e for e in available_encodings() if e in variants])
+    response = HttpResponse(variants['identity'], content_type=content_type, status=status)
+    if encoding is not None:
+        _set_encoding(response, encoding, variants[encoding])
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with brotli or gzip above a size threshold.
+
+    Runs natively in both sync and async request handling, so async views
+    are not pushed onto a thread for it.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.compress_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress_response(request, await self.get_response(request))
+
+    def compress_response(self, request, response):
+        if not _is_compressible(response):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if len(response.content) < _setting('COMPRESSION_MIN_SIZE', 1024):
+            return response
+        encoding = choose_encoding(request, available_encodings())
+        if encoding is None:
+            return response
+
+        compressed = compress(response.content, encoding)
+        if len(compressed) < len(response.content):
+            _set_encoding(response, encoding, compressed)
+        return response
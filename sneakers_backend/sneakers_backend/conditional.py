@@ -0,0 +1,68 @@
+"""
+HTTP conditional GET support for DRF viewset methods.
+
+Views declare a validator method that returns ``(etag, last_modified)``
+from cheap sources (an ``updated_at`` column, a version counter), and
+``conditional_get`` answers ``If-None-Match`` / ``If-Modified-Since``
+with ``304 Not Modified`` before the view queries or serializes anything.
+"""
+
+import functools
+from datetime import datetime, timezone
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def to_timestamp(value):
+    """Unix timestamp for a datetime or number, or None"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return float(value)
+
+
+def conditional_get(validator_name):
+    """
+    Decorate a viewset method with ETag / Last-Modified handling.
+
+    ``validator_name`` names a view method taking the same arguments as the
+    decorated one and returning ``(etag, last_modified)``; either may be
+    None, and returning ``(None, None)`` skips conditional handling.
+    """
+
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_method(self, request, *args, **kwargs)
+
+            etag, last_modified = getattr(self, validator_name)(
+                request, *args, **kwargs)
+            if etag is not None:
+                etag = quote_etag(str(etag))
+            last_modified = to_timestamp(last_modified)
+            if last_modified is not None:
+                last_modified = int(last_modified)
+            if etag is None and last_modified is None:
+                return view_method(self, request, *args, **kwargs)
+
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view_method(self, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+
+            if etag is not None:
+                response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,295 @@
+"""
+Pagination classes shared by the catalog, review and order endpoints.
+
+``KeysetPagination`` is the cursor mode: each page is fetched with a
+``WHERE (ordering values) > (last row's values)`` predicate instead of an
+``OFFSET``, and the primary key is always appended to the ordering as a
+tiebreaker so rows with equal prices or names are never skipped or
+repeated.  Page 500 costs the same as page 1 and no ``COUNT(*)`` is run
+unless the client asks for a total.
+
+``CatalogPagination`` keeps page-number pagination as the default and
+switches to keyset pagination when the request carries ``?pagination=cursor``
+or a ``cursor``.
+
+Both have an ``apaginate_queryset`` coroutine for the async views, which
+runs the same queries through the async ORM.
+"""
+
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import InvalidPage, Page
+from django.db.models import GeneratedField, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination over the queryset's own ordering.
+
+    The ordering is read from the queryset after filtering, so it follows
+    ``OrderingFilter`` and any view-level ``order_by``.  Only plain field
+    names are supported; ordering fields must not be nullable.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    total_query_param = 'include_total'
+    # Totals are counted up to this many rows and reported as approximate beyond
+    max_total_count = 1000
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.page_size = api_settings.PAGE_SIZE
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_ordering(self, queryset):
+        ordering = list(queryset.query.order_by) or list(
+            queryset.model._meta.ordering)
+        ordering = [f for f in ordering if isinstance(f, str) and f not in ('?',)]
+        pk_name = queryset.model._meta.pk.name
+        if not any(f.lstrip('-') in ('pk', pk_name) for f in ordering):
+            descending = ordering[0].startswith('-') if ordering else True
+            ordering.append(('-' if descending else '') + pk_name)
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_queryset = self._page_queryset(queryset, request)
+        return self._set_page(list(page_queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """``paginate_queryset`` with the async ORM"""
+        page_queryset = self._page_queryset(queryset, request)
+        rows = [row async for row in page_queryset]
+        if self._wants_total():
+            self.total = await self._total_queryset().acount()
+        return self._set_page(rows)
+
+    def _page_queryset(self, queryset, request):
+        """The page plus one row, seeking past the cursor position"""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.base_queryset = queryset
+        self.total = None
+
+        self.cursor = self.decode_cursor(request)
+        self.reverse = self.cursor is not None and self.cursor['reverse']
+
+        ordering = self.ordering
+        if self.reverse:
+            ordering = [_flip(f) for f in ordering]
+
+        queryset = queryset.order_by(*ordering)
+        if self.cursor is not None:
+            queryset = queryset.filter(
+                self._seek_filter(queryset.model, ordering, self.cursor['position']))
+        return queryset[:self.page_size + 1]
+
+    def _set_page(self, rows):
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+
+        self.page = rows
+        if self.reverse:
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+        return rows
+
+    def _seek_filter(self, model, ordering, position):
+        """(a, b, pk) > (va, vb, vpk), expanded to OR-of-ANDs"""
+        condition = Q()
+        for i, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            clause = Q(**{f'{name}__{lookup}': position[i]})
+            for prev_field, prev_value in zip(ordering[:i], position[:i]):
+                clause &= Q(**{prev_field.lstrip('-'): prev_value})
+            condition |= clause
+        return condition
+
+    def _position(self, instance):
+        # Pages hold model instances, or dicts for values() querysets
+        if isinstance(instance, dict):
+            pk_name = self.base_queryset.model._meta.pk.name
+            get = lambda name: instance[pk_name if name == 'pk' else name]
+        else:
+            get = lambda name: getattr(instance, name)
+        return [_encode_value(get(f.lstrip('-'))) for f in self.ordering]
+
+    def encode_cursor(self, instance, reverse):
+        payload = {'p': self._position(instance), 'r': int(reverse)}
+        data = json.dumps(payload, separators=(',', ':')).encode()
+        token = base64.urlsafe_b64encode(data).decode().rstrip('=')
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+            payload = json.loads(data)
+            position = payload['p']
+            reverse = bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        model = self.base_queryset.model
+        values = []
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            try:
+                model_field = model._meta.get_field(
+                    model._meta.pk.name if name == 'pk' else name)
+                if isinstance(model_field, GeneratedField):
+                    model_field = model_field.output_field
+                value = model_field.to_python(value)
+            except FieldDoesNotExist:
+                pass  # annotation such as search_rank
+            except Exception:
+                raise NotFound(self.invalid_cursor_message)
+            values.append(value)
+        return {'position': values, 'reverse': reverse}
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def _wants_total(self):
+        wants_total = self.request.query_params.get(self.total_query_param, '')
+        return wants_total.lower() in ['true', '1', 'yes']
+
+    def _total_queryset(self):
+        return self.base_queryset.order_by()[:self.max_total_count + 1]
+
+    def get_total(self):
+        """Exact total up to max_total_count, flagged approximate beyond it"""
+        count = self.total
+        if count is None:
+            count = self._total_queryset().count()
+        if count > self.max_total_count:
+            return self.max_total_count, True
+        return count, False
+
+    def get_paginated_response(self, data):
+        fields = [
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+        ]
+        if self._wants_total():
+            count, approximate = self.get_total()
+            fields += [('count', count), ('count_is_approximate', approximate)]
+        fields.append(('results', data))
+        return Response(OrderedDict(fields))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count': {'type': 'integer'},
+                'count_is_approximate': {'type': 'boolean'},
+                'results': schema,
+            },
+        }
+
+
+class CatalogPagination(PageNumberPagination):
+    """
+    Page-number pagination by default; keyset pagination on request.
+
+    ``?pagination=cursor`` starts a cursor walk, and the ``next``/``previous``
+    links it returns carry the ``cursor`` parameter that keeps it going.
+    """
+    mode_query_param = 'pagination'
+    cursor_class = KeysetPagination
+    delegate = None
+
+    def use_cursor(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or self.cursor_class.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request):
+            self.delegate = self.cursor_class()
+            return self.delegate.paginate_queryset(queryset, request, view)
+        self.delegate = None
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """``paginate_queryset`` with the async ORM"""
+        if self.use_cursor(request):
+            self.delegate = self.cursor_class()
+            return await self.delegate.apaginate_queryset(queryset, request, view)
+        self.delegate = None
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        # Count asynchronously; Paginator caches ``count`` as a property
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            number = paginator.validate_number(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)))
+        bottom = (number - 1) * paginator.per_page
+        rows = [row async for row in queryset[bottom:bottom + paginator.per_page]]
+        self.page = Page(rows, number, paginator)
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        return rows
+
+    def get_paginated_response(self, data):
+        if self.delegate is not None:
+            return self.delegate.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+def _flip(field):
+    return field[1:] if field.startswith('-') else '-' + field
+
+
+def _encode_value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
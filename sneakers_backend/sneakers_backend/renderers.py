@@ -0,0 +1,43 @@
+"""
+JSON renderer backed by orjson, when it is installed.
+
+``FastJSONRenderer`` produces the same JSON as DRF's ``JSONRenderer`` (the
+same ``Decimal``, datetime, UUID and lazy string handling, compact
+separators, UTF-8 output) several times faster.  Without orjson, or when
+the client asks for indented output (the browsable API does), it falls
+back to DRF's renderer.
+"""
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+# orjson encodes str, int, float, bool, None, dict, list and tuple itself and
+# hands everything else (Decimal, datetime, UUID, lazy strings...) to DRF's
+# own encoder, so the output matches JSONRenderer
+_default = JSONEncoder().default
+
+
+class FastJSONRenderer(JSONRenderer):
+    """Drop-in ``JSONRenderer`` that encodes with orjson when available"""
+
+    options = (
+        (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+        if orjson is not None else 0
+    )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = orjson.dumps(data, default=_default, option=self.options)
+        # As JSONRenderer: keep the output valid inside <script> tags
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
@@ -0,0 +1,116 @@
+"""
+Read replicas for catalog traffic.
+
+``ReplicaRouter`` sends reads of the catalog apps to one of the aliases in
+``DATABASE_REPLICAS``, but only while a request has opted in through
+``replica_reads`` (the ``ReplicaReadMixin`` viewsets do so for GET and
+HEAD, as do the ``/api/async/`` endpoints).  Everything else, and every
+write, uses ``default``.
+
+Read-your-writes: ``ReplicaPinMiddleware`` sets a short-lived cookie after
+any successful unsafe request, and while it is present the client's
+catalog reads stay on the primary, for ``REPLICA_PIN_SECONDS`` (long
+enough to cover replication lag).
+
+With no replicas configured the router never routes anything.
+"""
+
+import contextlib
+import contextvars
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+
+PIN_COOKIE = 'primary_pin'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def replicas():
+    return list(_setting('DATABASE_REPLICAS', []))
+
+
+def is_pinned(request):
+    """Whether this client wrote recently and must read from the primary"""
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+@contextlib.contextmanager
+def replica_reads(request):
+    """Route catalog reads to a replica for the duration, when allowed"""
+    allowed = (
+        request.method in SAFE_METHODS and replicas() and not is_pinned(request)
+    )
+    token = _replica_reads.set(bool(allowed))
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReplicaRouter:
+    """Catalog reads inside ``replica_reads`` go to a random replica"""
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get():
+            return None
+        if model._meta.app_label not in _setting('REPLICA_ROUTED_APPS', ['products']):
+            return None
+        aliases = replicas()
+        return random.choice(aliases) if aliases else None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {'default', *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaReadMixin:
+    """Viewset mixin serving safe requests from the read replicas"""
+
+    def dispatch(self, request, *args, **kwargs):
+        with replica_reads(request):
+            return super().dispatch(request, *args, **kwargs)
+
+
+class ReplicaPinMiddleware:
+    """Pin a client's reads to the primary for a while after it writes"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.pin(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.pin(request, await self.get_response(request))
+
+    def pin(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400 and replicas():
+            seconds = _setting('REPLICA_PIN_SECONDS', 5)
+            response.set_cookie(
+                PIN_COOKIE, f'{time.time() + seconds:.3f}', max_age=seconds,
+                httponly=True, samesite='Lax')
+        return response
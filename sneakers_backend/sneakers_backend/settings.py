@@ -39,6 +39,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'sneakers_backend.compression.CompressionMiddleware',
+    'sneakers_backend.replicas.ReplicaPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -73,9 +75,35 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts, so concurrent
+            # writers queue for up to ``timeout`` seconds instead of failing
+            # when a read-then-write transaction cannot upgrade its lock
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # A file rather than the shared-cache in-memory database, whose
+        # table locks fail concurrent writers at once (see the cart
+        # concurrency tests)
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# Read replicas for catalog GETs (see sneakers_backend/replicas.py). To try
+# it locally, copy db.sqlite3 and point SQLITE_REPLICA at the copy.
+if os.environ.get('SQLITE_REPLICA'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / os.environ['SQLITE_REPLICA'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['sneakers_backend.replicas.ReplicaRouter']
+
+# Seconds a client's reads stay on the primary after it writes
+REPLICA_PIN_SECONDS = 5
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -125,10 +153,63 @@ CORS_ALLOWED_ORIGINS = [
 CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOW_ALL_ORIGINS = False  # Change to True for development only
 
-# Session settings for cart
+# Sessions (the admin's; guest carts have their own cookie, see cart.identity)
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 SESSION_COOKIE_AGE = 86400  # 24 hours
-SESSION_SAVE_EVERY_REQUEST = True
+SESSION_SAVE_EVERY_REQUEST = False
+
+# Cache
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sneakers-default',
+    }
+}
+
+# Anonymous catalog response cache (see products.cache)
+CATALOG_CACHE_TIMEOUT = 300  # seconds before a cached response is rebuilt
+CATALOG_CACHE_GRACE = 30  # seconds a stale response is served during a rebuild
+CATALOG_STATE_TTL = 5  # seconds each process reuses the catalog version read from the database
+
+# Product view counting (see products.popularity)
+VIEW_COUNT_FLUSH_INTERVAL = 10  # seconds between batched view count writes
+VIEW_COUNT_FLUSH_THRESHOLD = 500  # flush early once this many views are buffered
+TRENDING_HALF_LIFE_HOURS = 72  # a view's weight in the trending score halves every 3 days
+
+# Cart identity (see cart.identity): 'cookie', a signed cookie holding the
+# cart key, or 'session', the Django session (needs SESSION_SAVE_EVERY_REQUEST
+# to keep the session alive, which writes on every request)
+CART_IDENTITY = 'cookie'
+CART_COOKIE_NAME = 'cart'
+CART_COOKIE_AGE = 14 * 86400  # seconds a cart cookie lasts after the last cart change
+
+# Cart storage (see cart.storage): 'cart.storage.DatabaseCartStorage' or
+# 'cart.storage.CacheCartStorage', which keeps guest carts in the cache.
+# CART_CACHE_ALIAS must then name a cache shared by all worker processes;
+# the local-memory 'default' cache only suits a single process
+CART_STORAGE = 'cart.storage.DatabaseCartStorage'
+CART_CACHE_ALIAS = 'default'
+CART_PERSIST_INTERVAL = 300  # seconds between write-behind flushes of cached carts; None: only at checkout
+CART_BATCH_MAX_OPERATIONS = 50  # most operations /api/cart/batch/ applies per request
+
+# Purging abandoned carts and expired sessions (see cart.purge and
+# manage.py purge_carts)
+CART_PURGE_AFTER = CART_COOKIE_AGE  # seconds a cart may sit unchanged
+CART_PURGE_BATCH_SIZE = 500  # rows deleted per transaction
+CART_PURGE_INTERVAL = None  # seconds between purges in each process; None: only by command
+
+# Most products /api/products/batch/ resolves per request
+PRODUCT_BATCH_MAX_SIZE = 200
+
+# Image derivatives (see products.images)
+IMAGE_DERIVATIVE_WORKERS = 2  # processes resizing uploaded images
+IMAGE_DERIVATIVES_SYNC = False  # resize inline on save instead of in the pool
+
+# Response compression (see sneakers_backend.compression); brotli is used
+# when the brotli package is installed
+COMPRESSION_MIN_SIZE = 1024  # bytes; smaller responses are sent as they are
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
 
 # REST Framework Settings
 REST_FRAMEWORK = {
@@ -137,6 +218,11 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 12,
+    # orjson-backed when orjson is installed, DRF's JSONRenderer otherwise
+    'DEFAULT_RENDERER_CLASSES': [
+        'sneakers_backend.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
         'rest_framework.filters.SearchFilter',
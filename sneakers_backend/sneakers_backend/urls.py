@@ -9,6 +9,9 @@ urlpatterns = [
     path('api/', include('products.urls')),
     path('api/cart/', include('cart.urls')),
     path('api/orders/', include('orders.urls')),
+    # Native async read endpoints for ASGI deployments
+    path('api/async/', include('products.async_urls')),
+    path('api/async/cart/', include('cart.async_urls')),
     
 ]
 